@@ -0,0 +1,269 @@
+# Resumen materializado del saldo de cada estudiante.
+#
+# Cada servicio mantiene su parte en la colección `balances` de su base, con
+# un documento por estudiante (_id = student_id) que se actualiza con $inc en
+# cada escritura: aranceles suma lo facturado (`billed`) y pagos lo pagado
+# (`paid`), en total y por semestre y tipo. GET /{student_id}/balance del
+# servicio de aranceles lee los dos documentos por _id.
+#
+# Si el resumen se desalinea (p. ej. el proceso cae entre la escritura del
+# elemento y la del resumen sin transacciones) se recalcula desde los
+# elementos, con los servicios en marcha:
+#
+#     python -m app.balance.main
+#     python -m app.balance.main --student 123
+#
+# Cada $inc sube `version` en el documento del estudiante; el recálculo
+# sólo reemplaza un resumen si su versión sigue siendo la que leyó antes de
+# agregar los elementos, y repite los estudiantes que cambiaron entremedio.
+import argparse
+import collections
+from datetime import datetime
+from pymongo import DeleteOne, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from ..mongo.main import AsyncCollection, get_client
+from ..mongo.items import ItemStore
+
+
+# Veces que el recálculo repite los estudiantes con escrituras concurrentes
+REBUILD_RETRIES = 3
+
+
+class RebuildConflict(Exception):
+    pass
+
+
+def _key(value):
+    # Semestre y tipo se usan como nombres de campo
+    return str(value).replace(".", "_").replace("$", "_")
+
+
+class BalanceView:
+    """
+    Totales de `field` ("billed" o "paid") por estudiante a partir de los
+    elementos de `store` que no están inactivados.
+    """
+
+    def __init__(self, database, field, store=None):
+        self.field = field
+        self.store = store
+        self.collection = get_client()[database]["balances"]
+        self.async_collection = AsyncCollection(database, "balances")
+
+    @staticmethod
+    def contribution(item):
+        """(semestre, tipo, monto) con que un elemento suma al saldo."""
+        if not item or item.get("status") == "inactived":
+            return None
+        return (_key(item.get("semester")), _key(item.get("type")),
+                item.get("amount") or 0)
+
+    def update(self, before, after):
+        """
+        Update del resumen para un elemento que pasó de `before` a `after`
+        (None si no existía o si se borró), o None si no cambia nada.
+        """
+        increments = collections.defaultdict(float)
+        for item, sign in ((before, -1), (after, 1)):
+            contribution = self.contribution(item)
+            if contribution is None:
+                continue
+            semester, item_type, amount = contribution
+            increments[self.field] += sign * amount
+            increments[f"semesters.{semester}.{item_type}.{self.field}"] += \
+                sign * amount
+        increments = {key: value for key, value in increments.items()
+                      if value}
+        if not increments:
+            return None
+        return {"$inc": {**increments, "version": 1},
+                "$set": {"updated_at": datetime.now()}}
+
+    def ops(self, student_id, before=None, after=None):
+        update = self.update(before, after)
+        if update is None:
+            return []
+        return [UpdateOne({"_id": student_id}, update, upsert=True)]
+
+    def apply(self, student_id, before=None, after=None, session=None):
+        ops = self.ops(student_id, before, after)
+        if ops:
+            self.collection.bulk_write(ops, session=session)
+
+    async def apply_async(self, student_id, before=None, after=None,
+                          session=None):
+        ops = self.ops(student_id, before, after)
+        if ops:
+            await self.async_collection.bulk_write(ops, session=session)
+
+    def find(self, student_id):
+        return self.collection.find_one({"_id": student_id})
+
+    async def find_async(self, student_id):
+        return await self.async_collection.find_one({"_id": student_id})
+
+    def _pipeline(self, student_ids):
+        store = self.store
+        pipeline = [{"$match": {"student_id": {"$in": student_ids}}
+                     if student_ids is not None else {}}]
+        if store.embedded:
+            pipeline.append({"$unwind": f"${store.array}"})
+        pipeline += [
+            {"$match": {store.path("status"): {"$ne": "inactived"}}},
+            {"$group": {
+                "_id": {"student_id": "$student_id",
+                        "semester": f"${store.path('semester')}",
+                        "type": f"${store.path('type')}"},
+                "amount": {"$sum": f"${store.path('amount')}"},
+            }},
+        ]
+        return pipeline
+
+    def rebuild(self, student_id=None, batch_size=500,
+                retries=REBUILD_RETRIES):
+        """
+        Recalcula el resumen desde los elementos (de un estudiante o de
+        todos) y devuelve cuántos documentos escribió. Los resúmenes de
+        estudiantes sin elementos activos se borran. Se puede correr con
+        escrituras en curso: los estudiantes cuyo resumen cambió durante el
+        recálculo se recalculan de nuevo, hasta `retries` veces; si siguen
+        cambiando lanza RebuildConflict.
+        """
+        student_ids = [student_id] if student_id is not None else None
+        written = 0
+        for _ in range(retries + 1):
+            count, conflicts = self._rebuild(student_ids, batch_size)
+            written += count
+            if not conflicts:
+                return written
+            student_ids = sorted(conflicts)
+        raise RebuildConflict(
+            f"{len(student_ids)} estudiantes cambiaron durante el recálculo "
+            f"de {self.collection.database.name}.balances: {student_ids[:10]}")
+
+    def _rebuild(self, student_ids, batch_size):
+        """Una pasada: (documentos escritos, estudiantes en conflicto)."""
+        started = datetime.now()
+        # Versiones antes de leer los elementos: una escritura posterior
+        # la cambia y el reemplazo de ese estudiante no se aplica
+        versions = {
+            doc["_id"]: doc.get("version", 0)
+            for doc in self.collection.find(
+                {"_id": {"$in": student_ids}} if student_ids is not None
+                else {}, {"version": 1})}
+        balances = {}
+        for row in self.store.collection.aggregate(
+                self._pipeline(student_ids), allowDiskUse=True):
+            key = row["_id"]
+            balance = balances.setdefault(key["student_id"], {
+                self.field: 0, "semesters": {}})
+            balance[self.field] += row["amount"]
+            balance["semesters"].setdefault(
+                _key(key.get("semester")), {})[_key(key.get("type"))] = {
+                    self.field: row["amount"]}
+
+        def unchanged(sid):
+            version = versions.get(sid, 0)
+            # Sin documento (o anterior a `version`): campo ausente
+            return {"_id": sid, "version": version} if version \
+                else {"_id": sid, "version": {"$in": [None, 0]}}
+
+        # Si la versión cambió el upsert choca con el _id existente y el
+        # estudiante queda en conflicto
+        replaced = list(balances)
+        ops = [ReplaceOne(unchanged(sid),
+                          {**balances[sid], "version": versions.get(sid, 0) + 1,
+                           "rebuilt_at": started, "updated_at": started},
+                          upsert=True)
+               for sid in replaced]
+        written = 0
+        conflicts = set()
+        for start in range(0, len(ops), batch_size):
+            try:
+                result = self.collection.bulk_write(
+                    ops[start:start + batch_size], ordered=False)
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                if any(error.get("code") != 11000 for error in errors):
+                    raise
+                conflicts.update(replaced[start + error["index"]]
+                                 for error in errors)
+                written += e.details.get("nUpserted", 0) + \
+                    e.details.get("nMatched", 0)
+            else:
+                written += result.upserted_count + result.matched_count
+
+        # Estudiantes sin elementos activos; si su resumen cambió no se
+        # borra y se revisa en la próxima pasada
+        deleted = [sid for sid in versions if sid not in balances]
+        for start in range(0, len(deleted), batch_size):
+            batch = deleted[start:start + batch_size]
+            self.collection.bulk_write(
+                [DeleteOne(unchanged(sid)) for sid in batch], ordered=False)
+            conflicts.update(doc["_id"] for doc in self.collection.find(
+                {"_id": {"$in": batch}}, {"_id": 1}))
+        return written, conflicts
+
+
+def balance_summary(student_id, billed, paid):
+    """Saldo de un estudiante a partir de los resúmenes de ambos servicios."""
+    billed = billed or {}
+    paid = paid or {}
+    semesters = []
+    for semester in sorted(set(billed.get("semesters", {}))
+                           | set(paid.get("semesters", {}))):
+        billed_types = billed.get("semesters", {}).get(semester, {})
+        paid_types = paid.get("semesters", {}).get(semester, {})
+        for item_type in sorted(set(billed_types) | set(paid_types)):
+            billed_amount = billed_types.get(item_type, {}).get("billed", 0)
+            paid_amount = paid_types.get(item_type, {}).get("paid", 0)
+            if not billed_amount and not paid_amount:
+                # Quedó en cero tras inactivar sus elementos
+                continue
+            semesters.append({
+                "semester": semester,
+                "type": item_type,
+                "billed": billed_amount,
+                "paid": paid_amount,
+                "outstanding": billed_amount - paid_amount,
+            })
+    updated = [doc["updated_at"] for doc in (billed, paid)
+               if doc.get("updated_at")]
+    return {
+        "student_id": student_id,
+        "billed": billed.get("billed", 0),
+        "paid": paid.get("paid", 0),
+        "outstanding": billed.get("billed", 0) - paid.get("paid", 0),
+        "semesters": semesters,
+        "updated_at": max(updated) if updated else None,
+    }
+
+
+def views():
+    return [
+        BalanceView("debt", "billed",
+                    ItemStore("debt", "debt", "debts", "debt_id", "debts")),
+        BalanceView("payment", "paid",
+                    ItemStore("payment", "payments", "payments", "payment_id",
+                              "payment_items")),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Recalcula el resumen de saldos desde aranceles y pagos")
+    parser.add_argument("--student", default=None,
+                        help="sólo este estudiante")
+    args = parser.parse_args()
+
+    for view in views():
+        try:
+            written = view.rebuild(args.student)
+        except RebuildConflict as e:
+            raise SystemExit(f"{e}; repetir con menos escrituras en curso")
+        print(f"{view.collection.database.name}.balances ({view.field}): "
+              f"{written} estudiantes")
+
+
+if __name__ == "__main__":
+    main()
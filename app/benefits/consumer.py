@@ -1,15 +1,13 @@
-import json
 import os
-import time
-from fastapi import FastAPI
-import pika
-from pika.exchange_type import ExchangeType
-import requests
 import logging
-from ..rabbit.main import Consumer
+from ..rabbit.main import (CONSUMER_RUNTIME, CONSUMER_TRANSPORT, Consumer,
+                           EventAction, EventCallback)
+from ..rabbit.async_consumer import AsyncConsumer
+from ..migrations.main import require_unique_indexes
+from ..rabbit.dedup import DedupStore
+from . import main as benefits_service
 
 rabbitmq_url = os.getenv("RABBITMQ_URL")
-RETRY_DELAY = 5
 
 
 logging.basicConfig(level=logging.INFO)
@@ -17,16 +15,12 @@ logger = logging.getLogger("Consumer_Benefit")
 url = f"http://benefits-container:8001/api/v1/"
 
 
-def callback(ch, method, properties, body):
-
-    message = json.loads(body)
-
-    event = method.routing_key
+def actions(event, message):
     _, benefit_id, action = event.split('.')
+    student_id = message.get("student_id")
+    data = message.get("data")
 
     if action == "created":
-        student_id = message.get("student_id")
-        data = message.get("data")
         body = {
             "amount": data["amount"],
             "benefit_id": data["benefit_id"],
@@ -35,19 +29,14 @@ def callback(ch, method, properties, body):
             "name": data["name"],
             "start_date": data["start_date"],
         }
-        try:
-            response = requests.post(
-                url+f"{student_id}/benefits", json=body)
-            response.raise_for_status()
-            logger.info("✅ Beneficio registrado")
-        except requests.exceptions.RequestException as e:
-            logger.info("❌ Error al registrar el beneficio:", e)
-
-        logger.info("[x] benefit created")
+        return [EventAction(
+            benefits_service.register_benefit,
+            (student_id, benefits_service.Benefit(**body)),
+            "POST", f"{student_id}/benefits", body,
+            success="✅ Beneficio registrado",
+            error="❌ Error al registrar el beneficio")]
 
-    elif action == "updated":
-        student_id = message.get("student_id")
-        data = message.get("data")
+    if action == "updated":
         body = {
             "amount": data["amount"],
             "description": data["description"],
@@ -56,25 +45,34 @@ def callback(ch, method, properties, body):
             "start_date": data["start_date"],
             "status": data["status"],
         }
-        try:
-            response = requests.put(
-                url+f"{student_id}/benefist/{benefit_id}", json=body)
-            response.raise_for_status()
-            logger.info("✅ Beneficio actualizado")
-        except requests.exceptions.RequestException as e:
-            logger.info("❌ Error al actualizar el beneficio:", e)
+        return [EventAction(
+            benefits_service.update_benefit,
+            (student_id, benefit_id, benefits_service.UpdateBenefit(**body)),
+            "PUT", f"{student_id}/benefist/{benefit_id}", body,
+            success="✅ Beneficio actualizado",
+            error="❌ Error al actualizar el beneficio")]
+
+    if action == "deleted":
+        return [EventAction(
+            benefits_service.delete_benefit, (student_id, benefit_id),
+            "DELETE", f"{student_id}/benefits/{benefit_id}",
+            success="✅ Beneficio eliminado",
+            error="❌ Error al eliminar el beneficio")]
+
+    return []
 
-    elif action == "deleted":
-        student_id = message.get("student_id")
-        try:
-            response = requests.delete(
-                url+f"{student_id}/benefits/{benefit_id}")
-            response.raise_for_status()
-            logger.info("✅ Beneficio eliminado")
-        except requests.exceptions.RequestException as e:
-            logger.info("❌ Error al eliminar el beneficio:", e)
 
-    ch.basic_ack(delivery_tag=method.delivery_tag)
+# En modo directo los eventos del propio servicio ya están aplicados en su
+# base; volver a aplicarlos re-emitiría el mismo evento.
+callback = EventCallback(url, actions, logger, skip_origin="benefits",
+                         dedup=DedupStore("benefits", benefits_service.db))
 
 
-Consumer("benefits", callback)
+if __name__ == "__main__":
+    if CONSUMER_TRANSPORT == "direct":
+        # Escribe con las funciones del servicio: necesita sus índices únicos
+        require_unique_indexes(benefits_service.db)
+    if CONSUMER_RUNTIME == "asyncio":
+        AsyncConsumer("benefits", callback)
+    else:
+        Consumer("benefits", callback)
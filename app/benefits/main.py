@@ -1,14 +1,18 @@
 import threading
 from pydantic import BaseModel, ConfigDict
-from fastapi import FastAPI, APIRouter, HTTPException, Request, requests
-from pymongo import MongoClient
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Request, requests
 from pydantic import BaseModel, Field
 from bson import ObjectId
 from datetime import datetime
 from typing import List
 import os
 from ..routers.router import prefix, router
-from ..rabbit.main import publish_event
+from ..metrics.main import install_metrics
+from ..outbox.main import OutboxRelay, emit_event, transaction
+from ..mongo.main import get_client
+from ..mongo.items import ItemStore, PageQuery, find_page
+from ..migrations.main import run_migrations
+from ..cache.main import ReadCache, start_invalidation
 import pika
 from pika.exchange_type import ExchangeType
 from typing import Optional
@@ -19,14 +23,19 @@ rabbitmq_url = os.getenv("RABBITMQ_URL")
 mongo_user = os.getenv("MONGO_ADMIN_USER")
 mongo_pass = os.getenv("MONGO_ADMIN_PASS")
 
-client = MongoClient("mongodb://mongodb:27017/",
-                     username=mongo_user,
-                     password=mongo_pass)
+client = get_client()
 db = client["benefit"]
-benefits_collection = db["benefits"]
+# Beneficios (con sus pagos anidados): embebidos en el documento del
+# estudiante o un documento por beneficio, según STORAGE_LAYOUT
+benefits_store = ItemStore("benefit", "benefits", "benefits", "benefit_id",
+                           "benefit_items")
+# Listados de beneficios y de sus pagos por estudiante
+read_cache = ReadCache("benefit")
+outbox_relay = OutboxRelay(db)
 
 app = FastAPI()
 app.include_router(router)
+install_metrics(app)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -36,6 +45,54 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+def apply_migrations():
+    run_migrations(db)
+
+
+@app.on_event("startup")
+def start_outbox_relay():
+    outbox_relay.start()
+
+
+@app.on_event("startup")
+def start_cache_invalidation():
+    start_invalidation("benefits", read_cache)
+
+
+# Campos que devuelven los listados (los pagos de un beneficio se listan
+# aparte)
+BENEFIT_FIELDS = ["benefit_id", "name", "description", "amount",
+                  "start_date", "end_date", "status"]
+BENEFIT_PAYMENT_FIELDS = ["payment_id", "debt_id", "type", "amount", "month",
+                          "semester", "year", "description", "status"]
+
+
+def find_benefit_payment(student_id, benefit_id, payment_id):
+    """
+    Devuelve (existe_estudiante, beneficio, pago) leyendo sólo el beneficio
+    pedido; beneficio y pago son None si no existen.
+    """
+    student_exists, benefit = benefits_store.find_item(
+        student_id, benefit_id)
+    payment = None
+    if benefit:
+        payment = next((pay for pay in benefit.get("payments") or []
+                        if pay["payment_id"] == payment_id), None)
+    return student_exists, benefit, payment
+
+
+def payment_update(benefit_id, payment_id, fields):
+    """$set y array_filters para actualizar un pago de un beneficio."""
+    update_fields = {}
+    array_filters = []
+    for key, value in fields.items():
+        path, array_filters = benefits_store.filtered_field(
+            f"payments.$[p].{key}", benefit_id)
+        update_fields[path] = value
+    return {"$set": update_fields}, array_filters + [{"p.payment_id": payment_id}]
+
+
 # ----------------------Schemas-------------------------------
 class Payment(BaseModel):
     payment_id: str
@@ -148,34 +205,17 @@ class UpdateBenefit(BaseModel):
   `end_date`: Fecha de finalización del beneficio (Ejemplo: 2024-10-20T22:16:23.930Z).\n
 """, tags=["POST"])
 def register_benefit(student_id: str, benefit: Benefit):
-    student_result = benefits_collection.find_one(
-        {"student_id": student_id})
-    if student_result:
-        has_benefit = any(
-            benefit.benefit_id == ben["benefit_id"] for ben in student_result["benefits"]
-        )
-        if has_benefit:
-            raise HTTPException(
-                status_code=400, detail="El beneficio ya fue asignado")
-        result = benefits_collection.update_one(
-            {"student_id": student_id},
-            {"$push": {"benefits": benefit.dict()}}
-        )
-    else:
-        student_dict = {
-            "student_id": student_id,
-            "benefits": [benefit.dict()]
-        }
-        result = benefits_collection.insert_one(student_dict)
-
-        benefits_collection.update_one(
-            {"student_id": student_id, "benefits.benefit_id": benefit.benefit_id},
-            {"$set": {"benefits.$.status": "actived"}}
-        )
-
-    if not result:
+    student_exists, existing = benefits_store.find_item(
+        student_id, benefit.benefit_id, ["benefit_id"])
+    if existing:
         raise HTTPException(
-            status_code=400, detail="No se pudo registrar el beneficio")
+            status_code=400, detail="El beneficio ya fue asignado")
+
+    benefit_dict = benefit.dict()
+    if not student_exists:
+        benefit_dict["status"] = "actived"
+    benefits_store.add(student_id, [benefit_dict])
+    read_cache.invalidate(student_id)
 
     return {"msg": "Beneficio registrado exitosamente!"}
 
@@ -191,24 +231,16 @@ def register_benefit(student_id: str, benefit: Benefit):
   `status`: estado del beneficio (Valores que puede tomar: "actived", "inactived" o "expired")
 """, tags=["PUT"])
 def update_benefit(student_id: str, benefit_id: str, update_benefit: UpdateBenefit):
-    result = benefits_collection.find_one(
-        {"student_id": student_id},
-        {
-            "benefits": {
-                "$elemMatch": {
-                    "benefit_id": benefit_id
-                }
-            }
-        }
-    )
+    student_exists, benefit = benefits_store.find_item(
+        student_id, benefit_id, ["benefit_id"])
 
-    if not result:
+    if not student_exists:
         raise HTTPException(
             status_code=404,
             detail="Estudiante no encontrado"
         )
 
-    if not result.get("benefits"):
+    if not benefit:
         raise HTTPException(
             status_code=404,
             detail="Beneficio o pago no encontrado"
@@ -227,99 +259,62 @@ def update_benefit(student_id: str, benefit_id: str, update_benefit: UpdateBenef
             detail="No se proporcionaron datos para actualizar"
         )
 
-    # Crear el diccionario de actualización con la notación correcta para arrays
-    update_fields = {
-        f"benefits.$.{key}": value
-        for key, value in update_data.items()
-    }
-
-    result = benefits_collection.update_one(
-        {
-            "student_id": student_id,
-            "benefits.benefit_id": benefit_id
-        },
-        {
-            "$set": update_fields
-        }
-    )
-
-    if result.matched_count == 0:
-        raise HTTPException(
-            status_code=404,
-            detail="Estudiante o beneficio no encontrado"
+    # El cambio y su evento se confirman juntos
+    with transaction(client) as session:
+        result = benefits_store.collection.update_one(
+            benefits_store.item_filter(student_id, benefit_id),
+            benefits_store.set_fields(update_data),
+            session=session
         )
 
-    # Obtener el beneficio actualizado
-    updated_student = benefits_collection.find_one(
-        {
-            "student_id": student_id,
-            "benefits.benefit_id": benefit_id
-        },
-        {
-            "benefits": {
-                "$elemMatch": {
-                    "benefit_id": benefit_id
-                }
-            }
-        }
-    )
+        if result.matched_count == 0:
+            raise HTTPException(
+                status_code=404,
+                detail="Estudiante o beneficio no encontrado"
+            )
 
-    if not updated_student or not updated_student.get("benefits"):
-        raise HTTPException(
-            status_code=404,
-            detail="Estudiante o beneficio no encontrado"
-        )
+        emit_event(db, f"benefits.{benefit_id}.updated",
+                   {
+            "origin_service": "benefits",
+            "student_id": student_id,
+            "data": update_benefit.dict()
+        }, session=session)
+    read_cache.invalidate(student_id)
 
     # Obtener el beneficio actualizado
-    updated_student = benefits_collection.find_one(
-        {
-            "student_id": student_id,
-            "benefits.benefit_id": benefit_id
-        },
-        {
-            "benefits": {
-                "$elemMatch": {
-                    "benefit_id": benefit_id
-                }
-            }
-        }
-    )
+    _, updated_benefit = benefits_store.find_item(student_id, benefit_id)
 
-    if not updated_student or not updated_student.get("benefits"):
+    if not updated_benefit:
         raise HTTPException(
             status_code=404,
             detail="No se pudo obtener el beneficio actualizado"
         )
 
-    publish_event(f"benefits.{benefit_id}.updated",
-                  {
-        "origin_service": "benefits",
-        "student_id": student_id,
-        "data": update_benefit.dict()
-    })
-
-    return updated_student["benefits"][0]
+    return updated_benefit
 
 # Endpoint: Eliminar un beneficio (DELETE)
 
 
 @ app.delete(f"{prefix}/{{student_id}}/benefits/{{benefit_id}}", summary="Eliminar un beneficio", description="Se puede eliminar un beneficio proporcionando el id del estudiante (student_id) y el id del beneficio (benefit_id)", tags=["DELETE"])
 def delete_benefit(student_id: str, benefit_id: str):
-    result = benefits_collection.update_one(
-        {"student_id": student_id, "benefits.benefit_id": benefit_id},
-        {"$set": {"benefits.$.status": "inactived"}}
-    )
+    with transaction(client) as session:
+        result = benefits_store.collection.update_one(
+            benefits_store.item_filter(student_id, benefit_id),
+            benefits_store.set_fields({"status": "inactived"}),
+            session=session
+        )
 
-    if result.modified_count == 0:
-        raise HTTPException(
-            status_code=404, detail="Beneficio o estudiante no encontrado")
+        if result.modified_count == 0:
+            raise HTTPException(
+                status_code=404, detail="Beneficio o estudiante no encontrado")
 
-    publish_event(f"benefits.{benefit_id}.deleted",
-                  {
-        "origin_service": "benefits",
-        "student_id": student_id,
-        "benefit_id": benefit_id
-    })
+        emit_event(db, f"benefits.{benefit_id}.deleted",
+                   {
+            "origin_service": "benefits",
+            "student_id": student_id,
+            "benefit_id": benefit_id
+        }, session=session)
+    read_cache.invalidate(student_id)
     return {"msg": "Beneficio eliminado exitosamente"}
 
 # Endpoint: Consultar información de un beneficio (GET)
@@ -334,48 +329,85 @@ def get_benefit(student_id: str, benefit_id: str):
     - student_id: Identificador único del estudiante
     - benefit_id: Identificador único del beneficio a consultar
     """
-    student = benefits_collection.find_one(
-        {"student_id": student_id, "benefits.benefit_id": benefit_id},
-        {"benefits.$": 1}
-    )
+    _, benefit = benefits_store.find_item(student_id, benefit_id)
 
-    if not student or "benefits" not in student or not student["benefits"]:
+    if not benefit:
         raise HTTPException(
             status_code=404, detail="Beneficio o estudiante no encontrado")
 
-    return student["benefits"][0]
+    return benefit
 
 # Endpoint: Listar todos los beneficios de un estudiante (GET)
 
 
 @ app.get(f"{prefix}/{{student_id}}/benefits", tags=["GET"], summary="Listar todos los beneficios de un estudiante")
-def list_benefits(student_id: str, skip: Optional[int] = None, limit: Optional[int] = None, status: Optional[str] = None):
+def list_benefits(
+    student_id: str,
+    page: Optional[int] = Query(default=None, ge=1,
+                                description="Número de página"),
+    page_size: Optional[int] = Query(default=None, ge=1, le=100,
+                                     description="Elementos por página"),
+    status: Optional[str] = None,
+    sort_by: str = Query(
+        default="start_date",
+        enum=["start_date", "end_date", "amount", "benefit_id"],
+        description="Campo para ordenar"),
+    sort_order: str = Query(
+        default="desc", enum=["asc", "desc"],
+        description="Orden de clasificación"),
+    cursor: Optional[str] = Query(
+        default=None,
+        description="next_cursor de la página anterior (reemplaza a page)"),
+    skip: Optional[int] = Query(default=None, ge=0),
+    limit: Optional[int] = Query(default=None, ge=1, le=100),
+):
     """
-    Obtiene la lista de todos los beneficios asociados a un estudiante específico.
+    Obtiene la lista de todos los beneficios asociados a un estudiante específico, filtrada en Mongo.
+
+    Sin page, page_size ni cursor responde como siempre: la lista completa de
+    beneficios (con sus pagos), recortada con skip y limit si se envían
+    ambos. Con cualquiera de ellos responde una página
+    {total, page, page_size, benefits, next_cursor}.
 
     Parámetros:
     - student_id: Identificador único del estudiante
+    - status: Filtro por estado del beneficio ("actived", "inactived" o "expired") (opcional)
     - skip: Número de registros a omitir para la paginación (opcional)
     - limit: Número máximo de registros a retornar (opcional)
-    - status: Filtro por estado del beneficio ("actived", "inactived" o "expired") (opcional)
+    - page, page_size: Página a retornar y su tamaño (opcional)
+    - sort_by, sort_order: Orden de los beneficios en la respuesta paginada
+    - cursor: next_cursor de la respuesta anterior, para recorrer por keyset (opcional)
     """
-    query = {"student_id": student_id}
-    student = benefits_collection.find_one(query)
-    if not student:
+    filters = {"status": status} if status is not None else {}
+    if page is None and page_size is None and cursor is None:
+        student_exists, benefits = read_cache.get_or_load(
+            student_id, ["benefits_list", filters, skip, limit],
+            lambda: benefits_store.list_items(
+                student_id, filters, skip, limit))
+        if not student_exists:
+            raise HTTPException(
+                status_code=404, detail="Estudiante no encontrado")
+        return benefits
+
+    page = page or 1
+    page_size = page_size or 10
+    student_exists, total, benefits, next_cursor = read_cache.get_or_load(
+        student_id,
+        ["benefits", filters, sort_by, sort_order, page, limit or page_size,
+         cursor, skip],
+        lambda: find_page(PageQuery(
+            benefits_store, student_id, BENEFIT_FIELDS, filters, sort_by,
+            sort_order, page, limit or page_size, cursor, skip=skip)))
+    if not student_exists:
         raise HTTPException(status_code=404, detail="Estudiante no encontrado")
 
-    benefits = student['benefits']
-
-    # Filtrar por estado
-    if status is not None:
-        benefits = [
-            benefit for benefit in benefits if benefit["status"] == status]
-
-    # Aplicar paginación
-    if skip is not None and limit is not None:
-        benefits = benefits[skip:skip+limit]
-
-    return benefits
+    return {
+        "total": total,
+        "page": page,
+        "page_size": limit or page_size,
+        "benefits": benefits,
+        "next_cursor": next_cursor
+    }
 
 
 # Endpoint: Registrar un pago mediante un beneficio (POST)
@@ -383,61 +415,43 @@ def list_benefits(student_id: str, skip: Optional[int] = None, limit: Optional[i
 
 @ app.post(f"{prefix}/{{student_id}}/benefits/{{benefit_id}}/payments", summary="Registrar un pago mediante un beneficio", tags=["POST"])
 def registrar_pago(student_id: str, benefit_id: str, payment: Payment):
-    student = benefits_collection.find_one({"student_id": student_id})
+    student_exists, benefit = benefits_store.find_item(
+        student_id, benefit_id, ["payments"])
 
-    if not student:
+    if not student_exists:
         raise HTTPException(status_code=404, detail="Estudiante no encontrado")
 
-    for benefit in student["benefits"]:
-        if benefit["benefit_id"] == benefit_id:
-            if "payments" not in benefit or not benefit["payments"]:
-                benefits_collection.update_one(
-                    {
-                        "student_id": student_id,
-                        "benefits.benefit_id": benefit_id
-                    },
-                    {
-                        "$set": {"benefits.$.payments": [payment.dict()]}
-                    }
-                )
-
-                benefits_collection.update_one(
-                    {
-                        "student_id": student_id,
-                        "benefits.benefit_id": benefit_id,
-                        "benefits.payments.payment_id": payment.payment_id
-                    },
-                    {
-                        "$set": {
-                            "benefits.$[b].payments.$[p].status": "actived"
-                        }
-                    },
-                    array_filters=[
-                        {"b.benefit_id": benefit_id},
-                        {"p.payment_id": payment.payment_id}
-                    ]
-                )
-            else:
-                payment_exists = any(
-                    payment.payment_id == pay["payment_id"] for pay in benefit["payments"]
-                )
-                if payment_exists:
-                    raise HTTPException(
-                        status_code=400, detail="El pago ya fue registrado")
-                benefits_collection.update_one(
-                    {"student_id": student_id, "benefits.benefit_id": benefit_id},
-                    {"$push": {"benefits.$.payments": payment.dict()}}
-                )
-            publish_event(f"payments.{payment.
-                                      payment_id}.created",
-                          {
-                "origin_service": "benefits",
-                "student_id": student_id,
-                "data": payment.dict()
-            })
-            return {"msg": "Pago registrado exitosamente", "payment_id": payment.payment_id}
-
-    raise HTTPException(status_code=404, detail="Beneficio no encontrado")
+    if benefit is None:
+        raise HTTPException(status_code=404, detail="Beneficio no encontrado")
+
+    if benefit.get("payments") and any(
+            payment.payment_id == pay["payment_id"]
+            for pay in benefit["payments"]):
+        raise HTTPException(status_code=400, detail="El pago ya fue registrado")
+
+    # El pago y su evento se confirman juntos
+    with transaction(client) as session:
+        if not benefit.get("payments"):
+            benefits_store.collection.update_one(
+                benefits_store.item_filter(student_id, benefit_id),
+                benefits_store.set_fields(
+                    {"payments": [{**payment.dict(), "status": "actived"}]}),
+                session=session
+            )
+        else:
+            benefits_store.collection.update_one(
+                benefits_store.item_filter(student_id, benefit_id),
+                {"$push": {benefits_store.item_field("payments"): payment.dict()}},
+                session=session
+            )
+        emit_event(db, f"payments.{payment.payment_id}.created",
+                   {
+            "origin_service": "benefits",
+            "student_id": student_id,
+            "data": payment.dict()
+        }, session=session)
+    read_cache.invalidate(student_id)
+    return {"msg": "Pago registrado exitosamente", "payment_id": payment.payment_id}
 
 # Endpoint: Actualizar información de un pago mediante un beneficio (PUT)
 
@@ -448,41 +462,21 @@ def registrar_pago(student_id: str, benefit_id: str, payment: Payment):
   `status`: estado del pago (Valores que puede tomar: "actived", "inactived" o "expired")
 """,  tags=["PUT"])
 def actualizar_pago(student_id: str, benefit_id: str, payment_id: str, update_payment: UpdatePayment):
-    result = benefits_collection.find_one(
-        {"student_id": student_id},
-        {
-            "benefits": {
-                "$elemMatch": {
-                    "benefit_id": benefit_id,
-                    "payments": {
-                        "$elemMatch": {
-                            "payment_id": payment_id
-                        }
-                    }
-                }
-            }
-        }
-    )
+    student_exists, _, payment = find_benefit_payment(
+        student_id, benefit_id, payment_id)
 
-    if not result:
+    if not student_exists:
         raise HTTPException(
             status_code=404,
             detail="Estudiante no encontrado"
         )
 
-    if not result.get("benefits"):
+    if not payment:
         raise HTTPException(
             status_code=404,
             detail="Beneficio o pago no encontrado"
         )
 
-    # Accedemos al pago específico
-    if not result["benefits"][0].get("payments"):
-        raise HTTPException(
-            status_code=404,
-            detail="Pago no encontrado"
-        )
-
     update_data = {
         k: v for k, v in update_payment.dict().items()
         if v is not None
@@ -494,89 +488,41 @@ def actualizar_pago(student_id: str, benefit_id: str, payment_id: str, update_pa
             detail="No se proporcionaron datos para actualizar"
         )
 
-    # Crear el diccionario de actualización para los campos del payment
-    update_fields = {
-        f"benefits.$[b].payments.$[p].{key}": value
-        for key, value in update_data.items()
-    }
-
-    result = benefits_collection.update_one(
-        {
-            "student_id": student_id
-        },
-        {
-            "$set": update_fields
-        },
-        array_filters=[
-            {"b.benefit_id": benefit_id},
-            {"p.payment_id": payment_id}
-        ]
-    )
-
-    if result.matched_count == 0:
-        raise HTTPException(
-            status_code=404,
-            detail="Estudiante, beneficio o pago no encontrado"
+    update, array_filters = payment_update(benefit_id, payment_id, update_data)
+    # El cambio y su evento se confirman juntos; el evento lleva el pago como
+    # queda con el update
+    with transaction(client) as session:
+        result = benefits_store.collection.update_one(
+            benefits_store.item_filter(student_id, benefit_id),
+            update,
+            array_filters=array_filters,
+            session=session
         )
 
-    # Obtener el payment actualizado
-    updated_student = benefits_collection.find_one(
-        {
-            "student_id": student_id,
-            "benefits": {
-                "$elemMatch": {
-                    "benefit_id": benefit_id,
-                    "payments": {
-                        "$elemMatch": {
-                            "payment_id": payment_id
-                        }
-                    }
-                }
-            }
-        }
-    )
+        if result.matched_count == 0:
+            raise HTTPException(
+                status_code=404,
+                detail="Estudiante, beneficio o pago no encontrado"
+            )
 
-    if not updated_student or not updated_student.get("benefits"):
-        raise HTTPException(
-            status_code=404,
-            detail="Estudiante, beneficio o pago no encontrado"
-        )
+        emit_event(db, f"payments.{payment_id}.updated",
+                   {
+            "origin_service": "benefits",
+            "student_id": student_id,
+            "payment_id": payment_id,
+            "data": {**payment, **update_data}
+        }, session=session)
+    read_cache.invalidate(student_id)
 
     # Obtener el payment actualizado
-    updated_student = benefits_collection.find_one(
-        {
-            "student_id": student_id,
-            "benefits": {
-                "$elemMatch": {
-                    "benefit_id": benefit_id,
-                    "payments": {
-                        "$elemMatch": {
-                            "payment_id": payment_id
-                        }
-                    }
-                }
-            }
-        }
-    )
+    _, _, payment = find_benefit_payment(student_id, benefit_id, payment_id)
 
-    if not updated_student or not updated_student.get("benefits"):
+    if not payment:
         raise HTTPException(
             status_code=404,
             detail="No se pudo obtener el pago actualizado"
         )
 
-    # Extraer el payment actualizado
-    payment = updated_student["benefits"][0]["payments"][0]
-    # payment.description = "Pago"
-
-    publish_event(f"payments.{payment_id}.updated",
-                  {
-        "origin_service": "benefits",
-        "student_id": student_id,
-        "payment_id": payment_id,
-        "data": payment
-    })
-
     return {
         "payment": payment
     }
@@ -586,76 +532,43 @@ def actualizar_pago(student_id: str, benefit_id: str, payment_id: str, update_pa
 
 @ app.delete(f"{prefix}/{{student_id}}/benefits/{{benefit_id}}/payments/{{payment_id}}", summary="Eliminar un pago mediante un beneficio", description="Se puede eliminar el pago de un beneficio proporcionando el id del estudiante (student_id), el id del beneficio (benefit_id) y el id del pago (payment_id)", tags=["DELETE"])
 def eliminar_pago(student_id: str, benefit_id: str, payment_id: str):
-    result = benefits_collection.find_one(
-        {"student_id": student_id},
-        {
-            "benefits": {
-                "$elemMatch": {
-                    "benefit_id": benefit_id,
-                    "payments": {
-                        "$elemMatch": {
-                            "payment_id": payment_id
-                        }
-                    }
-                }
-            }
-        }
-    )
-
-    if not result:
-        raise HTTPException(
-            status_code=404,
-            detail="Estudiante no encontrado"
-        )
-
-    if not result.get("benefits"):
-        raise HTTPException(
-            status_code=404,
-            detail="Beneficio o pago no encontrado"
-        )
+    student_exists, _, payment = find_benefit_payment(
+        student_id, benefit_id, payment_id)
 
-    # Accedemos al pago específico
-    if not result["benefits"][0].get("payments"):
+    if not student_exists:
         raise HTTPException(
             status_code=404,
             detail="Estudiante no encontrado"
         )
 
-    if not result.get("benefits"):
+    if not payment:
         raise HTTPException(
             status_code=404,
             detail="Beneficio o pago no encontrado"
         )
 
-    # Accedemos al pago específico
-    if not result["benefits"][0].get("payments"):
-        raise HTTPException(
-            status_code=404,
-            detail="Pago no encontrado"
+    update, array_filters = payment_update(
+        benefit_id, payment_id, {"status": "inactived"})
+    with transaction(client) as session:
+        result = benefits_store.collection.update_one(
+            benefits_store.item_filter(student_id, benefit_id),
+            update,
+            array_filters=array_filters,
+            session=session
         )
-
-    result = benefits_collection.update_one(
-        {
+        if result.matched_count == 0:
+            # Se borró entre la consulta y el update: sin evento
+            raise HTTPException(
+                status_code=404,
+                detail="Estudiante, beneficio o pago no encontrado"
+            )
+        emit_event(db, f"payments.{payment_id}.deleted",
+                   {
+            "origin_service": "benefits",
             "student_id": student_id,
-            "benefits.benefit_id": benefit_id,
-            "benefits.payments.payment_id": payment_id
-        },
-        {
-            "$set": {
-                "benefits.$[b].payments.$[p].status": "inactived"
-            }
-        },
-        array_filters=[
-            {"b.benefit_id": benefit_id},
-            {"p.payment_id": payment_id}
-        ]
-    )
-    publish_event(f"payments.{payment_id}.deleted",
-                  {
-        "origin_service": "benefits",
-        "student_id": student_id,
-        "payment_id": payment_id
-    })
+            "payment_id": payment_id
+        }, session=session)
+    read_cache.invalidate(student_id)
     return {"msg": "Pago eliminado exitosamente"}
 
 # Endpoint: Consultar información de un pago mediante un beneficio (GET)
@@ -671,59 +584,116 @@ def consultar_pago(student_id: str, benefit_id: str, payment_id: str):
     - benefit_id: Identificador único del beneficio asociado al pago
     - payment_id: Identificador único del pago a consultar
     """
-    student = benefits_collection.find_one({"student_id": student_id})
+    student_exists, benefit, payment = find_benefit_payment(
+        student_id, benefit_id, payment_id)
 
-    if not student:
+    if not student_exists:
         raise HTTPException(status_code=404, detail="Estudiante no encontrado")
 
-    for benefit in student["benefits"]:
-        if benefit["benefit_id"] == benefit_id:
-            if "payments" not in benefit or not benefit["payments"]:
-                raise HTTPException(
-                    status_code=404, detail="No hay pagos registrados para este beneficio")
-            for payment in benefit["payments"]:
-                if payment["payment_id"] == payment_id:
-                    return payment
+    if benefit and not benefit.get("payments"):
+        raise HTTPException(
+            status_code=404, detail="No hay pagos registrados para este beneficio")
+
+    if not payment:
+        raise HTTPException(status_code=404, detail="Pago no encontrado")
 
-    raise HTTPException(status_code=404, detail="Pago no encontrado")
+    return payment
 
 # Endpoint: Listar todos los pagos de un beneficio (GET)
 
 
+def list_benefit_payments(student_id, benefit_id, status, skip, limit):
+    """Respuesta sin paginar de listar_pagos: la lista de pagos."""
+    filters = {"status": status} if status is not None else {}
+    # Filtrados y recortados en Mongo: sólo viaja (y se cachea) la ventana
+    student_exists, total, payments = read_cache.get_or_load(
+        student_id,
+        ["benefit_payments_list", benefit_id, filters, skip, limit],
+        lambda: list(benefits_store.list_nested(
+            student_id, benefit_id, "payments", filters, skip, limit)))
+    if not student_exists:
+        raise HTTPException(status_code=404, detail="Estudiante no encontrado")
+    if total is None:
+        raise HTTPException(status_code=404, detail="Beneficio no encontrado")
+    if not total:
+        raise HTTPException(
+            status_code=404, detail="No hay pagos registrados para este beneficio")
+    return payments
+
+
 @ app.get(f"{prefix}/{{student_id}}/benefits/{{benefit_id}}/payments", summary="Listar todos los pagos de un beneficio", tags=["GET"])
-def listar_pagos(student_id: str, benefit_id: str, skip: int = None, limit: int = None, status: str = None):
+def listar_pagos(
+    student_id: str,
+    benefit_id: str,
+    page: Optional[int] = Query(default=None, ge=1,
+                                description="Número de página"),
+    page_size: Optional[int] = Query(default=None, ge=1, le=100,
+                                     description="Elementos por página"),
+    status: Optional[str] = None,
+    sort_by: str = Query(
+        default="payment_id", enum=["payment_id", "amount", "year"],
+        description="Campo para ordenar"),
+    sort_order: str = Query(
+        default="asc", enum=["asc", "desc"],
+        description="Orden de clasificación"),
+    cursor: Optional[str] = Query(
+        default=None,
+        description="next_cursor de la página anterior (reemplaza a page)"),
+    skip: Optional[int] = Query(default=None, ge=0),
+    limit: Optional[int] = Query(default=None, ge=1, le=100),
+):
     """
     Obtiene la lista de todos los pagos realizados para un beneficio específico de un estudiante, con opciones de filtrado y paginación.
 
+    Sin page, page_size ni cursor responde como siempre: la lista de pagos,
+    recortada con skip y limit si se envían ambos. Con cualquiera de ellos
+    responde una página {total, page, page_size, payments, next_cursor},
+    filtrada y paginada en Mongo.
+
     Parámetros:
     - student_id: Identificador único del estudiante
     - benefit_id: Identificador único del beneficio
+    - status: Estado de los pagos a filtrar ("actived", "inactived" o "expired") (opcional)
     - skip: Número de registros a omitir para la paginación (opcional)
     - limit: Número máximo de registros a retornar (opcional)
-    - status: Estado de los pagos a filtrar ("actived", "inactived" o "expired") (opcional)
+    - page, page_size: Página a retornar y su tamaño (opcional)
+    - sort_by, sort_order: Orden de los pagos en la respuesta paginada
+    - cursor: next_cursor de la respuesta anterior, para recorrer por keyset (opcional)
     """
-    student = benefits_collection.find_one({"student_id": student_id})
-
-    if not student:
+    filters = {"status": status} if status is not None else {}
+    if page is None and page_size is None and cursor is None:
+        return list_benefit_payments(student_id, benefit_id, status, skip,
+                                     limit)
+
+    page = page or 1
+    page_size = page_size or 10
+
+    def load():
+        query = PageQuery(
+            benefits_store, student_id, BENEFIT_PAYMENT_FIELDS, filters,
+            sort_by, sort_order, page, limit or page_size, cursor, skip=skip,
+            nested=("payments", "payment_id"), parent_id=benefit_id)
+        return [*find_page(query), query.parent_found]
+
+    student_exists, total, payments, next_cursor, parent_found = \
+        read_cache.get_or_load(
+            student_id,
+            ["benefit_payments", benefit_id, filters, sort_by, sort_order,
+             page, limit or page_size, cursor, skip],
+            load)
+
+    if not student_exists:
         raise HTTPException(status_code=404, detail="Estudiante no encontrado")
+    if not parent_found:
+        raise HTTPException(status_code=404, detail="Beneficio no encontrado")
+    if total == 0 and status is None:
+        raise HTTPException(
+            status_code=404, detail="No hay pagos registrados para este beneficio")
 
-    for benefit in student["benefits"]:
-        if benefit["benefit_id"] == benefit_id:
-
-            if "payments" not in benefit or not benefit["payments"]:
-                raise HTTPException(
-                    status_code=404, detail="No hay pagos registrados para este beneficio")
-
-            payments = benefit["payments"]
-
-            # Filtrar por estado
-            if status is not None:
-                payments = [
-                    payment for payment in payments if payment["status"] == status]
-
-            # Aplicar paginación si se especifican skip y limit
-            if skip is not None and limit is not None:
-                payments = payments[skip:skip + limit]
-            return payments
-
-    raise HTTPException(status_code=404, detail="Beneficio no encontrado")
+    return {
+        "total": total,
+        "page": page,
+        "page_size": limit or page_size,
+        "payments": payments,
+        "next_cursor": next_cursor
+    }
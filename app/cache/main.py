@@ -0,0 +1,475 @@
+import collections
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from bson import json_util
+from pika.exchange_type import ExchangeType
+from ..rabbit.main import get_rabbitmq_connection
+
+READ_CACHE_ENABLED = os.getenv("READ_CACHE_ENABLED", "true").lower() == "true"
+READ_CACHE_TTL = float(os.getenv("READ_CACHE_TTL", "30"))
+READ_CACHE_MAX_ENTRIES = int(os.getenv("READ_CACHE_MAX_ENTRIES", "10000"))
+READ_CACHE_MAX_BYTES = int(
+    os.getenv("READ_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Archivo sqlite compartido por los procesos del mismo host (p. ej.
+# /dev/shm/aranceles-cache.db); vacío = sólo caché en memoria
+READ_CACHE_SHARED_PATH = os.getenv("READ_CACHE_SHARED_PATH", "")
+# Segunda invalidación tras un evento: el consumer del servicio lo aplica en
+# Mongo poco después de que llega, y una lectura en ese intervalo dejaría en
+# caché el estado anterior
+READ_CACHE_EVENT_GRACE = float(os.getenv("READ_CACHE_EVENT_GRACE", "2"))
+READ_CACHE_RECONNECT_DELAY = 5
+# Invalidaciones propias pendientes de anunciar a las otras réplicas
+READ_CACHE_BROADCAST_BACKLOG = 10000
+
+_caches = []
+
+
+class SharedTier:
+    """
+    Segundo nivel en un archivo sqlite local: lo comparten los workers de
+    uvicorn y los pods del mismo nodo que montan el mismo archivo.
+    """
+
+    def __init__(self, path, name, max_entries):
+        self.table = f"cache_{name}"
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._path = path
+        self._writes = 0
+        with self._connection() as connection:
+            connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "key TEXT PRIMARY KEY, student_id TEXT, value TEXT, "
+                "expires_at REAL)")
+            connection.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table}_student "
+                f"ON {self.table} (student_id)")
+
+    def _connection(self):
+        # Una conexión por hilo: sqlite3 no comparte conexiones entre hilos
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self._path, timeout=1,
+                                         isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        row = self._connection().execute(
+            f"SELECT value FROM {self.table} WHERE key = ? AND expires_at > ?",
+            (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, student_id, value, ttl):
+        connection = self._connection()
+        connection.execute(
+            f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?)",
+            (key, student_id, value, time.time() + ttl))
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._trim(connection)
+
+    def _trim(self, connection):
+        connection.execute(
+            f"DELETE FROM {self.table} WHERE expires_at <= ?", (time.time(),))
+        connection.execute(
+            f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM "
+            f"{self.table} ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,))
+
+    def invalidate(self, student_id):
+        self._connection().execute(
+            f"DELETE FROM {self.table} WHERE student_id = ?", (student_id,))
+
+    def clear(self):
+        self._connection().execute(f"DELETE FROM {self.table}")
+
+
+class ReadCache:
+    """
+    Caché LRU con TTL de las respuestas de lectura de un servicio, por
+    estudiante y parámetros de la consulta.
+
+    Las respuestas se guardan serializadas (bson json_util): así se mide su
+    tamaño para el límite de memoria y nadie modifica la copia en caché.
+    Una escritura sobre un estudiante invalida todas sus entradas, en este
+    proceso y, a través del CacheInvalidator, en las demás réplicas. Cada
+    invalidación avanza una época global y se anota en qué época se
+    invalidó el estudiante; una lectura que empezó antes no guarda su
+    resultado.
+    """
+
+    def __init__(self, name, ttl=READ_CACHE_TTL,
+                 max_entries=READ_CACHE_MAX_ENTRIES,
+                 max_bytes=READ_CACHE_MAX_BYTES,
+                 shared_path=READ_CACHE_SHARED_PATH,
+                 enabled=READ_CACHE_ENABLED):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.logger = logging.getLogger("Read_Cache")
+        self._lock = threading.Lock()
+        # key -> (student_id, valor serializado, expira)
+        self._entries = collections.OrderedDict()
+        self._keys_by_student = collections.defaultdict(set)
+        self._epoch = 0
+        # student_id -> época de su última invalidación, acotado a
+        # max_entries; lo que se descarta sube _trimmed_epoch
+        self._invalidated = collections.OrderedDict()
+        self._trimmed_epoch = 0
+        self._bytes = 0
+        self._stats = {
+            "hits": 0,
+            "shared_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+            "errors": 0,
+        }
+        self.shared = None
+        # CacheInvalidator que anuncia las invalidaciones (start_invalidation)
+        self.invalidator = None
+        if enabled and shared_path:
+            try:
+                self.shared = SharedTier(shared_path, name, max_entries)
+            except sqlite3.Error as e:
+                self.logger.info(f"Caché compartida deshabilitada: {e}")
+        _caches.append(self)
+
+    @staticmethod
+    def key(student_id, params):
+        return json.dumps([student_id, params], sort_keys=True, default=str)
+
+    def generation(self):
+        with self._lock:
+            return self._epoch
+
+    def _stale(self, student_id, generation):
+        if self._trimmed_epoch > generation:
+            return True
+        return self._invalidated.get(student_id, 0) > generation
+
+    def get(self, student_id, params):
+        """Devuelve (encontrado, valor)."""
+        if not self.enabled:
+            return False, None
+        key = self.key(student_id, params)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] <= now:
+                self._remove(key)
+                self._stats["expirations"] += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+            generation = self._epoch
+        if entry is not None:
+            return True, json_util.loads(entry[1])
+
+        if self.shared is not None:
+            try:
+                value = self.shared.get(key)
+            except sqlite3.Error:
+                value = None
+                self._incr("errors")
+            if value is not None:
+                self._store(key, student_id, value, generation)
+                self._incr("shared_hits")
+                return True, json_util.loads(value)
+
+        self._incr("misses")
+        return False, None
+
+    def set(self, student_id, params, value, generation):
+        """
+        Guarda `value` salvo que el estudiante se haya invalidado después de
+        leer `generation`.
+        """
+        if not self.enabled:
+            return
+        key = self.key(student_id, params)
+        serialized = json_util.dumps(value)
+        if not self._store(key, student_id, serialized, generation):
+            return
+        if self.shared is not None:
+            try:
+                self.shared.set(key, student_id, serialized, self.ttl)
+            except sqlite3.Error:
+                self._incr("errors")
+
+    def _store(self, key, student_id, serialized, generation):
+        size = len(serialized)
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            if self._stale(student_id, generation):
+                return False
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (student_id, serialized,
+                                  time.monotonic() + self.ttl)
+            self._keys_by_student[student_id].add(key)
+            self._bytes += size
+            while (len(self._entries) > self.max_entries
+                   or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+        return True
+
+    def _remove(self, key):
+        student_id, serialized, _ = self._entries.pop(key)
+        self._bytes -= len(serialized)
+        keys = self._keys_by_student[student_id]
+        keys.discard(key)
+        if not keys:
+            del self._keys_by_student[student_id]
+
+    def _incr(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def invalidate(self, student_id, broadcast=True):
+        """
+        Descarta todas las lecturas en caché de un estudiante; con
+        `broadcast` también en las otras réplicas del servicio.
+        """
+        if not self.enabled or not student_id:
+            return
+        if broadcast and self.invalidator is not None:
+            self.invalidator.broadcast(student_id)
+        with self._lock:
+            self._epoch += 1
+            self._invalidated[student_id] = self._epoch
+            self._invalidated.move_to_end(student_id)
+            while len(self._invalidated) > self.max_entries:
+                _, epoch = self._invalidated.popitem(last=False)
+                self._trimmed_epoch = epoch
+            for key in list(self._keys_by_student.get(student_id, ())):
+                self._remove(key)
+            self._stats["invalidations"] += 1
+        if self.shared is not None:
+            try:
+                self.shared.invalidate(student_id)
+            except sqlite3.Error:
+                self._incr("errors")
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._trimmed_epoch = self._epoch
+            self._invalidated.clear()
+            self._entries.clear()
+            self._keys_by_student.clear()
+            self._bytes = 0
+        if self.shared is not None:
+            try:
+                self.shared.clear()
+            except sqlite3.Error:
+                self._incr("errors")
+
+    def get_or_load(self, student_id, params, load):
+        found, value = self.get(student_id, params)
+        if found:
+            return value
+        generation = self.generation()
+        value = load()
+        self.set(student_id, params, value, generation)
+        return value
+
+    async def get_or_load_async(self, student_id, params, load):
+        """Versión de `get_or_load` con `load` awaitable."""
+        found, value = self.get(student_id, params)
+        if found:
+            return value
+        generation = self.generation()
+        value = await load()
+        self.set(student_id, params, value, generation)
+        return value
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        lookups = stats["hits"] + stats["shared_hits"] + stats["misses"]
+        stats["hit_ratio"] = ((stats["hits"] + stats["shared_hits"]) / lookups
+                              if lookups else 0.0)
+        stats.update({
+            "name": self.name,
+            "enabled": self.enabled,
+            "shared": self.shared is not None,
+            "ttl": self.ttl,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+        })
+        return stats
+
+
+class CacheInvalidator:
+    """
+    Escucha en el exchange 'aranceles' los eventos `{service}.*.*` que
+    aplica el consumer del servicio e invalida el estudiante del mensaje.
+    Cada proceso tiene su cola exclusiva, así todas las réplicas reciben
+    todos los eventos.
+
+    Las escrituras HTTP no siempre emiten un evento del servicio, así que
+    cada invalidación local también se publica como `cache.{service}.invalidated`
+    para las demás réplicas. Se publica desde el hilo del invalidador
+    (add_callback_threadsafe), sin bloquear el request; las pendientes
+    mientras no hay conexión se envían al reconectar, y si se descartaron
+    por exceso se pide vaciar la caché completa.
+    """
+
+    def __init__(self, service, cache, grace=READ_CACHE_EVENT_GRACE):
+        self.service = service
+        self.cache = cache
+        self.grace = grace
+        self.logger = logging.getLogger("Read_Cache")
+        self.origin = uuid.uuid4().hex
+        self._thread = None
+        self._connection = None
+        self._channel = None
+        self._lock = threading.Lock()
+        self._pending = collections.deque()
+        self._overflow = False
+
+    @property
+    def routing_key(self):
+        return f"cache.{self.service}.invalidated"
+
+    def start(self):
+        if not self.cache.enabled or self._thread is not None:
+            return
+        self.cache.invalidator = self
+        self._thread = threading.Thread(
+            target=self._run, name=f"cache-{self.service}", daemon=True)
+        self._thread.start()
+
+    def broadcast(self, student_id):
+        """Anuncia (en segundo plano) la invalidación de un estudiante."""
+        with self._lock:
+            if len(self._pending) >= READ_CACHE_BROADCAST_BACKLOG:
+                self._pending.clear()
+                self._overflow = True
+            self._pending.append(student_id)
+        connection = self._connection
+        if connection is not None:
+            try:
+                connection.add_callback_threadsafe(self._flush)
+            except Exception:
+                # Se está cerrando: se envía al reconectar
+                pass
+
+    def _flush(self):
+        # Hilo del invalidador
+        if self._channel is None:
+            return
+        with self._lock:
+            student_ids = list(self._pending)
+            self._pending.clear()
+            overflow, self._overflow = self._overflow, False
+        messages = [{"clear": True}] if overflow else []
+        messages.extend({"student_id": student_id}
+                        for student_id in dict.fromkeys(student_ids))
+        for index, message in enumerate(messages):
+            try:
+                self._channel.basic_publish(
+                    exchange='aranceles', routing_key=self.routing_key,
+                    body=json.dumps({**message, "origin": self.origin}))
+            except Exception:
+                # Lo que no se envió vuelve a la cola para la reconexión
+                with self._lock:
+                    if message.get("clear"):
+                        self._overflow = True
+                    self._pending.extendleft(reversed(
+                        [item["student_id"] for item in messages[index:]
+                         if "student_id" in item]))
+                raise
+
+    def _run(self):
+        while True:
+            connection = get_rabbitmq_connection()
+            if connection is None:
+                time.sleep(READ_CACHE_RECONNECT_DELAY)
+                continue
+            try:
+                channel = connection.channel()
+                channel.exchange_declare(exchange='aranceles',
+                                         exchange_type=ExchangeType.topic)
+                queue = channel.queue_declare(queue='', exclusive=True)
+                for routing_key in (f'{self.service}.*.*',
+                                    self.routing_key):
+                    channel.queue_bind(exchange='aranceles',
+                                       queue=queue.method.queue,
+                                       routing_key=routing_key)
+
+                def on_message(ch, method, properties, body):
+                    if method.routing_key == self.routing_key:
+                        self.on_broadcast(body)
+                    else:
+                        self.on_event(connection, body)
+
+                channel.basic_consume(queue=queue.method.queue,
+                                      on_message_callback=on_message,
+                                      auto_ack=True)
+                self._channel = channel
+                self._connection = connection
+                self._flush()
+                channel.start_consuming()
+            except Exception as e:
+                self.logger.info(f"Invalidación por eventos desconectada: {e}")
+                # Pudo perderse una invalidación mientras no había conexión
+                try:
+                    self.cache.clear()
+                except Exception as e:
+                    self.logger.info(f"Error vaciando la caché: {e}")
+            finally:
+                self._connection = None
+                self._channel = None
+                if connection.is_open:
+                    connection.close()
+            time.sleep(READ_CACHE_RECONNECT_DELAY)
+
+    def on_event(self, connection, body):
+        try:
+            student_id = json.loads(body).get("student_id")
+        except (ValueError, AttributeError):
+            return
+        if not student_id:
+            return
+        self.cache.invalidate(student_id, broadcast=False)
+        connection.call_later(
+            self.grace,
+            lambda: self.cache.invalidate(student_id, broadcast=False))
+
+    def on_broadcast(self, body):
+        try:
+            message = json.loads(body)
+            origin = message.get("origin")
+        except (ValueError, AttributeError):
+            return
+        if origin == self.origin:
+            return
+        if message.get("clear"):
+            self.cache.clear()
+        else:
+            self.cache.invalidate(message.get("student_id"), broadcast=False)
+
+
+def start_invalidation(service, cache):
+    CacheInvalidator(service, cache).start()
+
+
+def cache_stats():
+    return [cache.stats() for cache in _caches]
@@ -1,15 +1,14 @@
-import json
 import os
-import time
-from fastapi import FastAPI
-import pika
-from pika.exchange_type import ExchangeType
-import requests
 import logging
-from ..rabbit.main import Consumer
+from ..rabbit.main import (CONSUMER_BATCH_SIZE, CONSUMER_PREFETCH,
+                           CONSUMER_RUNTIME, CONSUMER_TRANSPORT, Consumer,
+                           EventAction, EventCallback)
+from ..rabbit.async_consumer import AsyncConsumer
+from ..migrations.main import require_unique_indexes
+from ..rabbit.dedup import DedupStore
+from . import main as debt_service
 
 rabbitmq_url = os.getenv("RABBITMQ_URL")
-RETRY_DELAY = 5
 
 
 logging.basicConfig(level=logging.INFO)
@@ -17,16 +16,12 @@ logger = logging.getLogger("Consumer_debt")
 url = f"http://debt-container:8003/api/v1/"
 
 
-def callback(ch, method, properties, body):
-
-    message = json.loads(body)
-
-    event = method.routing_key
+def actions(event, message):
     _, debt_id, action = event.split('.')
+    student_id = message.get("student_id")
+    data = message.get("data")
 
     if action == "created":
-        student_id = message.get("student_id")
-        data = message.get("data")
         body = {
             "debt_id": data["debt_id"],
             "type": data["type"],
@@ -36,48 +31,59 @@ def callback(ch, method, properties, body):
             "year": data["year"],
             "description": data["description"]
         }
-        try:
-            response = requests.post(
-                url+f"{student_id}/debts", json=body)
-            response.raise_for_status()
-            logger.info("✅ Arancel registrado")
-        except requests.exceptions.RequestException as e:
-            logger.info("❌ Error al registrar el arancel:", e)
-
-    elif action == "updated":
-        student_id = message.get("student_id")
-        data = message.get("data")
+        # return_mode explícito: llamada como función, store_debt recibiría
+        # el Query(...) del parámetro en vez de su valor por defecto. El
+        # consumer no usa la respuesta, así que sólo pide el id
+        return [EventAction(
+            debt_service.store_debt,
+            (student_id, debt_service.Debt(**body), "minimal"),
+            "POST", f"{student_id}/debts?return=minimal", body,
+            success="✅ Arancel registrado",
+            error="❌ Error al registrar el arancel",
+            batch=debt_service.store_debts_batch)]
+
+    if action == "updated":
         body = {
             "paid": True
         }
-        try:
-            if data["type"] == "arancel":
-                response = requests.put(
-                    url+f"{student_id}/debts/{debt_id}", json=body)
-                response.raise_for_status()
-
-            if data["type"] == "matricula":
-                enrollment_id = debt_id
-                response = requests.put(
-                    url+f"{student_id}/enrollments/{enrollment_id}", json=body)
-                response.raise_for_status()
-
-            logger.info("✅ Arancel/Matricula actualizado(a)")
-
-        except requests.exceptions.RequestException as e:
-            logger.info("❌ Error al actualizar el arancel/matricula:", e)
-
-    elif action == "deleted":
-        student_id = message.get("student_id")
-        try:
-            response = requests.delete(
-                url+f"{student_id}/debts/{debt_id}")
-            response.raise_for_status()
-            logger.info("✅ Arancel/Matricula eliminado(a)")
-        except requests.exceptions.RequestException as e:
-            logger.info("❌ Error al eliminar el arancel/matricula:", e)
-
-    ch.basic_ack(delivery_tag=method.delivery_tag)
-
-
-Consumer("debts", callback)
+        if data["type"] == "arancel":
+            return [EventAction(
+                debt_service.update_debt,
+                (student_id, debt_id, debt_service.UpdateDebt(**body)),
+                "PUT", f"{student_id}/debts/{debt_id}", body,
+                success="✅ Arancel actualizado",
+                error="❌ Error al actualizar el arancel")]
+        if data["type"] == "matricula":
+            enrollment_id = debt_id
+            return [EventAction(
+                debt_service.update_enrollment,
+                (student_id, enrollment_id,
+                 debt_service.UpdateEnrollment(**body)),
+                "PUT", f"{student_id}/enrollments/{enrollment_id}", body,
+                success="✅ Matricula actualizada",
+                error="❌ Error al actualizar la matricula")]
+
+    if action == "deleted":
+        return [EventAction(
+            debt_service.delete_debt, (student_id, debt_id),
+            "DELETE", f"{student_id}/debts/{debt_id}",
+            success="✅ Arancel/Matricula eliminado(a)",
+            error="❌ Error al eliminar el arancel/matricula")]
+
+    return []
+
+
+callback = EventCallback(url, actions, logger,
+                         dedup=DedupStore("debts", debt_service.db))
+
+
+if __name__ == "__main__":
+    if CONSUMER_TRANSPORT == "direct":
+        # Escribe con las funciones del servicio: necesita sus índices únicos
+        require_unique_indexes(debt_service.db)
+    if CONSUMER_RUNTIME == "asyncio":
+        AsyncConsumer("debts", callback)
+    else:
+        # El prefetch debe permitir llenar un lote de debts.*.created
+        Consumer("debts", callback,
+                 prefetch=max(CONSUMER_PREFETCH, CONSUMER_BATCH_SIZE))
@@ -1,8 +1,11 @@
+import asyncio
 from datetime import datetime
 import json
 import threading
-from fastapi import FastAPI, Form, HTTPException, status, Query
-from pydantic import BaseModel
+from fastapi import FastAPI, Form, HTTPException, status, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
 from fastapi.middleware.cors import CORSMiddleware
 
 import time
@@ -14,22 +17,49 @@ import pika
 from pika.exchange_type import ExchangeType
 from enum import Enum
 from ..routers.router import prefix, router
+from ..metrics.main import install_metrics
 from ..rabbit.main import publish_event
+from ..outbox.main import (OutboxRelay, async_transaction, emit_events,
+                           transaction)
+from ..mongo.main import get_client
+from ..mongo.items import (RETURN_MODES, ItemStore, PageQuery,
+                           decode_position, encode_position, find_page,
+                           find_page_async, share_students)
+from ..migrations.main import run_migrations
+from ..cache.main import ReadCache, start_invalidation
+from ..responses.main import FastJSONResponse, trusted_rows
+from ..balance.main import BalanceView, balance_summary
+from ..stream.main import (EXPORT_BATCH_SIZE, EXPORT_MEDIA_TYPES,
+                           ImportErrors, chunked, export_lines, iter_rows)
 from typing import Optional, List
 
 rabbitmq_url = os.getenv("RABBITMQ_URL")
 
 load_dotenv()
 
-mongo_client = pymongo.MongoClient("mongodb://mongodb:27017/",
-                                   username=os.getenv("MONGO_ADMIN_USER"),
-                                   password=os.getenv("MONGO_ADMIN_PASS"))
+mongo_client = get_client()
 
 db = mongo_client["debt"]
-debts_collection = db["debt"]
+# Aranceles y matrículas: embebidos en el documento del estudiante o un
+# documento por elemento, según STORAGE_LAYOUT
+debts_store = ItemStore("debt", "debt", "debts", "debt_id", "debts")
+enrollments_store = ItemStore("debt", "debt", "enrollments", "enrollment_id",
+                              "enrollments")
+share_students(debts_store, enrollments_store)
+# Listados de aranceles y matrículas por estudiante
+read_cache = ReadCache("debt")
+# Saldo por estudiante: lo facturado se mantiene aquí, lo pagado en el
+# servicio de pagos
+debts_balance = BalanceView("debt", "billed", debts_store)
+payments_balance = BalanceView("payment", "paid")
+outbox_relay = OutboxRelay(db)
+
+# Filas por bulk_write en la carga masiva de aranceles
+DEBT_BULK_CHUNK_SIZE = int(os.getenv("DEBT_BULK_CHUNK_SIZE", "1000"))
 
 app = FastAPI()
 app.include_router(router)
+install_metrics(app)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -38,6 +68,28 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.on_event("startup")
+def apply_migrations():
+    run_migrations(db)
+
+
+@app.on_event("startup")
+def start_cache_invalidation():
+    start_invalidation("debts", read_cache)
+
+
+@app.on_event("startup")
+def start_outbox_relay():
+    outbox_relay.start()
+
+
+# Campos de un arancel y de una matrícula que devuelven las consultas
+DEBT_FIELDS = ["debt_id", "type", "amount", "month", "semester", "year",
+               "status", "paid", "description", "created_at", "updated_at"]
+ENROLLMENT_FIELDS = ["enrollment_id", "semester", "status", "paid",
+                     "created_at", "updated_at"]
+
 # ----- Schemas ------
 
 
@@ -124,6 +176,7 @@ class PaginatedDebtsResponse(BaseModel):
     page: int
     page_size: int
     debts: List[DebtResponse]
+    next_cursor: Optional[str] = None
 
 
 class Enrollment(BaseModel):
@@ -167,18 +220,14 @@ class StudentEnrollment(BaseModel):
           description="""
     (FALTA DESCRIPCIÓN)
     """, tags=["POST"])
-def store_debt(student_id: str, debt: Debt):
+def store_debt(
+    student_id: str,
+    debt: Debt,
+    return_mode: str = Query(
+        default="student", alias="return", enum=RETURN_MODES,
+        description="minimal: sólo el id, item: el arancel, student: todos los aranceles del estudiante")
+):
     try:
-        existing_debt = debts_collection.find_one(
-            {"dets": {"$elemMatch": {"det_id": debt.debt_id}}}
-        )
-
-        if existing_debt:
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail=f"El arancel con ID {debt.debt_id} ya existe"
-            )
-
         debt_dict = debt.model_dump()
         debt_dict.update({
             "status": "active",
@@ -186,29 +235,26 @@ def store_debt(student_id: str, debt: Debt):
             "paid": False
         })
 
-        result = debts_collection.update_one(
-            {"student_id": student_id},
-            {"$push": {"debts": debt_dict}}
+        # El arancel y el resumen de saldo se guardan juntos
+        with transaction(mongo_client) as session:
+            student = debts_store.insert_item(student_id, debt_dict,
+                                              return_mode, session=session)
+            debts_balance.apply(student_id, after=debt_dict, session=session)
+        read_cache.invalidate(student_id)
+
+        response = {"msg": "Arancel registrado correctamente!",
+                    "debt_id": debt.debt_id}
+        if return_mode == "item":
+            response["debt"] = debt_dict
+        elif return_mode == "student":
+            response["student_debts"] = student
+        return response
+
+    except pymongo.errors.DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"El arancel con ID {debt.debt_id} ya existe"
         )
-
-        if result.matched_count == 0:
-            new_student = {
-                "student_id": student_id,
-                "debts": [debt_dict]
-            }
-            debts_collection.insert_one(new_student)
-
-        student = debts_collection.find_one({"student_id": student_id})
-        if not student:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"No se pudo recuperar el estudiante con ID: {
-                    student_id}"
-            )
-
-        student.pop('_id', None)
-        return {"msg": "Arancel registrado correctamente!", "student_debts": student}
-
     except HTTPException:
         raise
     except pymongo.errors.PyMongoError as e:
@@ -223,6 +269,270 @@ def store_debt(student_id: str, debt: Debt):
         )
 
 
+def store_debts_batch(debts):
+    """
+    Registra un lote de aranceles [(student_id, Debt, ...), ...] (los args
+    de store_debt; lo que sigue al arancel se ignora) con un único
+    bulk_write: un $push con $each por estudiante (o un insert por arancel
+    con STORAGE_LAYOUT=items). Lo usa el consumer para
+    aplicar en lote los eventos debts.*.created. Los aranceles repetidos se
+    omiten, igual que el 409 de store_debt.
+    """
+    existing = debts_store.existing_ids(debt.debt_id for _, debt, *_ in debts)
+
+    now = datetime.now()
+    debts_by_student = {}
+    for student_id, debt, *_ in debts:
+        if debt.debt_id in existing:
+            continue
+        existing.add(debt.debt_id)
+        debt_dict = debt.model_dump()
+        debt_dict.update({
+            "status": "active",
+            "created_at": now,
+            "paid": False
+        })
+        debts_by_student.setdefault(student_id, []).append(debt_dict)
+
+    if not debts_by_student:
+        return 0
+
+    with transaction(mongo_client) as session:
+        debts_store.collection.bulk_write([
+            operation
+            for student_id, student_debts in debts_by_student.items()
+            for operation in debts_store.add_ops(student_id, student_debts)
+        ], ordered=False, session=session)
+        debts_balance.collection.bulk_write([
+            operation
+            for student_id, student_debts in debts_by_student.items()
+            for debt_dict in student_debts
+            for operation in debts_balance.ops(student_id, after=debt_dict)
+        ], ordered=False, session=session)
+    for student_id in debts_by_student:
+        read_cache.invalidate(student_id)
+    return sum(len(student_debts) for student_debts in debts_by_student.values())
+
+
+def bulk_debt_row(row):
+    """
+    Valida una fila de la carga masiva: {"student_id": ..., "debt": {...}}
+    o los campos del arancel junto al student_id. Devuelve
+    ((student_id, arancel), None) o (None, error).
+    """
+    if not isinstance(row, dict):
+        return None, "La fila debe ser un objeto JSON"
+    student_id = row.get("student_id")
+    if not isinstance(student_id, str) or not student_id:
+        return None, "student_id es obligatorio"
+    fields = row.get("debt", {k: v for k, v in row.items()
+                                if k != "student_id"})
+    try:
+        debt = Debt(**fields)
+    except (ValidationError, TypeError) as e:
+        if isinstance(e, ValidationError):
+            return None, "; ".join(
+                f"{'.'.join(map(str, error['loc']))}: {error['msg']}"
+                for error in e.errors())
+        return None, str(e)
+    return (student_id, debt), None
+
+
+def store_debts_chunk(rows, now=None):
+    """
+    Registra un trozo de la carga masiva [(fila, student_id, Debt), ...].
+    Descarta los aranceles cuyo debt_id ya existe (en la base o antes en el
+    mismo trozo), como el 409 de store_debt. Los aranceles, el resumen de
+    saldo y los eventos del outbox se escriben en una transacción: si el
+    proceso cae a mitad del trozo no quedan aranceles sin su evento.
+    Devuelve (registrados, errores por fila).
+    """
+    now = now or datetime.now()
+    for attempt in range(2):
+        failed, debts = filter_debts_chunk(rows, now)
+        try:
+            with transaction(mongo_client) as session:
+                stored = write_debts_chunk(debts, failed, session)
+            break
+        except pymongo.errors.BulkWriteError:
+            # Otro request registró uno de los aranceles entre el filtro y la
+            # escritura: la transacción se abortó y el trozo se filtra de nuevo
+            if attempt:
+                raise
+
+    for student_id in {student_id for student_id, _ in stored}:
+        read_cache.invalidate(student_id)
+
+    errors = [{
+        "row": rows[i][0],
+        "student_id": rows[i][1],
+        "debt_id": rows[i][2].debt_id,
+        "error": message
+    } for i, message in sorted(failed.items())]
+    return len(stored), errors
+
+
+def filter_debts_chunk(rows, now):
+    """
+    Separa un trozo en ({índice: error}, [(índice, student_id, arancel)])
+    con una consulta de debt_id.
+    """
+    existing = debts_store.existing_ids(debt.debt_id for _, _, debt in rows)
+
+    failed = {}
+    debts = []
+    for i, (_, student_id, debt) in enumerate(rows):
+        if debt.debt_id in existing:
+            failed[i] = "El arancel ya existe"
+            continue
+        existing.add(debt.debt_id)
+        debt_dict = debt.model_dump()
+        debt_dict.update({"status": "active", "created_at": now,
+                          "paid": False})
+        debts.append((i, student_id, debt_dict))
+    return failed, debts
+
+
+def write_debts_chunk(debts, failed, session):
+    """
+    Inserta los aranceles filtrados, su parte del saldo y sus eventos. Sin
+    transacción (standalone) un arancel que choca falla sólo en su fila;
+    dentro de una, el error aborta el trozo.
+    """
+    if debts:
+        try:
+            debts_store.collection.bulk_write(
+                [debts_store.insert_op(student_id, debt_dict)
+                 for _, student_id, debt_dict in debts],
+                ordered=False, session=session)
+        except pymongo.errors.BulkWriteError as e:
+            if session is not None:
+                raise
+            for error in e.details.get("writeErrors", []):
+                failed[debts[error["index"]][0]] = (
+                    "El arancel ya existe" if error.get("code") == 11000
+                    else error.get("errmsg"))
+
+    stored = [(student_id, debt_dict)
+              for i, student_id, debt_dict in debts if i not in failed]
+    if stored:
+        debts_balance.collection.bulk_write([
+            operation
+            for student_id, debt_dict in stored
+            for operation in debts_balance.ops(student_id, after=debt_dict)
+        ], ordered=False, session=session)
+        emit_events(db, [
+            (f"debts.{debt_dict['debt_id']}.billed", {
+                "origin_service": "debts",
+                "student_id": student_id,
+                "data": debt_dict
+            }) for student_id, debt_dict in stored], session=session)
+    return stored
+
+
+# Registrar aranceles en lote:
+
+
+@app.post(f"{prefix}/debts/bulk",
+          status_code=status.HTTP_200_OK,
+          summary="Registrar aranceles en lote (facturación del semestre)",
+          description="""
+    Recibe un arreglo JSON o NDJSON (`Content-Type: application/x-ndjson`)
+    de filas `{"student_id": ..., "debt": {...}}` (o con los campos del
+    arancel junto al `student_id`) y las registra por trozos con
+    `bulk_write`, a medida que llega el cuerpo. Por cada arancel registrado
+    se publica `debts.{debt_id}.billed`. Responde con el total registrado,
+    la cantidad de filas rechazadas y el error de cada una (`row` es su
+    posición, desde 0); pasados `IMPORT_MAX_ERRORS` errores sólo se cuentan
+    y `errors_truncated` es `true`.
+    """, tags=["POST"])
+async def bulk_store_debts(request: Request):
+    started = time.perf_counter()
+    received = 0
+    stored = 0
+    errors = ImportErrors()
+    try:
+        async for chunk in chunked(iter_rows(request), DEBT_BULK_CHUNK_SIZE):
+            rows = []
+            for index, row, error in chunk:
+                received += 1
+                if error is None:
+                    parsed, error = bulk_debt_row(row)
+                if error is not None:
+                    errors.add({"row": index, "error": error})
+                    continue
+                rows.append((index, *parsed))
+            if rows:
+                chunk_stored, chunk_errors = await run_in_threadpool(
+                    store_debts_chunk, rows)
+                stored += chunk_stored
+                errors.extend(chunk_errors)
+
+        return {
+            "received": received,
+            "stored": stored,
+            **errors.report(),
+            "seconds": round(time.perf_counter() - started, 3)
+        }
+
+    except pymongo.errors.PyMongoError as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Se produjo un error en la base de datos tras registrar {
+                stored} aranceles: {str(e)}"
+        )
+
+
+# Exportar aranceles por semestre:
+
+
+@app.get(f"{prefix}/debts/export",
+         status_code=status.HTTP_200_OK,
+         summary="Exportar aranceles de todos los estudiantes",
+         description="""
+    Descarga como NDJSON o CSV todos los aranceles que cumplen los filtros
+    (`semester`, `year`, `type` y `paid`), leídos de Mongo por lotes y enviados a
+    medida que llegan, sin armar la respuesta completa en memoria. Cada fila
+    trae `resume_token`: si la descarga se corta, repetirla con
+    `resume=<token de la última fila recibida>` continúa después de esa fila.
+    """, tags=["GET"])
+def export_debts(
+    semester: Optional[str] = Query(
+        default=None, description="Filtrar por semestre"),
+    year: Optional[int] = Query(default=None, description="Filtrar por año"),
+    debt_type: Optional[str] = Query(
+        default=None, alias="type", description="Filtrar por tipo de arancel"),
+    paid: Optional[bool] = Query(
+        default=None, description="Filtrar por pagado"),
+    output: str = Query(default="ndjson", alias="format",
+                        enum=list(EXPORT_MEDIA_TYPES),
+                        description="Formato de salida"),
+    resume: Optional[str] = Query(
+        default=None,
+        description="resume_token de la última fila recibida")
+):
+    filters = {}
+    if semester is not None:
+        filters["semester"] = semester
+    if year is not None:
+        filters["year"] = year
+    if debt_type is not None:
+        filters["type"] = debt_type
+    if paid is not None:
+        filters["paid"] = paid
+
+    # Un token inválido responde 400 antes de empezar a enviar
+    position = decode_position(resume, debts_store) if resume else None
+    rows = debts_store.export(filters, position, EXPORT_BATCH_SIZE)
+    period = [str(value) for value in (semester, year) if value is not None]
+    name = "-".join(["debts", *period])
+    return StreamingResponse(
+        export_lines(rows, DEBT_FIELDS, output, encode_position),
+        media_type=EXPORT_MEDIA_TYPES[output],
+        headers={"Content-Disposition":
+                 f'attachment; filename="{name}.{output}"'})
+
+
 # Actualizar información de un arancel:
 
 @app.put(
@@ -249,22 +559,18 @@ async def update_debt(student_id: str, debt_id: str, update_debt: UpdateDebt):
 
         update_data['updated_at'] = datetime.now()
 
-        result = debts_collection.update_one(
-            {
-                "student_id": student_id,
-                "debts.debt_id": debt_id
-            },
-            {
-                "$set": {
-                    f"debts.$.{key}": value
-                    for key, value in update_data.items()
-                }
-            }
-        )
-
-        if result.matched_count == 0:
-            student = debts_collection.find_one({"student_id": student_id})
-            if not student:
+        # El arancel y el resumen de saldo se actualizan juntos
+        async with async_transaction() as session:
+            before = await debts_store.update_item_async(
+                student_id, debt_id, update_data, session=session)
+            if before is not None:
+                await debts_balance.apply_async(
+                    student_id, before, {**before, **update_data},
+                    session=session)
+        read_cache.invalidate(student_id)
+
+        if before is None:
+            if not await debts_store.student_exists_async(student_id):
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail=f"Estudiante con ID {student_id} no fue encontrado"
@@ -275,18 +581,13 @@ async def update_debt(student_id: str, debt_id: str, update_debt: UpdateDebt):
                     debt_id} no encontrado para estudiante {student_id}"
             )
 
-        if result.modified_count == 0:
-            return debts_collection.find_one({"student_id": student_id})
-
-        updated_student = debts_collection.find_one(
-            {"student_id": student_id})
+        updated_student = await debts_store.student_async(student_id)
         if not updated_student:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="No se pudo recuperar el registro actualizado del estudiante"
             )
 
-        updated_student.pop('_id', None)
         return {"msg": "Arancel actualizado correctamente!", "student_updated": updated_student}
 
     except HTTPException:
@@ -316,24 +617,15 @@ async def update_debt(student_id: str, debt_id: str, update_debt: UpdateDebt):
 )
 async def delete_debt(student_id: str, debt_id: str):
     try:
-        try:
-            debt = debts_collection.aggregate([
-                {"$match": {"student_id": student_id}},
-                {"$unwind": "$debts"},
-                {"$match": {"debts.debt_id": debt_id}},
-                {"$project": {
-                    "_id": 0,
-                    "status": "$debts.status"
-                }}
-            ]).next()
-
-        except StopIteration:
-            student = debts_collection.find_one({"student_id": student_id})
-            if not student:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail=f"Estudiante con ID {student_id} no fue encontrado"
-                )
+        student_exists, debt = await debts_store.find_item_async(
+            student_id, debt_id, ["status"])
+
+        if not student_exists:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Estudiante con ID {student_id} no fue encontrado"
+            )
+        if debt is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Arancel con ID {
@@ -345,48 +637,39 @@ async def delete_debt(student_id: str, debt_id: str):
                 detail=f"Arancel con ID {debt_id} ya fue eliminado"
             )
 
-        update_result = debts_collection.update_one(
-            {
-                "student_id": student_id,
-                "debts.debt_id": debt_id
-            },
-            {
-                "$set": {
-                    "debts.$.status": "inactived",
-                    "debts.$.updated_at": datetime.now()
-                }
-            }
-        )
-
-        if update_result.modified_count == 0:
+        # Sólo si sigue activo: dos DELETE simultáneos descuentan una vez.
+        # El arancel y el resumen de saldo se actualizan juntos
+        async with async_transaction() as session:
+            before = await debts_store.update_item_async(
+                student_id, debt_id,
+                {"status": "inactived", "updated_at": datetime.now()},
+                conditions={"status": {"$ne": "inactived"}},
+                session=session)
+            if before is not None:
+                await debts_balance.apply_async(
+                    student_id, before, {**before, "status": "inactived"},
+                    session=session)
+        read_cache.invalidate(student_id)
+
+        if before is None:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Error al eliminar el arancel"
             )
 
-        updated_debt = debts_collection.aggregate([
-            {"$match": {"student_id": student_id}},
-            {"$unwind": "$debts"},
-            {"$match": {"debts.debt_id": debt_id}},
-            {"$project": {
-                "_id": 0,
-                "debt_id": "$debts.debt_id",
-                "amount": "$debts.amount",
-                "status": "$debts.status",
-                "paid": "$debts.paid",
-                "description": "$debts.description",
-                "created_at": "$debts.created_at",
-                "updated_at": "$debts.updated_at"
-            }}
-        ]).next()
+        _, updated_debt = await debts_store.find_item_async(
+            student_id, debt_id,
+            ["debt_id", "amount", "status", "paid", "description",
+             "created_at", "updated_at"])
+
+        if updated_debt is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="No se pudo recuperar el arancel actualizado"
+            )
 
         return updated_debt
 
-    except StopIteration:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="No se pudo recuperar el arancel actualizado"
-        )
     except HTTPException:
         raise
     except pymongo.errors.PyMongoError as e:
@@ -414,35 +697,15 @@ async def delete_debt(student_id: str, debt_id: str):
 )
 async def get_debt(student_id: str, debt_id: str):
     try:
-        debt_cursor = debts_collection.aggregate([
-            {"$match": {"student_id": student_id}},
-            {"$unwind": "$debts"},
-            {"$match": {"debts.debt_id": debt_id}},
-            {"$project": {
-                "_id": 0,
-                "debt_id": "$debts.debt_id",
-                "type": "$debts.type",
-                "amount": "$debts.amount",
-                "month": "$debts.month",
-                "semester": "$debts.semester",
-                "year": "$debts.year",
-                "status": "$debts.status",
-                "paid": "$debts.paid",
-                "description": "$debts.description",
-                "created_at": "$debts.created_at",
-                "updated_at": "$debts.updated_at"
-            }}
-        ])
+        student_exists, debt = await debts_store.find_item_async(
+            student_id, debt_id, DEBT_FIELDS)
 
-        try:
-            debt = debt_cursor.next()
-        except StopIteration:
-            student = debts_collection.find_one({"student_id": student_id})
-            if not student:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail=f"Estudiante con ID {student_id} no fue encontrado"
-                )
+        if not student_exists:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Estudiante con ID {student_id} no fue encontrado"
+            )
+        if debt is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Arancel con ID {
@@ -479,83 +742,64 @@ async def get_debts(
     student_id: str,
     page: int = Query(default=1, ge=1, description="Page number"),
     page_size: int = Query(default=10, ge=1, le=100, description="Items per page"),
-    status: Optional[DebtStatus] = Query(default=None, description="Filter by debt status"),
+    status_filter: Optional[DebtStatus] = Query(default=None, alias="status", description="Filter by debt status"),
     paid: Optional[DebtPaid] = Query(default=None, description="Filter by debt paid"),
     min_amount: Optional[float] = Query(default=None, ge=0, description="Minimum debt amount"),
     max_amount: Optional[float] = Query(default=None, ge=0, description="Maximum debt amount"),
     from_date: Optional[datetime] = Query(default=None, description="Filter debts from this date"),
     to_date: Optional[datetime] = Query(default=None, description="Filter debts until this date"),
     sort_by: Optional[str] = Query(default="created_at", enum=["created_at", "amount", "debt_id"], description="Field to sort by"),
-    sort_order: Optional[str] = Query(default="desc", enum=["asc", "desc"], description="Sort order")
+    sort_order: Optional[str] = Query(default="desc", enum=["asc", "desc"], description="Sort order"),
+    cursor: Optional[str] = Query(default=None, description="next_cursor of the previous page (replaces page)")
 ):
     try:
-        student = debts_collection.find_one({"student_id": student_id})
-        if not student:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Estudiante con ID {student_id} no fue encontrado"
-            )
-        match_conditions = {"student_id": student_id}
         filter_conditions = {}
 
-        if status:
-            filter_conditions["debts.status"] = status.value
+        if status_filter:
+            filter_conditions["status"] = status_filter.value
         if paid:
-            filter_conditions["debts.paid"] = paid.value
+            filter_conditions["paid"] = paid.value
         if min_amount is not None:
-            filter_conditions["debts.amount"] = {"$gte": min_amount}
+            filter_conditions["amount"] = {"$gte": min_amount}
         if max_amount is not None:
-            filter_conditions["debts.amount"] = {
-                **filter_conditions.get("debts.amount", {}),
+            filter_conditions["amount"] = {
+                **filter_conditions.get("amount", {}),
                 "$lte": max_amount
             }
         if from_date:
-            filter_conditions["debts.created_at"] = {"$gte": from_date}
+            filter_conditions["created_at"] = {"$gte": from_date}
         if to_date:
-            filter_conditions["debts.created_at"] = {
-                **filter_conditions.get("debts.created_at", {}),
+            filter_conditions["created_at"] = {
+                **filter_conditions.get("created_at", {}),
                 "$lte": to_date
             }
 
-        sort_direction = pymongo.DESCENDING if sort_order == "desc" else pymongo.ASCENDING
-        pipeline = [
-            {"$match": match_conditions},
-            {"$unwind": "$debts"},
-            {"$match": filter_conditions} if filter_conditions else {"$match": {}},
-            {"$sort": {f"debts.{sort_by}": sort_direction}},
-            {"$skip": (page - 1) * page_size},
-            {"$limit": page_size},
-            {
-                "$project": {
-                    "_id": 0,
-                    "debt_id": "$debts.debt_id",
-                    "type": "$debts.type",
-                    "amount": "$debts.amount",
-                    "month": "$debts.month",
-                    "semester": "$debts.semester",
-                    "year": "$debts.year",
-                    "description": "$debts.description",
-                    "paid": "$debts.paid",
-                    "status": "$debts.status",
-                    "created_at": "$debts.created_at",
-                    "updated_at": "$debts.updated_at",
-                }
-            }
-        ]
-        count_pipeline = pipeline.copy()
-        count_pipeline.append({"$count": "total"})
-        total_count = list(debts_collection.aggregate(count_pipeline))
-        total = total_count[0]["total"] if total_count else 0
-
-        debts = list(debts_collection.aggregate(pipeline))
-
-        return PaginatedDebtsResponse(
-            total=total,
-            page=page,
-            page_size=page_size,
-            debts=debts
-        )
+        student_exists, total, debts, next_cursor = \
+            await read_cache.get_or_load_async(
+                student_id,
+                ["debts", filter_conditions, sort_by, sort_order, page,
+                 page_size, cursor],
+                lambda: find_page_async(PageQuery(
+                    debts_store, student_id, DEBT_FIELDS, filter_conditions,
+                    sort_by, sort_order, page, page_size, cursor)))
 
+        if not student_exists:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Estudiante con ID {student_id} no fue encontrado"
+            )
+
+        # Filas de nuestra proyección: sin validar de nuevo con el modelo
+        return FastJSONResponse({
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "debts": trusted_rows(DebtResponse, debts),
+            "next_cursor": next_cursor
+        })
+
+    except HTTPException:
+        raise
     except pymongo.errors.PyMongoError as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -567,6 +811,41 @@ async def get_debts(
             detail=f"Se produjo un error inesperado: {str(e)}"
         )
 
+# Saldo de un estudiante:
+
+
+@app.get(
+    f"{prefix}/{{student_id}}/balance",
+    status_code=status.HTTP_200_OK,
+    summary="Saldo de un estudiante",
+    description="""
+    Total facturado (aranceles activos), total pagado y saldo pendiente del
+    estudiante, también por semestre y tipo. Se lee de un resumen que
+    mantienen las escrituras de aranceles y pagos.
+    """, tags=["GET"]
+)
+async def get_balance(student_id: str):
+    try:
+        billed, paid = await asyncio.gather(
+            debts_balance.find_async(student_id),
+            payments_balance.find_async(student_id))
+
+        if billed is None and paid is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Estudiante con ID {student_id} no fue encontrado"
+            )
+
+        return balance_summary(student_id, billed, paid)
+
+    except HTTPException:
+        raise
+    except pymongo.errors.PyMongoError as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Se produjo un error en la base de datos: {str(e)}"
+        )
+
 # Registrar matricula:
 
 
@@ -576,19 +855,14 @@ async def get_debts(
     summary="Registrar una matrícula para un estudiante",
     description="Registra una nueva matrícula para un estudiante específico", tags=["POST"]
 )
-def enroll_student(student_id: str, enrollment: Enrollment):
+def enroll_student(
+    student_id: str,
+    enrollment: Enrollment,
+    return_mode: str = Query(
+        default="student", alias="return", enum=RETURN_MODES,
+        description="minimal: sólo el id, item: la matrícula, student: todas las matrículas del estudiante")
+):
     try:
-        existing_enrollment = debts_collection.find_one(
-            {"enrollments": {"$elemMatch": {"enrollment_id": enrollment.enrollment_id}}}
-        )
-
-        if existing_enrollment:
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail=f"La matrícula con ID {
-                    enrollment.enrollment_id} ya existe"
-            )
-
         enrollment_dict = enrollment.model_dump()
         enrollment_dict.update({
             "status": "active",
@@ -596,29 +870,24 @@ def enroll_student(student_id: str, enrollment: Enrollment):
             "paid": False
         })
 
-        result = debts_collection.update_one(
-            {"student_id": student_id},
-            {"$push": {"enrollments": enrollment_dict}}
-        )
+        student = enrollments_store.insert_item(
+            student_id, enrollment_dict, return_mode)
+        read_cache.invalidate(student_id)
 
-        if result.matched_count == 0:
-            new_student = {
-                "student_id": student_id,
-                "enrollments": [enrollment_dict]
-            }
-            debts_collection.insert_one(new_student)
-
-        student = debts_collection.find_one({"student_id": student_id})
-        if not student:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"No se pudo recuperar el estudiante con ID: {
-                    student_id}"
-            )
-
-        student.pop('_id', None)
-        return {"msg": "Matrícula registrada correctamente!", "student_enrollments": student}
+        response = {"msg": "Matrícula registrada correctamente!",
+                    "enrollment_id": enrollment.enrollment_id}
+        if return_mode == "item":
+            response["enrollment"] = enrollment_dict
+        elif return_mode == "student":
+            response["student_enrollments"] = student
+        return response
 
+    except pymongo.errors.DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"La matrícula con ID {
+                enrollment.enrollment_id} ya existe"
+        )
     except HTTPException:
         raise
     except pymongo.errors.PyMongoError as e:
@@ -652,22 +921,14 @@ def update_enrollment(student_id: str, enrollment_id: str, enrollment: UpdateEnr
 
         update_data['updated_at'] = datetime.now()
 
-        result = debts_collection.update_one(
-            {
-                "student_id": student_id,
-                "enrollments.enrollment_id": enrollment_id
-            },
-            {
-                "$set": {
-                    f"enrollments.$.{key}": value
-                    for key, value in update_data.items()
-                }
-            }
+        result = enrollments_store.collection.update_one(
+            enrollments_store.item_filter(student_id, enrollment_id),
+            enrollments_store.set_fields(update_data)
         )
+        read_cache.invalidate(student_id)
 
         if result.matched_count == 0:
-            student = debts_collection.find_one({"student_id": student_id})
-            if not student:
+            if not enrollments_store.student_exists(student_id):
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail=f"Estudiante con ID {student_id} no fue encontrado"
@@ -678,14 +939,13 @@ def update_enrollment(student_id: str, enrollment_id: str, enrollment: UpdateEnr
                     enrollment_id} no encontrada para estudiante {student_id}"
             )
 
-        updated_student = debts_collection.find_one({"student_id": student_id})
+        updated_student = enrollments_store.student(student_id)
         if not updated_student:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="No se pudo recuperar el registro actualizado del estudiante"
             )
 
-        updated_student.pop('_id', None)
         return {"msg": "Matrícula actualizada correctamente!", "student_updated": updated_student}
 
     except HTTPException:
@@ -712,24 +972,15 @@ def update_enrollment(student_id: str, enrollment_id: str, enrollment: UpdateEnr
 )
 def delete_enrollment(student_id: str, enrollment_id: str):
     try:
-        try:
-            enrollment = debts_collection.aggregate([
-                {"$match": {"student_id": student_id}},
-                {"$unwind": "$enrollments"},
-                {"$match": {"enrollments.enrollment_id": enrollment_id}},
-                {"$project": {
-                    "_id": 0,
-                    "status": "$enrollments.status"
-                }}
-            ]).next()
-
-        except StopIteration:
-            student = debts_collection.find_one({"student_id": student_id})
-            if not student:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail=f"Estudiante con ID {student_id} no fue encontrado"
-                )
+        student_exists, enrollment = enrollments_store.find_item(
+            student_id, enrollment_id, ["status"])
+
+        if not student_exists:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Estudiante con ID {student_id} no fue encontrado"
+            )
+        if enrollment is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Matrícula con ID {
@@ -742,18 +993,14 @@ def delete_enrollment(student_id: str, enrollment_id: str):
                 detail=f"Matrícula con ID {enrollment_id} ya fue eliminada"
             )
 
-        update_result = debts_collection.update_one(
-            {
-                "student_id": student_id,
-                "enrollments.enrollment_id": enrollment_id
-            },
-            {
-                "$set": {
-                    "enrollments.$.status": "inactived",
-                    "enrollments.$.updated_at": datetime.now()
-                }
-            }
+        update_result = enrollments_store.collection.update_one(
+            enrollments_store.item_filter(student_id, enrollment_id),
+            enrollments_store.set_fields({
+                "status": "inactived",
+                "updated_at": datetime.now()
+            })
         )
+        read_cache.invalidate(student_id)
 
         if update_result.modified_count == 0:
             raise HTTPException(
@@ -761,20 +1008,14 @@ def delete_enrollment(student_id: str, enrollment_id: str):
                 detail="Error al eliminar la matrícula"
             )
 
-        updated_enrollment = debts_collection.aggregate([
-            {"$match": {"student_id": student_id}},
-            {"$unwind": "$enrollments"},
-            {"$match": {"enrollments.enrollment_id": enrollment_id}},
-            {"$project": {
-                "_id": 0,
-                "enrollment_id": "$enrollments.enrollment_id",
-                "semester": "$enrollments.semester",
-                "status": "$enrollments.status",
-                "paid": "$enrollments.paid",
-                "created_at": "$enrollments.created_at",
-                "updated_at": "$enrollments.updated_at"
-            }}
-        ]).next()
+        _, updated_enrollment = enrollments_store.find_item(
+            student_id, enrollment_id, ENROLLMENT_FIELDS)
+
+        if updated_enrollment is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="No se pudo recuperar la matrícula actualizada"
+            )
 
         return updated_enrollment
 
@@ -802,30 +1043,15 @@ def delete_enrollment(student_id: str, enrollment_id: str):
 )
 def get_enrollment(student_id: str, enrollment_id: str):
     try:
-        enrollment_cursor = debts_collection.aggregate([
-            {"$match": {"student_id": student_id}},
-            {"$unwind": "$enrollments"},
-            {"$match": {"enrollments.enrollment_id": enrollment_id}},
-            {"$project": {
-                "_id": 0,
-                "enrollment_id": "$enrollments.enrollment_id",
-                "semester": "$enrollments.semester",
-                "status": "$enrollments.status",
-                "paid": "$enrollments.paid",
-                "created_at": "$enrollments.created_at",
-                "updated_at": "$enrollments.updated_at"
-            }}
-        ])
+        student_exists, enrollment = enrollments_store.find_item(
+            student_id, enrollment_id, ENROLLMENT_FIELDS)
 
-        try:
-            enrollment = enrollment_cursor.next()
-        except StopIteration:
-            student = debts_collection.find_one({"student_id": student_id})
-            if not student:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail=f"Estudiante con ID {student_id} no fue encontrado"
-                )
+        if not student_exists:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Estudiante con ID {student_id} no fue encontrado"
+            )
+        if enrollment is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Matrícula con ID {
@@ -861,8 +1087,9 @@ def get_enrollments(
     page: int = Query(default=1, ge=1, description="Número de página"),
     page_size: int = Query(default=10, ge=1, le=100,
                            description="Elementos por página"),
-    status: Optional[str] = Query(
-        default=None, description="Filtrar por estado de matrícula"),
+    status_filter: Optional[str] = Query(
+        default=None, alias="status",
+        description="Filtrar por estado de matrícula"),
     paid: Optional[bool] = Query(
         default=None, description="Filtrar por estado de pago"),
     semester: Optional[str] = Query(
@@ -876,67 +1103,43 @@ def get_enrollments(
         default="desc",
         enum=["asc", "desc"],
         description="Orden de clasificación"
-    )
+    ),
+    cursor: Optional[str] = Query(
+        default=None,
+        description="next_cursor de la página anterior (reemplaza a page)")
 ):
     try:
-        student = debts_collection.find_one({"student_id": student_id})
-        if not student:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Estudiante con ID {student_id} no fue encontrado"
-            )
-
-        match_conditions = {"student_id": student_id}
         filter_conditions = {}
 
-        if status:
-            filter_conditions["enrollments.status"] = status
+        if status_filter:
+            filter_conditions["status"] = status_filter
         if paid is not None:
-            filter_conditions["enrollments.paid"] = paid
+            filter_conditions["paid"] = paid
         if semester:
-            filter_conditions["enrollments.semester"] = semester
-
-        pipeline = [
-            {"$match": match_conditions},
-            {"$unwind": "$enrollments"}
-        ]
-
-        if filter_conditions:
-            pipeline.append({"$match": filter_conditions})
-
-        sort_direction = pymongo.DESCENDING if sort_order == "desc" else pymongo.ASCENDING
-        pipeline.append({"$sort": {f"enrollments.{sort_by}": sort_direction}})
-
-        # Count total enrollments
-        count_pipeline = pipeline.copy()
-        count_pipeline.append({"$count": "total"})
-        total_count = list(debts_collection.aggregate(count_pipeline))
-        total = total_count[0]["total"] if total_count else 0
-
-        # Add pagination
-        pipeline.extend([
-            {"$skip": (page - 1) * page_size},
-            {"$limit": page_size},
-            {
-                "$project": {
-                    "_id": 0,
-                    "enrollment_id": "$enrollments.enrollment_id",
-                    "semester": "$enrollments.semester",
-                    "status": "$enrollments.status",
-                    "paid": "$enrollments.paid",
-                    "created_at": "$enrollments.created_at",
-                    "updated_at": "$enrollments.updated_at"
-                }
-            }
-        ])
-
-        enrollments = list(debts_collection.aggregate(pipeline))
+            filter_conditions["semester"] = semester
+
+        student_exists, total, enrollments, next_cursor = \
+            read_cache.get_or_load(
+                student_id,
+                ["enrollments", filter_conditions, sort_by, sort_order, page,
+                 page_size, cursor],
+                lambda: find_page(PageQuery(
+                    enrollments_store, student_id, ENROLLMENT_FIELDS,
+                    filter_conditions, sort_by, sort_order, page, page_size,
+                    cursor)))
+
+        if not student_exists:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Estudiante con ID {student_id} no fue encontrado"
+            )
 
         return {
             "total": total,
             "page": page,
             "page_size": page_size,
-            "enrollments": enrollments
+            "enrollments": enrollments,
+            "next_cursor": next_cursor
         }
 
     except HTTPException:
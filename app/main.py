@@ -2,6 +2,7 @@ from fastapi import FastAPI
 from dotenv import load_dotenv
 
 from .routers import benefits
+from .metrics.main import install_metrics
 import logging
 
 from fastapi.middleware.cors import CORSMiddleware
@@ -17,6 +18,7 @@ app.add_middleware(
 )
 
 app.include_router(benefits.router)
+install_metrics(app)
 
 logging.basicConfig(level=logging.INFO)
 
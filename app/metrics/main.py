@@ -0,0 +1,325 @@
+# Métricas en formato de texto de Prometheus, servidas en /metrics por cada
+# app (aranceles, pagos, beneficios y el gateway):
+#
+# - http_request_duration_seconds: histograma por método, plantilla de ruta
+#   (/api/v1/{student_id}/debts, no la URL concreta) y status.
+# - http_requests_in_flight: requests en curso.
+# - mongodb_command_duration_seconds / mongodb_command_failures_total: por
+#   colección y comando, con el monitoreo de comandos de pymongo.
+# - rabbitmq_publish_duration_seconds / rabbitmq_publish_failures_total: por
+#   evento ("debts.created", sin el id).
+# - consumer_*: mensajes procesados por resultado, latencia del handler y
+#   demora desde la publicación por cola y acción, profundidad de las colas.
+#   Los consumers no tienen app HTTP: se sirven en un puerto propio (ver
+#   rabbit.monitor).
+# - consumer_dedup_*: consultas, duplicados descartados (en memoria o en
+#   processed_events), ids registrados, errores y tamaño del LRU de la
+#   deduplicación de cada consumer (ver rabbit.dedup).
+#
+# Cada proceso tiene su propio registro: con varios workers de uvicorn cada
+# uno expone los suyos.
+from bisect import bisect_left
+import os
+import threading
+import time
+from fastapi.responses import Response
+from pymongo import monitoring
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+               120.0, 300.0, 600.0, 1800.0)
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                 0.25, 0.5, 1.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_registry = []
+
+
+def _escape(value):
+    return (str(value).replace("\\", "\\\\").replace("\n", "\\n")
+            .replace('"', '\\"'))
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"'
+                          for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        if not self.labelnames and self.kind in ("counter", "gauge"):
+            # Sin etiquetas la serie existe desde el inicio, en cero
+            self._values[()] = 0
+        _registry.append(self)
+
+    def samples(self):
+        """[(sufijo, etiquetas extra, valores de etiquetas, valor)]."""
+        with self._lock:
+            return [("", (), labels, value)
+                    for labels, value in self._values.items()]
+
+    def total(self, **match):
+        """Suma de las series cuyas etiquetas coinciden con `match`."""
+        positions = [(self.labelnames.index(name), value)
+                     for name, value in match.items()]
+        with self._lock:
+            return sum(value for labels, value in self._values.items()
+                       if all(labels[index] == expected
+                              for index, expected in positions))
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} {self.kind}"]
+        for suffix, extra, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}"
+                         f"{_labels(self.labelnames, labels, extra)} "
+                         f"{_number(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, value=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, *labels, value=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def dec(self, *labels, value=1):
+        self.inc(*labels, value=-value)
+
+    def set(self, *labels, value):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # cuentas por bucket (sin acumular), suma, total
+                state = self._values[labels] = [
+                    [0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            states = [(labels, list(counts), total, count)
+                      for labels, (counts, total, count)
+                      in self._values.items()]
+        samples = []
+        for labels, counts, total, count in states:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                samples.append(("_bucket", (("le", _number(float(bound))),),
+                                labels, cumulative))
+            samples.append(("_bucket", (("le", "+Inf"),), labels, count))
+            samples.append(("_sum", (), labels, total))
+            samples.append(("_count", (), labels, count))
+        return samples
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Duración de los requests HTTP",
+    ["method", "route", "status"])
+http_requests_in_flight = Gauge(
+    "http_requests_in_flight", "Requests HTTP en curso")
+mongo_command_duration = Histogram(
+    "mongodb_command_duration_seconds", "Duración de los comandos de MongoDB",
+    ["collection", "command"], buckets=MONGO_BUCKETS)
+mongo_command_failures = Counter(
+    "mongodb_command_failures_total", "Comandos de MongoDB que fallaron",
+    ["collection", "command"])
+publish_duration = Histogram(
+    "rabbitmq_publish_duration_seconds",
+    "Duración de la publicación de eventos (hasta la confirmación del "
+    "broker con publisher confirms)", ["event"])
+publish_failures = Counter(
+    "rabbitmq_publish_failures_total", "Eventos que no se pudieron publicar",
+    ["event"])
+consumer_messages = Counter(
+    "consumer_messages_total",
+    "Mensajes procesados por los consumers según el resultado (acked, "
+    "duplicate, retried, parked, discarded, nacked)",
+    ["queue", "action", "outcome"])
+consumer_handler_duration = Histogram(
+    "consumer_handler_duration_seconds",
+    "Tiempo desde que llega el mensaje hasta su ack (con lotes incluye la "
+    "espera del lote)", ["queue", "action"])
+consumer_event_lag = Histogram(
+    "consumer_event_lag_seconds",
+    "Demora entre la publicación del evento y su procesamiento",
+    ["queue", "action"], buckets=LAG_BUCKETS)
+consumer_throughput = Gauge(
+    "consumer_messages_per_second",
+    "Mensajes por segundo del último intervalo de monitoreo", ["queue"])
+consumer_queue_depth = Gauge(
+    "consumer_queue_messages", "Mensajes listos en la cola (declare pasivo)",
+    ["queue"])
+consumer_queue_consumers = Gauge(
+    "consumer_queue_consumers", "Consumers suscritos a la cola", ["queue"])
+consumer_dedup_checks = Counter(
+    "consumer_dedup_checks_total",
+    "Mensajes consultados en la deduplicación", ["service"])
+consumer_dedup_duplicates = Counter(
+    "consumer_dedup_duplicates_total",
+    "Re-entregas descartadas según dónde estaba el id (memory, persistent)",
+    ["service", "source"])
+consumer_dedup_without_id = Counter(
+    "consumer_dedup_without_id_total",
+    "Mensajes sin message_id (no se pueden deduplicar)", ["service"])
+consumer_dedup_marked = Counter(
+    "consumer_dedup_marked_total", "Ids registrados como procesados",
+    ["service"])
+consumer_dedup_errors = Counter(
+    "consumer_dedup_errors_total",
+    "Errores consultando o registrando processed_events", ["service"])
+consumer_dedup_entries = Gauge(
+    "consumer_dedup_entries", "Ids en el LRU en memoria", ["service"])
+
+
+def event_label(event):
+    # "debts.DEBT123.created" -> "debts.created": sin ids en las etiquetas
+    parts = event.split(".")
+    return f"{parts[0]}.{parts[-1]}" if len(parts) == 3 else event
+
+
+def consumer_labels(routing_key):
+    # "debts.DEBT123.created" -> ("debts", "created")
+    parts = routing_key.split(".")
+    return parts[0], parts[-1] if len(parts) == 3 else ""
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Tiempos de cada comando que envían los clientes de mongo.main."""
+
+    def __init__(self):
+        # (request_id, connection_id) -> colección; el evento de fin no la
+        # trae
+        self._collections = {}
+
+    @staticmethod
+    def _collection(event):
+        command = event.command
+        if event.command_name == "getMore":
+            return command.get("collection", "")
+        target = command.get(event.command_name)
+        return target if isinstance(target, str) else ""
+
+    def started(self, event):
+        self._collections[(event.request_id, event.connection_id)] = \
+            self._collection(event)
+
+    def succeeded(self, event):
+        collection = self._collections.pop(
+            (event.request_id, event.connection_id), "")
+        mongo_command_duration.observe(event.duration_micros / 1e6,
+                                       collection, event.command_name)
+
+    def failed(self, event):
+        collection = self._collections.pop(
+            (event.request_id, event.connection_id), "")
+        mongo_command_duration.observe(event.duration_micros / 1e6,
+                                       collection, event.command_name)
+        mongo_command_failures.inc(collection, event.command_name)
+
+
+_mongo_listener = MongoCommandListener()
+
+
+def mongo_event_listeners():
+    """event_listeners para los clientes de pymongo."""
+    return [_mongo_listener] if METRICS_ENABLED else []
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI que mide cada request HTTP. La ruta se toma después de
+    atender el request (`scope["route"]` lo completa FastAPI al enrutar).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        http_requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_flight.dec()
+            route = scope.get("route")
+            http_request_duration.observe(
+                time.perf_counter() - started, scope["method"],
+                getattr(route, "path", "unmatched"), str(status_code))
+
+
+def metrics():
+    return Response(render(), media_type=CONTENT_TYPE)
+
+
+def install_metrics(app):
+    """Agrega a `app` la medición de requests y el endpoint /metrics."""
+    if not METRICS_ENABLED:
+        return
+    app.add_middleware(MetricsMiddleware)
+    app.add_api_route("/metrics", metrics, methods=["GET"],
+                      include_in_schema=False)
@@ -0,0 +1,139 @@
+# Copia en línea de los arreglos embebidos a las colecciones por elemento
+# (STORAGE_LAYOUT=items), sin detener los servicios.
+#
+#     python -m app.migrations.items debt payment benefit
+#
+# Recorre los documentos de estudiantes por _id en lotes y guarda un punto de
+# control por colección en `item_migrations`, así una corrida interrumpida
+# continúa donde quedó. Cada elemento se escribe con un upsert por
+# (student_id, id), por lo que repetir la copia no duplica nada.
+#
+# Pasos para cambiar de layout:
+#
+# 1. Con los servicios en "embedded", copiar (se puede repetir con
+#    --restart para refrescar lo que cambió desde la copia anterior).
+# 2. Reiniciar los servicios con STORAGE_LAYOUT=items.
+# 3. Correr `--restart --insert-only`: agrega los elementos creados en
+#    el arreglo embebido mientras se reiniciaban los servicios, sin pisar
+#    los que ya se escribieron con el layout nuevo.
+#
+# Las modificaciones hechas a elementos ya copiados entre el paso 1 y el
+# paso 2 se pierden; conviene hacer la última copia justo antes de reiniciar
+# o pausar las escrituras en esa ventana.
+import argparse
+from datetime import datetime
+import logging
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from ..mongo.main import get_client
+from .main import migrate
+
+logger = logging.getLogger("ItemsMigration")
+
+# base -> (colección de estudiantes, arreglo, campo id, colección por elemento)
+ITEM_COLLECTIONS = {
+    "debt": [
+        ("debt", "debts", "debt_id", "debts"),
+        ("debt", "enrollments", "enrollment_id", "enrollments"),
+    ],
+    "payment": [
+        ("payments", "payments", "payment_id", "payment_items"),
+    ],
+    "benefit": [
+        ("benefits", "benefits", "benefit_id", "benefit_items"),
+    ],
+}
+
+
+def _item_op(student_id, item, id_field, insert_only):
+    key = {"student_id": student_id, id_field: item[id_field]}
+    document = {"student_id": student_id, **item}
+    if insert_only:
+        return UpdateOne(key, {"$setOnInsert": document}, upsert=True)
+    return ReplaceOne(key, document, upsert=True)
+
+
+def copy_items(db, student_collection, array, id_field, items_collection,
+               batch_size=500, insert_only=False, restart=False):
+    """
+    Copia los elementos del arreglo `array` a `items_collection` y devuelve
+    el resumen de la corrida.
+    """
+    checkpoints = db["item_migrations"]
+    if restart:
+        checkpoints.delete_one({"_id": items_collection})
+    checkpoint = checkpoints.find_one({"_id": items_collection}) or {}
+    last_id = checkpoint.get("last_id")
+    summary = {"students": 0, "items": 0, "skipped": 0, "errors": 0}
+
+    while True:
+        query = {array: {"$exists": True}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        students = list(db[student_collection]
+                        .find(query, {"student_id": 1, array: 1})
+                        .sort("_id", 1).limit(batch_size))
+        if not students:
+            break
+
+        ops = []
+        for student in students:
+            for item in student.get(array) or []:
+                if id_field not in item:
+                    summary["skipped"] += 1
+                    continue
+                ops.append(_item_op(student["student_id"], item, id_field,
+                                    insert_only))
+        if ops:
+            try:
+                db[items_collection].bulk_write(ops, ordered=False)
+            except BulkWriteError as e:
+                # p. ej. un id repetido entre estudiantes con índice único
+                write_errors = e.details.get("writeErrors", [])
+                summary["errors"] += len(write_errors)
+                for error in write_errors[:5]:
+                    logger.info(f"⚠️ {items_collection}: {error.get('errmsg')}")
+
+        last_id = students[-1]["_id"]
+        summary["students"] += len(students)
+        summary["items"] += len(ops)
+        checkpoints.update_one(
+            {"_id": items_collection},
+            {"$set": {"last_id": last_id, "updated_at": datetime.now()}},
+            upsert=True)
+
+    checkpoints.update_one(
+        {"_id": items_collection},
+        {"$set": {"finished_at": datetime.now()}}, upsert=True)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Copia los arreglos embebidos a colecciones por elemento")
+    parser.add_argument("databases", nargs="*", default=list(ITEM_COLLECTIONS),
+                        choices=list(ITEM_COLLECTIONS))
+    parser.add_argument("--batch-size", type=int, default=500,
+                        help="estudiantes por lote")
+    parser.add_argument("--insert-only", action="store_true",
+                        help="no reemplaza elementos que ya existen")
+    parser.add_argument("--restart", action="store_true",
+                        help="ignora el punto de control y recorre todo")
+    args = parser.parse_args()
+
+    client = get_client()
+    for name in args.databases:
+        db = client[name]
+        # Los índices únicos de la versión 2 evitan duplicar elementos
+        migrate(db)
+        for student_collection, array, id_field, items_collection in \
+                ITEM_COLLECTIONS[name]:
+            summary = copy_items(db, student_collection, array, id_field,
+                                 items_collection, args.batch_size,
+                                 args.insert_only, args.restart)
+            print(f"{name}.{items_collection}: {summary}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,400 @@
+# Migraciones versionadas de índices para las bases de los servicios.
+#
+# Cada base (debt, payment, benefit) tiene su lista de migraciones en orden de
+# versión. Las aplicadas se registran en la colección `migrations` de la base,
+# así cada servicio las ejecuta al arrancar sin repetirlas. También se puede
+# correr a mano:
+#
+#     python -m app.migrations.main debt payment benefit
+#     python -m app.migrations.main debt --verify
+#     python -m app.migrations.main debt --duplicates
+#
+# Los servicios dependen de los índices únicos (altas con upsert, cargas
+# masivas): si una migración falla, por ejemplo porque hay documentos
+# repetidos que impiden crear un índice único, el servicio no arranca. Los
+# repetidos se listan con --duplicates y hay que resolverlos a mano.
+import argparse
+from datetime import datetime
+import logging
+import os
+import pymongo
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from ..mongo.main import get_client
+
+MIGRATIONS_ON_STARTUP = os.getenv(
+    "MIGRATIONS_ON_STARTUP", "true").lower() == "true"
+
+logger = logging.getLogger("Migrations")
+
+# Cuántos valores repetidos se muestran por índice
+DUPLICATE_SAMPLES = 5
+
+
+class MigrationError(Exception):
+    pass
+
+
+class Migration:
+    """
+    Una versión del esquema: índices a crear como
+    (colección, claves, opciones de create_index).
+    """
+
+    def __init__(self, version, description, indexes):
+        self.version = version
+        self.description = description
+        self.indexes = indexes
+
+    def apply(self, db):
+        for collection, keys, options in self.indexes:
+            db[collection].create_index(keys, **options)
+
+    def unique_indexes(self):
+        return [(collection, keys, options)
+                for collection, keys, options in self.indexes
+                if options.get("unique")]
+
+
+class IndexCheck:
+    """Consulta representativa que debe resolverse con el índice indicado."""
+
+    def __init__(self, collection, query, index):
+        self.collection = collection
+        self.query = query
+        self.index = index
+
+
+def _embedded_unique(field):
+    # Índice único sobre un id embebido. El filtro parcial deja fuera los
+    # documentos sin ese arreglo (si no, todos chocarían en null).
+    return {
+        "name": f"{field.replace('.', '_')}_unique",
+        "unique": True,
+        "partialFilterExpression": {field: {"$exists": True}},
+    }
+
+
+STUDENT_ID_UNIQUE = {"name": "student_id_unique", "unique": True}
+
+
+def _items_indexes(collection, id_field, sort_field, globally_unique=True):
+    """
+    Índices de una colección con un documento por elemento
+    (STORAGE_LAYOUT=items): el elemento de un estudiante, el id global si lo
+    es, y el orden por defecto de los listados con el id para desempatar.
+    """
+    indexes = [
+        (collection, [("student_id", pymongo.ASCENDING),
+                      (id_field, pymongo.ASCENDING)],
+         {"name": f"student_id_{id_field}_unique", "unique": True}),
+        (collection, [("student_id", pymongo.ASCENDING),
+                      (sort_field, pymongo.DESCENDING),
+                      (id_field, pymongo.DESCENDING)],
+         {"name": f"student_id_{sort_field}"}),
+    ]
+    if globally_unique:
+        indexes.append((collection, [(id_field, pymongo.ASCENDING)],
+                        {"name": f"{id_field}_unique", "unique": True}))
+    return indexes
+
+
+MIGRATIONS = {
+    "debt": [
+        Migration(1, "Índices por estudiante y por id de arancel/matrícula", [
+            ("debt", [("student_id", pymongo.ASCENDING)], STUDENT_ID_UNIQUE),
+            ("debt", [("debts.debt_id", pymongo.ASCENDING)],
+             _embedded_unique("debts.debt_id")),
+            ("debt", [("enrollments.enrollment_id", pymongo.ASCENDING)],
+             _embedded_unique("enrollments.enrollment_id")),
+        ]),
+        Migration(2, "Colecciones por elemento de aranceles y matrículas",
+                  _items_indexes("debts", "debt_id", "created_at")
+                  + _items_indexes("enrollments", "enrollment_id",
+                                   "created_at")),
+    ],
+    "payment": [
+        Migration(1, "Índices por estudiante y por id de pago", [
+            ("payments", [("student_id", pymongo.ASCENDING)],
+             STUDENT_ID_UNIQUE),
+            ("payments", [("payments.payment_id", pymongo.ASCENDING)],
+             _embedded_unique("payments.payment_id")),
+        ]),
+        Migration(2, "Colección por elemento de pagos",
+                  _items_indexes("payment_items", "payment_id",
+                                 "created_at")),
+    ],
+    "benefit": [
+        # benefit_id sólo es único dentro de cada estudiante
+        Migration(1, "Índices por estudiante y por beneficio", [
+            ("benefits", [("student_id", pymongo.ASCENDING)],
+             STUDENT_ID_UNIQUE),
+            ("benefits", [("student_id", pymongo.ASCENDING),
+                          ("benefits.benefit_id", pymongo.ASCENDING)],
+             {"name": "student_id_benefit_id"}),
+        ]),
+        Migration(2, "Colección por elemento de beneficios",
+                  _items_indexes("benefit_items", "benefit_id", "start_date",
+                                 globally_unique=False)),
+    ],
+}
+
+INDEX_CHECKS = {
+    "debt": [
+        IndexCheck("debt", {"student_id": ""}, "student_id_unique"),
+        IndexCheck("debt", {"debts.debt_id": ""}, "debts_debt_id_unique"),
+        IndexCheck("debt", {"enrollments.enrollment_id": ""},
+                   "enrollments_enrollment_id_unique"),
+        IndexCheck("debts", {"debt_id": ""}, "debt_id_unique"),
+        IndexCheck("enrollments", {"enrollment_id": ""},
+                   "enrollment_id_unique"),
+    ],
+    "payment": [
+        IndexCheck("payments", {"student_id": ""}, "student_id_unique"),
+        IndexCheck("payments", {"payments.payment_id": ""},
+                   "payments_payment_id_unique"),
+        IndexCheck("payment_items", {"payment_id": ""}, "payment_id_unique"),
+    ],
+    "benefit": [
+        IndexCheck("benefits", {"student_id": ""}, "student_id_unique"),
+    ],
+}
+
+
+def applied_versions(db):
+    return {doc["_id"] for doc in db["migrations"].find({}, {"_id": 1})}
+
+
+def current_version(db):
+    return max(applied_versions(db), default=0)
+
+
+def unique_indexes(db):
+    """[(colección, claves, opciones)] de los índices únicos de la base."""
+    return [index for migration in MIGRATIONS.get(db.name, [])
+            for index in migration.unique_indexes()]
+
+
+def find_duplicates(db, collection, keys, options, limit=DUPLICATE_SAMPLES):
+    """
+    Valores que impedirían crear el índice único `keys`: (cantidad, hasta
+    `limit` ejemplos con los _id de los documentos que los comparten). Los
+    ids embebidos se cuentan por documento, como el índice multikey.
+    """
+    pipeline = []
+    if options.get("partialFilterExpression"):
+        pipeline.append({"$match": options["partialFilterExpression"]})
+    unwound = set()
+    for field, _ in keys:
+        array = field.split(".")[0] if "." in field else None
+        if array and array not in unwound:
+            pipeline.append({"$unwind": f"${array}"})
+            unwound.add(array)
+    pipeline += [
+        {"$group": {
+            "_id": {field.replace(".", "_"): f"${field}"
+                    for field, _ in keys},
+            "documents": {"$addToSet": "$_id"},
+        }},
+        {"$match": {"documents.1": {"$exists": True}}},
+        {"$facet": {
+            "count": [{"$count": "total"}],
+            "samples": [{"$limit": limit}],
+        }},
+    ]
+    result = next(db[collection].aggregate(pipeline, allowDiskUse=True), {})
+    count = result.get("count") or [{"total": 0}]
+    return count[0]["total"], result.get("samples", [])
+
+
+def check_duplicates(db, migration):
+    """
+    Antes de crear los índices únicos que aún no existen: si hay valores
+    repetidos, MigrationError con el detalle (create_index fallaría igual,
+    pero sin decir cuáles son).
+    """
+    problems = []
+    for collection, keys, options in migration.unique_indexes():
+        if options["name"] in db[collection].index_information():
+            continue
+        count, samples = find_duplicates(db, collection, keys, options)
+        if count:
+            problems.append(
+                f"{db.name}.{collection}: {count} valores repetidos impiden "
+                f"crear {options['name']}, p. ej. {samples}")
+    if problems:
+        raise MigrationError("; ".join(problems))
+
+
+def migrate(db):
+    """
+    Aplica en orden las migraciones pendientes de la base y devuelve las
+    versiones aplicadas. Si una falla se detiene ahí (queda sin registrar y
+    se reintenta en el próximo arranque).
+    """
+    done = applied_versions(db)
+    applied = []
+    for migration in MIGRATIONS.get(db.name, []):
+        if migration.version in done:
+            continue
+        started = datetime.now()
+        check_duplicates(db, migration)
+        migration.apply(db)
+        try:
+            db["migrations"].insert_one({
+                "_id": migration.version,
+                "description": migration.description,
+                "applied_at": datetime.now(),
+                "seconds": (datetime.now() - started).total_seconds(),
+            })
+        except DuplicateKeyError:
+            # Otro pod la aplicó al mismo tiempo; create_index es idempotente
+            pass
+        applied.append(migration.version)
+    return applied
+
+
+def _used_indexes(plan):
+    if isinstance(plan, dict):
+        names = {plan["indexName"]} if "indexName" in plan else set()
+        for value in plan.values():
+            names |= _used_indexes(value)
+        return names
+    if isinstance(plan, list):
+        return set().union(*(_used_indexes(item) for item in plan))
+    return set()
+
+
+def missing_unique_indexes(db):
+    """[(colección, nombre)] de los índices únicos que no existen en la base."""
+    missing = []
+    for collection, _, options in unique_indexes(db):
+        if options["name"] not in db[collection].index_information():
+            missing.append((collection, options["name"]))
+    return missing
+
+
+def require_unique_indexes(db):
+    """
+    Lanza MigrationError si falta algún índice único de la base: las altas
+    con upsert (ItemStore.insert_item, las cargas masivas) dependen de ellos
+    para rechazar duplicados, y sin student_id_unique un alta repetida
+    crearía un segundo documento del estudiante en vez de fallar.
+    """
+    missing = missing_unique_indexes(db)
+    if missing:
+        raise MigrationError(
+            f"Faltan índices únicos en {db.name}: "
+            + ", ".join(f"{collection}.{name}"
+                        for collection, name in missing)
+            + " (python -m app.migrations.main " + db.name + ")")
+
+
+def verify(db):
+    """
+    Ejecuta explain() de las consultas de INDEX_CHECKS y devuelve, por cada
+    una, si el plan ganador usa el índice esperado. Los índices únicos que
+    faltan se informan aparte, con `missing` y sin consulta.
+    """
+    results = [{
+        "collection": collection,
+        "query": None,
+        "index": name,
+        "used": False,
+        "missing": True,
+        "plan_indexes": [],
+    } for collection, name in missing_unique_indexes(db)]
+    for check in INDEX_CHECKS.get(db.name, []):
+        explain = db[check.collection].find(check.query).explain()
+        used = _used_indexes(explain.get("queryPlanner", {})
+                             .get("winningPlan", {}))
+        results.append({
+            "collection": check.collection,
+            "query": check.query,
+            "index": check.index,
+            "used": check.index in used,
+            "missing": False,
+            "plan_indexes": sorted(used),
+        })
+    return results
+
+
+def run_migrations(db):
+    """
+    Punto de entrada de los servicios al arrancar. Si una migración falla
+    lanza MigrationError y el servicio no arranca. Con
+    MIGRATIONS_ON_STARTUP=false sólo se comprueba que existan los índices
+    únicos (ver require_unique_indexes).
+    """
+    if not MIGRATIONS_ON_STARTUP:
+        require_unique_indexes(db)
+        return
+    try:
+        applied = migrate(db)
+        if applied:
+            logger.info(f"Migraciones aplicadas en {db.name}: {applied}")
+        results = verify(db)
+    except (MigrationError, PyMongoError) as e:
+        logger.info(f"No se pudieron aplicar las migraciones de {db.name}: {e}")
+        raise MigrationError(
+            f"No se pudieron aplicar las migraciones de {db.name}: {e}") from e
+    for result in results:
+        if result["missing"]:
+            raise MigrationError(
+                f"Falta el índice {result['index']} en "
+                f"{db.name}.{result['collection']}")
+        if not result["used"]:
+            logger.info(
+                f"⚠️ {db.name}.{result['collection']} {result['query']} "
+                f"no usa {result['index']} (plan: {result['plan_indexes']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Aplica las migraciones de índices de los servicios")
+    parser.add_argument("databases", nargs="*", default=list(MIGRATIONS),
+                        choices=list(MIGRATIONS))
+    parser.add_argument("--verify", action="store_true",
+                        help="sólo muestra versión y explain(), sin migrar")
+    parser.add_argument("--duplicates", action="store_true",
+                        help="sólo lista los valores repetidos que impiden "
+                             "crear los índices únicos")
+    args = parser.parse_args()
+
+    client = get_client()
+    failed = False
+    for name in args.databases:
+        db = client[name]
+        if args.duplicates:
+            for collection, keys, options in unique_indexes(db):
+                count, samples = find_duplicates(db, collection, keys,
+                                                 options)
+                print(f"{name}.{collection} {options['name']}: {count}")
+                for sample in samples:
+                    print(f"  {sample['_id']} -> {sample['documents']}")
+                failed = failed or count > 0
+            continue
+        if not args.verify:
+            try:
+                applied = migrate(db)
+            except MigrationError as e:
+                print(f"{name}: {e}")
+                failed = True
+                continue
+            print(f"{name}: aplicadas {applied or 'ninguna'}")
+        print(f"{name}: versión {current_version(db)}")
+        for result in verify(db):
+            if result["missing"]:
+                print(f"  {result['collection']} -> {result['index']}: "
+                      "FALTA EL ÍNDICE")
+            else:
+                mark = "ok" if result["used"] else "SIN ÍNDICE"
+                print(f"  {result['collection']} {result['query']} -> "
+                      f"{result['index']}: {mark}")
+            failed = failed or not result["used"]
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,649 @@
+import base64
+import os
+from bson import json_util
+from bson.objectid import ObjectId
+from fastapi import HTTPException, status
+import pymongo
+from pymongo import InsertOne, ReturnDocument, UpdateOne
+from .main import AsyncCollection, aggregate_list, get_client
+
+# "embedded": un documento por estudiante con el arreglo de elementos.
+# "items": un documento por elemento (arancel, matrícula, pago, beneficio).
+STORAGE_LAYOUT = os.getenv("STORAGE_LAYOUT", "embedded")
+
+# Qué devuelve un alta: sólo el id, el elemento guardado o el estudiante
+RETURN_MODES = ["minimal", "item", "student"]
+
+
+class ItemStore:
+    """
+    Dónde viven los elementos de un tipo y cómo se consultan según el layout:
+
+    - embedded: en el arreglo `array` del documento del estudiante, en la
+      colección `student_collection`.
+    - items: un documento por elemento en `items_collection`, con el
+      student_id del dueño e índice único (student_id, id_field).
+
+    Los endpoints arman filtros y updates con estos métodos en vez de
+    escribir las rutas "arreglo.$.campo" a mano, así funcionan igual con
+    ambos layouts.
+    """
+
+    def __init__(self, database, student_collection, array, id_field,
+                 items_collection, layout=None):
+        self.database = database
+        self.array = array
+        self.id_field = id_field
+        self.items_collection = items_collection
+        self.layout = layout or STORAGE_LAYOUT
+        self.embedded = self.layout == "embedded"
+        name = student_collection if self.embedded else items_collection
+        self.collection = get_client()[database][name]
+        self.async_collection = AsyncCollection(database, name)
+        # Stores con los que comparte el documento del estudiante en el
+        # layout embedded (ver share_students)
+        self.siblings = []
+
+    def path(self, field):
+        """Ruta de un campo del elemento para filtros y ordenamientos."""
+        return f"{self.array}.{field}" if self.embedded else field
+
+    def item_field(self, field):
+        """Ruta para actualizar el elemento que matcheó `item_filter`."""
+        return f"{self.array}.$.{field}" if self.embedded else field
+
+    def filtered_field(self, field, item_id):
+        """
+        Ruta con filtro de arreglo para updates anidados (p. ej. los pagos de
+        un beneficio). Devuelve (ruta, array_filters).
+        """
+        if self.embedded:
+            return (f"{self.array}.$[item].{field}",
+                    [{f"item.{self.id_field}": item_id}])
+        return field, []
+
+    def id_filter(self, item_id):
+        """Busca un elemento por su id, de cualquier estudiante."""
+        return {self.path(self.id_field): item_id}
+
+    def existing_ids(self, item_ids):
+        """Cuáles de `item_ids` ya existen, de cualquier estudiante."""
+        existing = set()
+        for document in self.collection.find(
+                self.id_filter({"$in": list(item_ids)}),
+                {"_id": 0, self.path(self.id_field): 1}):
+            items = document.get(self.array, []) if self.embedded \
+                else [document]
+            existing.update(item[self.id_field] for item in items)
+        return existing
+
+    def item_filter(self, student_id, item_id):
+        return {"student_id": student_id, self.path(self.id_field): item_id}
+
+    def elem_filter(self, student_id, conditions):
+        """Estudiante con algún elemento que cumple todas las condiciones."""
+        if self.embedded:
+            return {"student_id": student_id,
+                    self.array: {"$elemMatch": conditions}}
+        return {"student_id": student_id, **conditions}
+
+    def set_fields(self, fields):
+        return {"$set": {self.item_field(key): value
+                         for key, value in fields.items()}}
+
+    def add_ops(self, student_id, items):
+        """Operaciones de bulk_write para agregar elementos a un estudiante."""
+        if self.embedded:
+            return [UpdateOne({"student_id": student_id},
+                              {"$push": {self.array: {"$each": items}}},
+                              upsert=True)]
+        return [InsertOne({"student_id": student_id, **item})
+                for item in items]
+
+    def add(self, student_id, items, session=None):
+        self.collection.bulk_write(self.add_ops(student_id, items),
+                                   session=session)
+
+    async def add_async(self, student_id, items, session=None):
+        await self.async_collection.bulk_write(
+            self.add_ops(student_id, items), session=session)
+
+    def insert_op(self, student_id, item):
+        """Operación de bulk_write equivalente a `insert_item`."""
+        if not self.embedded:
+            return InsertOne({"student_id": student_id, **item})
+        return UpdateOne(
+            {"student_id": student_id,
+             self.path(self.id_field): {"$ne": item[self.id_field]}},
+            {"$push": {self.array: item}}, upsert=True)
+
+    def insert_item(self, student_id, item, return_mode="minimal",
+                    session=None):
+        """
+        Agrega un elemento en un solo viaje a Mongo, sin consultar antes si
+        existe: los duplicados los rechazan los índices únicos de las
+        migraciones con DuplicateKeyError (el id ya usado por otro
+        estudiante, o por el mismo en el layout items). En el layout
+        embedded el filtro $ne no deja repetirlo dentro del arreglo: si el
+        estudiante ya lo tiene, el upsert choca con student_id_unique. Sin
+        esos índices un alta repetida no fallaría, por eso los servicios no
+        arrancan si faltan (migrations.main.require_unique_indexes).
+
+        Con return_mode "student" devuelve el documento del estudiante (en
+        el layout items es una segunda consulta); si no, None.
+        """
+        if not self.embedded:
+            self.collection.insert_one({"student_id": student_id, **item},
+                                       session=session)
+            return self.student(student_id, session) \
+                if return_mode == "student" else None
+
+        student = self.collection.find_one_and_update(
+            {"student_id": student_id,
+             self.path(self.id_field): {"$ne": item[self.id_field]}},
+            {"$push": {self.array: item}},
+            projection={"_id": 0} if return_mode == "student" else {"_id": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+            session=session,
+        )
+        return student if return_mode == "student" else None
+
+    def _update_query(self, student_id, item_id, conditions):
+        if conditions:
+            item_filter = self.elem_filter(
+                student_id, {self.id_field: item_id, **conditions})
+        else:
+            item_filter = self.item_filter(student_id, item_id)
+        if self.embedded:
+            projection = {"_id": 0, self.array: {
+                "$elemMatch": {self.id_field: item_id}}}
+        else:
+            projection = {"_id": 0, "student_id": 0}
+        return item_filter, projection
+
+    def _before(self, document):
+        if document is None or not self.embedded:
+            return document
+        items = document.get(self.array)
+        return items[0] if items else None
+
+    def update_item(self, student_id, item_id, fields, conditions=None,
+                    session=None):
+        """
+        Actualiza `fields` del elemento (si además cumple `conditions`) y
+        devuelve cómo estaba antes del cambio, o None si no hubo match.
+        """
+        item_filter, projection = self._update_query(
+            student_id, item_id, conditions)
+        return self._before(self.collection.find_one_and_update(
+            item_filter, self.set_fields(fields), projection=projection,
+            return_document=ReturnDocument.BEFORE, session=session))
+
+    async def update_item_async(self, student_id, item_id, fields,
+                                conditions=None, session=None):
+        """Versión de `update_item` para los endpoints async."""
+        item_filter, projection = self._update_query(
+            student_id, item_id, conditions)
+        return self._before(await self.async_collection.find_one_and_update(
+            item_filter, self.set_fields(fields), projection=projection,
+            return_document=ReturnDocument.BEFORE, session=session))
+
+    # ----- Lecturas -----
+
+    def _student(self, student_id, items):
+        if not items:
+            return None
+        return {"student_id": student_id, self.array: items}
+
+    def student(self, student_id, session=None):
+        """
+        Documento del estudiante con su arreglo de elementos (en el layout
+        items se arma con los documentos de cada elemento).
+        """
+        if self.embedded:
+            return self.collection.find_one({"student_id": student_id},
+                                            {"_id": 0}, session=session)
+        return self._student(student_id, list(self.collection.find(
+            {"student_id": student_id}, {"_id": 0, "student_id": 0},
+            session=session)))
+
+    async def student_async(self, student_id):
+        if self.embedded:
+            return await self.async_collection.find_one(
+                {"student_id": student_id}, {"_id": 0})
+        cursor = self.async_collection.find(
+            {"student_id": student_id}, {"_id": 0, "student_id": 0})
+        return self._student(student_id, await cursor.to_list(None))
+
+    def _item_query(self, student_id, item_id):
+        if self.embedded:
+            # Proyección posicional: sólo viaja el elemento buscado
+            return ({"student_id": student_id},
+                    {"_id": 0, "student_id": 1,
+                     self.array: {"$elemMatch": {self.id_field: item_id}}})
+        return (self.item_filter(student_id, item_id),
+                {"_id": 0, "student_id": 0})
+
+    def _pick(self, item, fields):
+        if fields is None:
+            return item
+        return {field: item[field] for field in fields if field in item}
+
+    def find_item(self, student_id, item_id, fields=None):
+        """
+        Busca un elemento con una consulta indexada por student_id. Devuelve
+        (existe_estudiante, elemento): (False, None) si no hay estudiante y
+        (True, None) si el estudiante existe pero no tiene el elemento.
+        `fields` limita las claves del elemento.
+        """
+        document = self.collection.find_one(
+            *self._item_query(student_id, item_id))
+        if self.embedded:
+            if document is None:
+                return False, None
+            items = document.get(self.array)
+            return True, self._pick(items[0], fields) if items else None
+        if document is not None:
+            return True, self._pick(document, fields)
+        return self.student_exists(student_id), None
+
+    async def find_item_async(self, student_id, item_id, fields=None):
+        """Versión de `find_item` para los endpoints async."""
+        document = await self.async_collection.find_one(
+            *self._item_query(student_id, item_id))
+        if self.embedded:
+            if document is None:
+                return False, None
+            items = document.get(self.array)
+            return True, self._pick(items[0], fields) if items else None
+        if document is not None:
+            return True, self._pick(document, fields)
+        return await self.student_exists_async(student_id), None
+
+    def _owners(self):
+        # En embedded el documento del estudiante ya es el de los hermanos
+        return [self] if self.embedded else [self, *self.siblings]
+
+    def student_exists(self, student_id):
+        return any(store.collection.find_one(
+            {"student_id": student_id}, {"_id": 1}) is not None
+            for store in self._owners())
+
+    async def student_exists_async(self, student_id):
+        for store in self._owners():
+            if await store.async_collection.find_one(
+                    {"student_id": student_id}, {"_id": 1}) is not None:
+                return True
+        return False
+
+    def list_items(self, student_id, filters=None, skip=None, limit=None):
+        """
+        Todos los elementos del estudiante que cumplen `filters` (igualdad
+        por campo), completos y en el orden en que se guardaron; con `skip`
+        y `limit` se recorta en Mongo. Devuelve (existe_estudiante,
+        elementos).
+        """
+        filters = filters or {}
+        sliced = skip is not None and limit is not None
+        if not self.embedded:
+            cursor = self.collection.find(
+                {"student_id": student_id, **filters},
+                {"_id": 0, "student_id": 0}).sort("_id", pymongo.ASCENDING)
+            if sliced:
+                cursor = cursor.skip(skip).limit(limit)
+            items = list(cursor)
+            return bool(items) or self.student_exists(student_id), items
+
+        document = next(self.collection.aggregate([
+            {"$match": {"student_id": student_id}},
+            {"$limit": 1},
+            {"$project": {"_id": 0, "items": _window(
+                {"$ifNull": [f"${self.array}", []]}, filters, skip, limit)}},
+        ]), None)
+        if document is None:
+            return False, []
+        return True, document["items"]
+
+    def list_nested(self, student_id, item_id, field, filters=None,
+                    skip=None, limit=None):
+        """
+        Los elementos del arreglo `field` de un elemento (p. ej. los pagos
+        de un beneficio) que cumplen `filters`, recortados con `skip` y
+        `limit` en Mongo: sólo viaja la ventana pedida. Devuelve
+        (existe_estudiante, total, elementos), con total = largo del arreglo
+        sin filtrar, o None si el estudiante no tiene el elemento.
+        """
+        if self.embedded:
+            match = {"student_id": student_id}
+            # El elemento buscado dentro del arreglo del estudiante
+            first = {"matched": {"$filter": {
+                "input": {"$ifNull": [f"${self.array}", []]},
+                "cond": {"$eq": [f"$$this.{self.id_field}", item_id]}}}}
+            found = {"$gt": [{"$size": "$matched"}, 0]}
+            nested = {"$ifNull": [
+                {"$arrayElemAt": [f"$matched.{field}", 0]}, []]}
+        else:
+            match = self.item_filter(student_id, item_id)
+            first = {"nested": f"${field}"}
+            found = {"$literal": True}
+            nested = {"$ifNull": ["$nested", []]}
+        document = next(self.collection.aggregate([
+            {"$match": match},
+            {"$limit": 1},
+            {"$project": {"_id": 0, **first}},
+            {"$project": {"found": found,
+                          "total": {"$size": nested},
+                          "items": _window(nested, filters, skip, limit)}},
+        ]), None)
+        if document is None:
+            if self.embedded:
+                return False, None, []
+            return self.student_exists(student_id), None, []
+        if not document["found"]:
+            return True, None, []
+        return True, document["total"], document["items"]
+
+    def export(self, filters=None, resume=None, batch_size=1000):
+        """
+        Recorre los elementos de todos los estudiantes que cumplen `filters`
+        en un orden estable y genera (posición, student_id, elemento). La
+        posición de un elemento, pasada como `resume`, continúa la lectura
+        justo después de él. El cursor trae `batch_size` documentos por
+        viaje, así la memoria no depende del total.
+        """
+        filters = filters or {}
+        if not self.embedded:
+            query = dict(filters)
+            if resume is not None:
+                query["_id"] = {"$gt": resume}
+            cursor = (self.collection.find(query)
+                      .sort("_id", pymongo.ASCENDING)
+                      .batch_size(batch_size))
+            for document in cursor:
+                yield (document.pop("_id"), document.pop("student_id"),
+                       document)
+            return
+
+        # embedded: por documento de estudiante (_id) y posición en el
+        # arreglo; los elementos nuevos se agregan al final
+        match = {self.array: {"$elemMatch": filters} if filters
+                 else {"$exists": True}}
+        if resume is not None:
+            match["_id"] = {"$gte": resume[0]}
+        pipeline = [
+            {"$match": match},
+            {"$sort": {"_id": pymongo.ASCENDING}},
+            {"$unwind": {"path": f"${self.array}",
+                         "includeArrayIndex": "position"}},
+        ]
+        if filters:
+            pipeline.append({"$match": {self.path(key): value
+                                        for key, value in filters.items()}})
+        if resume is not None:
+            pipeline.append({"$match": {"$or": [
+                {"_id": {"$gt": resume[0]}},
+                {"position": {"$gt": resume[1]}}]}})
+        pipeline.append({"$project": {"student_id": 1, "position": 1,
+                                      "item": f"${self.array}"}})
+        for row in self.collection.aggregate(pipeline, allowDiskUse=True,
+                                             batchSize=batch_size):
+            yield [row["_id"], row["position"]], row["student_id"], \
+                row["item"]
+
+
+class PageQuery:
+    """
+    Una página de elementos de un estudiante (aranceles, matrículas, pagos,
+    beneficios). `filters` y `sort_by` usan los nombres de campo del
+    elemento; la ruta según el layout la pone `store`.
+
+    - embedded: un solo $facet entrega la página, el total filtrado y si el
+      estudiante existe.
+    - items: find sobre el índice (student_id, sort_by, id) más
+      count_documents.
+
+    Con `cursor` la página se pide por keyset: se continúa después del último
+    elemento entregado (valor de `sort_by` y, para desempatar, el id) en vez
+    de saltar con $skip. Toda página trae `next_cursor` si hay más.
+
+    `nested` = (arreglo, campo_id) pagina un arreglo anidado dentro del
+    elemento `parent_id`, p. ej. los pagos de un beneficio; tras ejecutar la
+    consulta queda `parent_found` indicando si ese elemento existe. `skip`
+    reemplaza el desplazamiento calculado con page.
+    """
+
+    def __init__(self, store, student_id, fields, filters=None,
+                 sort_by="created_at", sort_order="desc", page=1,
+                 page_size=10, cursor=None, skip=None, nested=None,
+                 parent_id=None):
+        self.store = store
+        self.student_id = student_id
+        self.fields = fields
+        self.filters = filters or {}
+        self.sort_by = sort_by
+        self.sort_order = sort_order
+        self.direction = (pymongo.DESCENDING if sort_order == "desc"
+                          else pymongo.ASCENDING)
+        self.page = page
+        self.page_size = page_size
+        self.skip = (page - 1) * page_size if skip is None else skip
+        self.after = decode_cursor(cursor, sort_by, sort_order) if cursor \
+            else None
+        self.nested = nested
+        self.parent_id = parent_id
+        self.parent_found = None
+
+        if nested:
+            array, self.id_field = nested
+            # Ruta del arreglo paginado dentro del documento consultado
+            self.array = (f"{store.array}.{array}" if store.embedded
+                          else array)
+        else:
+            self.id_field = store.id_field
+            self.array = store.array if store.embedded else None
+
+    def _path(self, field):
+        return f"{self.array}.{field}" if self.array else field
+
+    def _filters(self):
+        return {self._path(key): value for key, value in self.filters.items()}
+
+    def _after_match(self):
+        value, item_id = self.after
+        op = "$lt" if self.direction == pymongo.DESCENDING else "$gt"
+        sort_field = self._path(self.sort_by)
+        id_field = self._path(self.id_field)
+        if self.sort_by == self.id_field:
+            return {id_field: {op: item_id}}
+        return {"$or": [{sort_field: {op: value}},
+                         {sort_field: value, id_field: {op: item_id}}]}
+
+    def _sort(self):
+        return {self._path(self.sort_by): self.direction,
+                self._path(self.id_field): self.direction}
+
+    def pipeline(self):
+        """Pipeline de $facet para arreglos (layout embedded o `nested`)."""
+        store = self.store
+        match = {"student_id": self.student_id}
+        if self.nested and store.embedded:
+            # Sólo el elemento padre pedido llega al $facet
+            project = {"_id": 0, store.array: {"$filter": {
+                "input": f"${store.array}",
+                "cond": {"$eq": [f"$$this.{store.id_field}", self.parent_id]},
+            }}}
+            student = [{"$project": {"_id": 0, "parent": {
+                "$size": {"$ifNull": [f"${store.array}", []]}}}}]
+            items = [{"$unwind": f"${store.array}"},
+                     {"$unwind": f"${self.array}"}]
+        else:
+            if self.nested:
+                match[store.id_field] = self.parent_id
+            project = {"_id": 0, self.array: 1}
+            student = [{"$limit": 1}, {"$project": {"_id": 1}}]
+            items = [{"$unwind": f"${self.array}"}]
+        if self.filters:
+            items.append({"$match": self._filters()})
+
+        page = list(items)
+        if self.after is not None:
+            page.append({"$match": self._after_match()})
+        page.append({"$sort": self._sort()})
+        if self.after is None:
+            page.append({"$skip": self.skip})
+        # Un elemento de más indica si hay página siguiente
+        page.append({"$limit": self.page_size + 1})
+        page.append({"$project": {field: f"${self.array}.{field}"
+                                  for field in self.fields}})
+
+        return [
+            {"$match": match},
+            {"$project": project},
+            {"$facet": {
+                "student": student,
+                "total": items + [{"$count": "total"}],
+                "items": page,
+            }},
+        ]
+
+    def facet_result(self, result):
+        facet = result[0]
+        if self.nested and self.store.embedded:
+            self.parent_found = bool(
+                facet["student"] and facet["student"][0]["parent"])
+        elif self.nested:
+            self.parent_found = bool(facet["student"])
+        total = facet["total"][0]["total"] if facet["total"] else 0
+        return bool(facet["student"]), total, facet["items"]
+
+    def find_args(self):
+        """filtro, filtro del total, proyección y orden del layout items."""
+        count_filter = {"student_id": self.student_id, **self._filters()}
+        page_filter = count_filter
+        if self.after is not None:
+            page_filter = {"$and": [count_filter, self._after_match()]}
+        projection = {"_id": 0, **{field: 1 for field in self.fields}}
+        return page_filter, count_filter, projection, list(self._sort().items())
+
+    def result(self, student_exists, total, items):
+        """Devuelve (existe_estudiante, total, elementos, next_cursor)."""
+        next_cursor = None
+        if len(items) > self.page_size:
+            items = items[:self.page_size]
+            last = items[-1]
+            next_cursor = encode_cursor(
+                last.get(self.sort_by), last[self.id_field], self.sort_by,
+                self.sort_order)
+        return student_exists, total, items, next_cursor
+
+
+def _window(items, filters=None, skip=None, limit=None):
+    """Expresión de agregación: `items` filtrado por igualdad y recortado."""
+    if filters:
+        items = {"$filter": {"input": items, "cond": {"$and": [
+            {"$eq": [f"$$this.{key}", value]}
+            for key, value in filters.items()]}}}
+    if skip is not None and limit is not None:
+        items = {"$slice": [items, skip, limit]}
+    return items
+
+
+def share_students(*stores):
+    """
+    Declara stores cuyos elementos viven en el mismo documento del estudiante
+    con el layout embedded (aranceles y matrículas). En el layout items el
+    estudiante existe si tiene elementos en cualquiera de ellos, así un
+    estudiante que sólo tiene matrículas no da 404 al listar sus aranceles.
+    """
+    for store in stores:
+        store.siblings = [other for other in stores if other is not store]
+
+
+def encode_cursor(value, item_id, sort_by, sort_order):
+    payload = json_util.dumps([sort_by, sort_order, value, item_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor, sort_by, sort_order):
+    try:
+        cursor_sort_by, cursor_sort_order, value, item_id = json_util.loads(
+            base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Cursor inválido")
+    if (cursor_sort_by, cursor_sort_order) != (sort_by, sort_order):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="El cursor corresponde a otro orden (sort_by/sort_order)")
+    return value, item_id
+
+
+def encode_position(position):
+    """Token de reanudación de `ItemStore.export`."""
+    return base64.urlsafe_b64encode(
+        json_util.dumps(position).encode()).decode()
+
+
+def decode_position(token, store):
+    try:
+        position = json_util.loads(base64.urlsafe_b64decode(
+            token.encode()).decode())
+    except (ValueError, TypeError):
+        position = None
+    # Cada layout tiene su forma de posición: el _id del elemento (items) o
+    # el _id del estudiante y el índice en el arreglo (embedded). Un token
+    # adulterado o de otro layout sería un límite $gt equivocado
+    if store.embedded:
+        valid = (isinstance(position, list) and len(position) == 2
+                 and isinstance(position[0], ObjectId)
+                 and type(position[1]) is int and position[1] >= 0)
+    else:
+        valid = isinstance(position, ObjectId)
+    if not valid:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Token de reanudación inválido")
+    return position
+
+
+def find_page(query):
+    store = query.store
+    if query.array:
+        student_exists, total, items = query.facet_result(
+            list(store.collection.aggregate(query.pipeline())))
+        if query.nested and not store.embedded and not query.parent_found:
+            student_exists = store.student_exists(query.student_id)
+        return query.result(student_exists, total, items)
+
+    page_filter, count_filter, projection, sort = query.find_args()
+    cursor = store.collection.find(page_filter, projection).sort(sort)
+    if query.after is None:
+        cursor = cursor.skip(query.skip)
+    items = list(cursor.limit(query.page_size + 1))
+    total = store.collection.count_documents(count_filter)
+    student_exists = (total > 0 or bool(items)
+                      or store.student_exists(query.student_id))
+    return query.result(student_exists, total, items)
+
+
+async def find_page_async(query):
+    """Versión de `find_page` para los endpoints async."""
+    store = query.store
+    if query.array:
+        student_exists, total, items = query.facet_result(
+            await aggregate_list(store.async_collection, query.pipeline()))
+        if query.nested and not store.embedded and not query.parent_found:
+            student_exists = await store.student_exists_async(
+                query.student_id)
+        return query.result(student_exists, total, items)
+
+    page_filter, count_filter, projection, sort = query.find_args()
+    cursor = store.async_collection.find(page_filter, projection).sort(sort)
+    if query.after is None:
+        cursor = cursor.skip(query.skip)
+    items = await cursor.limit(query.page_size + 1).to_list(None)
+    total = await store.async_collection.count_documents(count_filter)
+    student_exists = (total > 0 or bool(items)
+                      or await store.student_exists_async(query.student_id))
+    return query.result(student_exists, total, items)
@@ -0,0 +1,99 @@
+import asyncio
+import os
+import threading
+import weakref
+from dotenv import load_dotenv
+import pymongo
+from pymongo import AsyncMongoClient
+from ..metrics.main import mongo_event_listeners
+
+load_dotenv()
+
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://mongodb:27017/")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+
+_client = None
+_client_lock = threading.Lock()
+# AsyncMongoClient queda ligado al event loop donde se usa: un cliente por loop
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _client_options():
+    return {
+        "username": os.getenv("MONGO_ADMIN_USER"),
+        "password": os.getenv("MONGO_ADMIN_PASS"),
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        # Tiempos por colección y comando para /metrics
+        "event_listeners": mongo_event_listeners(),
+    }
+
+
+def get_client():
+    """Cliente pymongo síncrono compartido por el proceso."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = pymongo.MongoClient(MONGO_URL, **_client_options())
+    return _client
+
+
+def get_async_client():
+    """Cliente asíncrono del event loop actual."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = AsyncMongoClient(MONGO_URL, **_client_options())
+        _async_clients[loop] = client
+    return client
+
+
+class AsyncCollection:
+    """
+    Referencia a una colección que se resuelve contra el cliente asíncrono
+    del event loop en curso. Se declara a nivel de módulo igual que las
+    colecciones síncronas y se usa con `await` en los endpoints async.
+    """
+
+    def __init__(self, database, collection):
+        self.database = database
+        self.collection = collection
+
+    def get(self):
+        return get_async_client()[self.database][self.collection]
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+class AsyncDatabase:
+    def __init__(self, name):
+        self.name = name
+
+    def get(self):
+        return get_async_client()[self.name]
+
+    def __getitem__(self, collection):
+        return AsyncCollection(self.name, collection)
+
+
+def async_collection(database, collection):
+    return AsyncCollection(database, collection)
+
+
+def async_database(name):
+    return AsyncDatabase(name)
+
+
+async def aggregate_list(collection, pipeline, **kwargs):
+    cursor = await collection.aggregate(pipeline, **kwargs)
+    return await cursor.to_list(None)
+
+
+async def aggregate_one(collection, pipeline, **kwargs):
+    cursor = await collection.aggregate(pipeline, **kwargs)
+    async for document in cursor:
+        await cursor.close()
+        return document
+    return None
+
@@ -0,0 +1,281 @@
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timedelta
+import logging
+import os
+import socket
+import threading
+import uuid
+import pymongo
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from ..rabbit.main import (PUBLISHER_CONFIRMS, PUBLISHER_CONFIRM_TIMEOUT,
+                           get_confirm_publisher, get_publisher, publish_event,
+                           publish_event_async)
+from ..mongo.main import get_async_client
+
+OUTBOX_ENABLED = os.getenv("OUTBOX_ENABLED", "true").lower() == "true"
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "0.5"))
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "30"))
+OUTBOX_RETENTION_SECONDS = int(
+    os.getenv("OUTBOX_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+_relays = []
+_transaction_support = {}
+
+
+def supports_transactions(client):
+    # Las transacciones requieren replica set o sharding (mongo:4.4 en
+    # compose corre standalone).
+    if id(client) not in _transaction_support:
+        try:
+            hello = client.admin.command("hello")
+        except PyMongoError:
+            return False
+        _transaction_support[id(client)] = bool(
+            hello.get("setName") or hello.get("msg") == "isdbgrid")
+    return _transaction_support[id(client)]
+
+
+@contextmanager
+def transaction(client):
+    """
+    Abre una transacción si el despliegue la soporta, para que la escritura
+    de negocio y el evento del outbox se confirmen juntos. En un standalone
+    entrega None y las escrituras se hacen una tras otra.
+    """
+    if not OUTBOX_ENABLED or not supports_transactions(client):
+        yield None
+        return
+    with client.start_session() as session:
+        with session.start_transaction():
+            yield session
+
+
+async def supports_transactions_async(client):
+    if id(client) not in _transaction_support:
+        try:
+            hello = await client.admin.command("hello")
+        except PyMongoError:
+            return False
+        _transaction_support[id(client)] = bool(
+            hello.get("setName") or hello.get("msg") == "isdbgrid")
+    return _transaction_support[id(client)]
+
+
+@asynccontextmanager
+async def async_transaction():
+    """Versión de `transaction` para el cliente asíncrono."""
+    client = get_async_client()
+    if not OUTBOX_ENABLED or not await supports_transactions_async(client):
+        yield None
+        return
+    async with client.start_session() as session:
+        async with await session.start_transaction():
+            yield session
+
+
+def emit_event(db, event: str, body: dict, session=None):
+    """
+    Registra un evento de dominio en la colección `outbox` de la base del
+    servicio. El relay lo publica después en RabbitMQ. Con
+    OUTBOX_ENABLED=false se publica directamente como antes.
+    """
+    if not OUTBOX_ENABLED:
+        publish_event(event, body)
+        return
+    db["outbox"].insert_one({
+        "event": event,
+        "body": body,
+        "created_at": datetime.now(),
+        "published_at": None,
+    }, session=session)
+
+
+def emit_events(db, events, session=None):
+    """
+    Registra varios eventos [(evento, cuerpo), ...] con un solo
+    insert_many; el relay los publica en lotes.
+    """
+    if not events:
+        return
+    if not OUTBOX_ENABLED:
+        for event, body in events:
+            publish_event(event, body)
+        return
+    now = datetime.now()
+    db["outbox"].insert_many([{
+        "event": event,
+        "body": body,
+        "created_at": now,
+        "published_at": None,
+    } for event, body in events], session=session)
+
+
+async def emit_event_async(db, event: str, body: dict, session=None):
+    """Versión de `emit_event` para una base de `mongo.main.async_database`."""
+    if not OUTBOX_ENABLED:
+        await publish_event_async(event, body)
+        return
+    await db["outbox"].insert_one({
+        "event": event,
+        "body": body,
+        "created_at": datetime.now(),
+        "published_at": None,
+    }, session=session)
+
+
+class OutboxRelay:
+    """
+    Drena el outbox de un servicio hacia RabbitMQ en lotes y en orden de _id.
+
+    Sólo un proceso por base de datos publica a la vez (lease en
+    `outbox_checkpoint`), así el orden se mantiene aunque el HPA escale los
+    pods. Tras cada lote se marca `published_at` y se avanza el checkpoint.
+    """
+
+    def __init__(self, db, name="relay", batch_size=OUTBOX_BATCH_SIZE,
+                 poll_interval=OUTBOX_POLL_INTERVAL):
+        self.db = db
+        self.name = name
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.outbox = db["outbox"]
+        self.checkpoints = db["outbox_checkpoint"]
+        self.owner = f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+        self.logger = logging.getLogger("Outbox_Relay")
+        self._stopped = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "relayed": 0,
+            "batches": 0,
+            "errors": 0,
+            "last_id": None,
+            "leader": False,
+        }
+
+    def ensure_indexes(self):
+        self.outbox.create_index([("published_at", pymongo.ASCENDING),
+                                  ("_id", pymongo.ASCENDING)])
+        # TTL: sólo expiran los eventos que ya fueron publicados
+        self.outbox.create_index("published_at",
+                                 name="published_at_ttl",
+                                 expireAfterSeconds=OUTBOX_RETENTION_SECONDS)
+
+    def start(self):
+        if not OUTBOX_ENABLED or self._thread is not None:
+            return
+        try:
+            self.ensure_indexes()
+        except PyMongoError as e:
+            self.logger.info(f"No se pudieron crear los índices del outbox: {e}")
+        self._thread = threading.Thread(
+            target=self._run, name=f"outbox-{self.db.name}", daemon=True)
+        self._thread.start()
+        _relays.append(self)
+
+    def stop(self):
+        self._stopped.set()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["database"] = self.db.name
+        stats["last_id"] = str(stats["last_id"]) if stats["last_id"] else None
+        try:
+            stats["pending"] = self.outbox.count_documents(
+                {"published_at": None})
+        except PyMongoError:
+            stats["pending"] = None
+        return stats
+
+    def _acquire_lease(self):
+        now = datetime.now()
+        try:
+            self.checkpoints.find_one_and_update(
+                {"_id": self.name,
+                 "$or": [{"owner": self.owner},
+                         {"lease_until": {"$lt": now}}]},
+                {"$set": {"owner": self.owner,
+                          "lease_until": now + timedelta(
+                              seconds=OUTBOX_LEASE_SECONDS)}},
+                upsert=True,
+            )
+            return True
+        except DuplicateKeyError:
+            # Otro proceso tiene el lease vigente
+            return False
+
+    def _run(self):
+        while not self._stopped.is_set():
+            relayed = 0
+            try:
+                leader = self._acquire_lease()
+                with self._lock:
+                    self._stats["leader"] = leader
+                if leader:
+                    relayed = self.relay_batch()
+            except Exception as e:
+                with self._lock:
+                    self._stats["errors"] += 1
+                self.logger.info(f"Error en el relay del outbox: {e}")
+            # Si el lote vino lleno se sigue drenando sin esperar
+            if relayed < self.batch_size:
+                self._stopped.wait(self.poll_interval)
+
+    def relay_batch(self):
+        batch = list(self.outbox.find(
+            {"published_at": None},
+            {"event": 1, "body": 1},
+        ).sort("_id", pymongo.ASCENDING).limit(self.batch_size))
+        if not batch:
+            return 0
+
+        published = self._publish(batch)
+        if published:
+            ids = [doc["_id"] for doc in batch[:published]]
+            self.outbox.update_many({"_id": {"$in": ids}},
+                                    {"$set": {"published_at": datetime.now()}})
+            self.checkpoints.update_one(
+                {"_id": self.name, "owner": self.owner},
+                {"$set": {"last_id": ids[-1], "updated_at": datetime.now()},
+                 "$inc": {"relayed": published}})
+            with self._lock:
+                self._stats["relayed"] += published
+                self._stats["batches"] += 1
+                self._stats["last_id"] = ids[-1]
+        if published < len(batch):
+            raise RuntimeError(
+                f"Sólo se publicaron {published} de {len(batch)} eventos")
+        return published
+
+    def _publish(self, batch):
+        # Devuelve cuántos eventos del inicio del lote quedaron publicados
+        if PUBLISHER_CONFIRMS:
+            publisher = get_confirm_publisher()
+            # El _id del outbox como message_id: si el lote se vuelve a
+            # publicar tras un corte, los consumers descartan los repetidos
+            futures = [publisher.publish(doc["event"], doc["body"],
+                                         str(doc["_id"]))
+                       for doc in batch]
+            for index, future in enumerate(futures):
+                try:
+                    future.result(timeout=PUBLISHER_CONFIRM_TIMEOUT)
+                except Exception as e:
+                    self.logger.info(f"Error publicando evento: {e}")
+                    return index
+            return len(batch)
+
+        publisher = get_publisher()
+        for index, doc in enumerate(batch):
+            try:
+                publisher.publish(doc["event"], doc["body"],
+                                  message_id=str(doc["_id"]))
+            except Exception as e:
+                self.logger.info(f"Error publicando evento: {e}")
+                return index
+        return len(batch)
+
+
+def relay_stats():
+    return [relay.stats() for relay in _relays]
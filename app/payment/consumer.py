@@ -1,15 +1,13 @@
-import json
 import os
-import time
-from fastapi import FastAPI
-import pika
-from pika.exchange_type import ExchangeType
-import requests
 import logging
-from ..rabbit.main import Consumer
+from ..rabbit.main import (CONSUMER_RUNTIME, CONSUMER_TRANSPORT, Consumer,
+                           EventAction, EventCallback)
+from ..rabbit.async_consumer import AsyncConsumer
+from ..migrations.main import require_unique_indexes
+from ..rabbit.dedup import DedupStore
+from . import main as payment_service
 
 rabbitmq_url = os.getenv("RABBITMQ_URL")
-RETRY_DELAY = 5
 
 
 logging.basicConfig(level=logging.INFO)
@@ -17,16 +15,12 @@ logger = logging.getLogger("Consumer_Payment")
 url = f"http://payment-container:8002/api/v1/"
 
 
-def callback(ch, method, properties, body):
-
-    message = json.loads(body)
-
-    event = method.routing_key
+def actions(event, message):
     _, payment_id, action = event.split('.')
+    student_id = message.get("student_id")
+    data = message.get("data")
 
-    if action == "created":
-        student_id = message.get("student_id")
-        data = message.get("data")
+    if action in ("created", "updated"):
         body = {
             "amount": data["amount"],
             "debt_id": data["debt_id"],
@@ -37,46 +31,42 @@ def callback(ch, method, properties, body):
             "type": data["type"],
             "year": data["year"]
         }
-        try:
-            response = requests.post(
-                url+f"{student_id}/payments", json=body)
-            response.raise_for_status()
-            logger.info("✅ Pago registrado")
-        except requests.exceptions.RequestException as e:
-            logger.info("❌ Error al registrar el pago:", e)
 
-    elif action == "updated":
-        student_id = message.get("student_id")
-        data = message.get("data")
-        body = {
-            "amount": data["amount"],
-            "debt_id": data["debt_id"],
-            "description": data["description"],
-            "month": data["month"],
-            "payment_id": data["payment_id"],
-            "semester": data["semester"],
-            "type": data["type"],
-            "year": data["year"]
-        }
-        try:
-            response = requests.put(
-                url+f"{student_id}/payments/{payment_id}", json=body)
-            response.raise_for_status()
-            logger.info("✅ Pago actualizado")
-        except requests.exceptions.RequestException as e:
-            logger.info("❌ Error al actualizar el pago:", e)
+    if action == "created":
+        return [EventAction(
+            payment_service.store_payment,
+            (student_id, payment_service.Payment(**body)),
+            "POST", f"{student_id}/payments", body,
+            success="✅ Pago registrado",
+            error="❌ Error al registrar el pago")]
+
+    if action == "updated":
+        return [EventAction(
+            payment_service.update_payment,
+            (student_id, payment_id, payment_service.UpdatePayment(**body)),
+            "PUT", f"{student_id}/payments/{payment_id}", body,
+            success="✅ Pago actualizado",
+            error="❌ Error al actualizar el pago")]
+
+    if action == "deleted":
+        return [EventAction(
+            payment_service.delete_payment, (student_id, payment_id),
+            "DELETE", f"{student_id}/payments/{payment_id}",
+            success="✅ Pago eliminado",
+            error="❌ Error al eliminar el pago")]
+
+    return []
 
-    elif action == "deleted":
-        student_id = message.get("student_id")
-        try:
-            response = requests.delete(
-                url+f"{student_id}/payments/{payment_id}")
-            response.raise_for_status()
-            logger.info("✅ Pago eliminado")
-        except requests.exceptions.RequestException as e:
-            logger.info("❌ Error al eliminar el pago:", e)
 
-    ch.basic_ack(delivery_tag=method.delivery_tag)
+callback = EventCallback(url, actions, logger,
+                         dedup=DedupStore("payments", payment_service.db))
 
 
-Consumer("payments", callback)
+if __name__ == "__main__":
+    if CONSUMER_TRANSPORT == "direct":
+        # Escribe con las funciones del servicio: necesita sus índices únicos
+        require_unique_indexes(payment_service.db)
+    if CONSUMER_RUNTIME == "asyncio":
+        AsyncConsumer("payments", callback)
+    else:
+        Consumer("payments", callback)
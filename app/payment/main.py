@@ -1,8 +1,10 @@
 from datetime import datetime
 import json
 import threading
-from fastapi import FastAPI, Form, HTTPException, status, Query
-from pydantic import BaseModel
+from fastapi import FastAPI, Form, HTTPException, status, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
 from fastapi.middleware.cors import CORSMiddleware
 
 import time
@@ -14,7 +16,19 @@ import pika
 from pika.exchange_type import ExchangeType
 from enum import Enum
 from ..routers.router import prefix, router
-from ..rabbit.main import get_rabbitmq_connection, publish_event
+from ..metrics.main import install_metrics
+from ..rabbit.main import get_rabbitmq_connection
+from ..outbox.main import (OutboxRelay, async_transaction, emit_event_async,
+                           emit_events, transaction)
+from ..mongo.main import async_database, get_client
+from ..mongo.items import (ItemStore, PageQuery, decode_position,
+                           encode_position, find_page_async)
+from ..migrations.main import run_migrations
+from ..cache.main import ReadCache, start_invalidation
+from ..responses.main import FastJSONResponse, trusted_rows
+from ..balance.main import BalanceView
+from ..stream.main import (EXPORT_BATCH_SIZE, EXPORT_MEDIA_TYPES,
+                           ImportErrors, chunked, export_lines, iter_rows)
 
 from typing import Optional, List
 
@@ -23,15 +37,29 @@ load_dotenv()
 
 rabbitmq_url = os.getenv("RABBITMQ_URL")
 
-mongo_client = pymongo.MongoClient("mongodb://mongodb:27017/",
-                                   username=os.getenv("MONGO_ADMIN_USER"),
-                                   password=os.getenv("MONGO_ADMIN_PASS"))
+mongo_client = get_client()
 
 db = mongo_client["payment"]
-payments_collection = db["payments"]
+# Base asíncrona para el outbox de los endpoints async
+async_db = async_database("payment")
+# Pagos: embebidos en el documento del estudiante o un documento por pago,
+# según STORAGE_LAYOUT
+payments_store = ItemStore("payment", "payments", "payments", "payment_id",
+                           "payment_items")
+# Listados de pagos por estudiante
+read_cache = ReadCache("payment")
+# Lo pagado del saldo de cada estudiante (ver /{student_id}/balance en el
+# servicio de aranceles)
+payments_balance = BalanceView("payment", "paid", payments_store)
+outbox_relay = OutboxRelay(db)
+
+# Filas por lote en la importación de pagos del banco
+PAYMENT_IMPORT_CHUNK_SIZE = int(
+    os.getenv("PAYMENT_IMPORT_CHUNK_SIZE", "1000"))
 
 app = FastAPI()
 app.include_router(router)
+install_metrics(app)
 
 app.add_middleware(
     CORSMiddleware,
@@ -40,6 +68,29 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+
+
+@app.on_event("startup")
+def apply_migrations():
+    run_migrations(db)
+
+
+@app.on_event("startup")
+def start_outbox_relay():
+    outbox_relay.start()
+
+
+@app.on_event("startup")
+def start_cache_invalidation():
+    start_invalidation("payments", read_cache)
+
+# Campos de un pago que devuelven las consultas
+PAYMENT_FIELDS = ["payment_id", "debt_id", "type", "amount", "semester",
+                  "month", "year", "status", "description", "created_at",
+                  "updated_at"]
+# Un estudiante no puede pagar dos veces la misma deuda en el mismo periodo
+PAYMENT_PERIOD_FIELDS = ["debt_id", "month", "semester", "year"]
+
 # ----- Schemas ------
 
 
@@ -121,6 +172,7 @@ class PaginatedPaymentsResponse(BaseModel):
     page: int
     page_size: int
     payments: List[PaymentResponse]
+    next_cursor: Optional[str] = None
 
 # ----------------------End Points-------------------------------
 
@@ -137,17 +189,14 @@ class PaginatedPaymentsResponse(BaseModel):
 )
 async def store_payment(student_id: str, payment: Payment):
     try:
-        existing_payment_check = payments_collection.find_one({
-            "student_id": student_id,
-            "payments": {
-                "$elemMatch": {
-                    "debt_id": payment.debt_id,
-                    "month": payment.month,
-                    "semester": payment.semester,
-                    "year": payment.year
-                }
-            }
-        })
+        existing_payment_check = await payments_store.async_collection.find_one(
+            payments_store.elem_filter(student_id, {
+                "debt_id": payment.debt_id,
+                "month": payment.month,
+                "semester": payment.semester,
+                "year": payment.year
+            })
+        )
 
         if existing_payment_check:
             raise HTTPException(
@@ -155,8 +204,8 @@ async def store_payment(student_id: str, payment: Payment):
                 detail=f"Ya existe un pago registrado para la deuda {
                     payment.debt_id} del estudiante con ID {student_id} el {payment.month}/{payment.year}"
             )
-        existing_payment = payments_collection.find_one(
-            {"payments": {"$elemMatch": {"payment_id": payment.payment_id}}}
+        existing_payment = await payments_store.async_collection.find_one(
+            payments_store.id_filter(payment.payment_id)
         )
 
         if existing_payment:
@@ -171,19 +220,23 @@ async def store_payment(student_id: str, payment: Payment):
             "created_at": datetime.now()
         })
 
-        result = payments_collection.update_one(
-            {"student_id": student_id},
-            {"$push": {"payments": payment_dict}}
-        )
-
-        if result.matched_count == 0:
-            new_student = {
+        # El pago y su evento se guardan juntos; el relay del outbox lo
+        # publica en RabbitMQ fuera del request
+        async with async_transaction() as session:
+            await payments_store.add_async(student_id, [payment_dict],
+                                           session=session)
+            await payments_balance.apply_async(student_id, after=payment_dict,
+                                               session=session)
+
+            await emit_event_async(async_db, f"debts.{payment.debt_id}.updated",
+                                   {
+                "origin_service": "payments",
                 "student_id": student_id,
-                "payments": [payment_dict]
-            }
-            payments_collection.insert_one(new_student)
+                "data": payment.dict()
+            }, session=session)
+        read_cache.invalidate(student_id)
 
-        student = payments_collection.find_one({"student_id": student_id})
+        student = await payments_store.student_async(student_id)
         if not student:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -191,14 +244,6 @@ async def store_payment(student_id: str, payment: Payment):
                     student_id}"
             )
 
-        student.pop('_id', None)
-
-        publish_event(f"debts.{payment.debt_id}.updated",
-                      {
-            "origin_service": "payments",
-            "student_id": student_id,
-            "data": payment.dict()
-        })
         return {"msg": "Pago registrado correctamente!", "student_payments": "student"}
 
     except HTTPException:
@@ -214,6 +259,262 @@ async def store_payment(student_id: str, payment: Payment):
             detail=f"Se produjo un error inesperado: {str(e)}"
         )
 
+
+def import_payment_row(row):
+    """
+    Valida una fila de la importación: {"student_id": ..., "payment": {...}}
+    o los campos del pago junto al student_id (así vienen las columnas del
+    CSV). Devuelve ((student_id, pago), None) o (None, error).
+    """
+    if not isinstance(row, dict):
+        return None, "La fila debe ser un objeto JSON"
+    student_id = row.get("student_id")
+    if not isinstance(student_id, str) or not student_id:
+        return None, "student_id es obligatorio"
+    fields = row.get("payment", {k: v for k, v in row.items()
+                                   if k != "student_id"})
+    try:
+        payment = Payment(**fields)
+    except (ValidationError, TypeError) as e:
+        if isinstance(e, ValidationError):
+            return None, "; ".join(
+                f"{'.'.join(map(str, error['loc']))}: {error['msg']}"
+                for error in e.errors())
+        return None, str(e)
+    return (student_id, payment), None
+
+
+def payment_period(student_id, payment):
+    return (student_id, *(payment.get(field)
+                          for field in PAYMENT_PERIOD_FIELDS))
+
+
+def existing_payment_periods(student_ids, debt_ids):
+    """
+    Periodos (student_id, debt_id, month, semester, year) ya pagados entre
+    los estudiantes y deudas de un lote, con una sola consulta.
+    """
+    projection = {"_id": 0, "student_id": 1}
+    projection.update({payments_store.path(field): 1
+                       for field in PAYMENT_PERIOD_FIELDS})
+    periods = set()
+    for document in payments_store.collection.find(
+            {"student_id": {"$in": list(student_ids)},
+             payments_store.path("debt_id"): {"$in": list(debt_ids)}},
+            projection):
+        items = document.get(payments_store.array, []) \
+            if payments_store.embedded else [document]
+        periods.update(payment_period(document["student_id"], item)
+                       for item in items)
+    return periods
+
+
+def store_payments_chunk(rows, now=None):
+    """
+    Registra un lote de la importación [(fila, student_id, Payment), ...].
+    Descarta los pagos cuyo periodo ya estaba pagado o cuyo payment_id ya
+    existe (en la base o antes en el mismo lote), como los 409 de
+    store_payment. Los pagos, el resumen de saldo y los eventos del outbox
+    se escriben en una transacción: si el proceso cae a mitad del lote no
+    quedan pagos sin su evento. Devuelve (registrados, errores por fila).
+    """
+    now = now or datetime.now()
+    for attempt in range(2):
+        failed, payments = filter_payments_chunk(rows, now)
+        try:
+            with transaction(mongo_client) as session:
+                stored = write_payments_chunk(payments, failed, session)
+            break
+        except pymongo.errors.BulkWriteError:
+            # Otro request registró uno de los pagos entre el filtro y la
+            # escritura: la transacción se abortó y el lote se filtra de nuevo
+            if attempt:
+                raise
+
+    for student_id in {student_id for student_id, _ in stored}:
+        read_cache.invalidate(student_id)
+
+    errors = [{
+        "row": rows[i][0],
+        "student_id": rows[i][1],
+        "payment_id": rows[i][2].payment_id,
+        "error": message
+    } for i, message in sorted(failed.items())]
+    return len(stored), errors
+
+
+def filter_payments_chunk(rows, now):
+    """
+    Separa un lote en ({índice: error}, [(índice, student_id, pago)]) con
+    una consulta de periodos y una de payment_id.
+    """
+    existing = existing_payment_periods(
+        {student_id for _, student_id, _ in rows},
+        {payment.debt_id for _, _, payment in rows})
+    existing_ids = payments_store.existing_ids(
+        payment.payment_id for _, _, payment in rows)
+
+    failed = {}
+    payments = []
+    for i, (_, student_id, payment) in enumerate(rows):
+        payment_dict = payment.model_dump()
+        period = payment_period(student_id, payment_dict)
+        if period in existing:
+            failed[i] = (f"Ya existe un pago registrado para la deuda "
+                         f"{payment.debt_id} el {payment.month}/{payment.year}")
+            continue
+        if payment.payment_id in existing_ids:
+            failed[i] = "El pago ya existe"
+            continue
+        existing.add(period)
+        existing_ids.add(payment.payment_id)
+        payment_dict.update({"status": "active", "created_at": now})
+        payments.append((i, student_id, payment_dict))
+    return failed, payments
+
+
+def write_payments_chunk(payments, failed, session):
+    """
+    Inserta los pagos filtrados, su parte del saldo y sus eventos. Sin
+    transacción (standalone) un pago que choca falla sólo en su fila, como
+    antes; dentro de una, el error aborta el lote.
+    """
+    if payments:
+        try:
+            payments_store.collection.bulk_write(
+                [payments_store.insert_op(student_id, payment_dict)
+                 for _, student_id, payment_dict in payments],
+                ordered=False, session=session)
+        except pymongo.errors.BulkWriteError as e:
+            if session is not None:
+                raise
+            for error in e.details.get("writeErrors", []):
+                failed[payments[error["index"]][0]] = (
+                    "El pago ya existe" if error.get("code") == 11000
+                    else error.get("errmsg"))
+
+    stored = [(student_id, payment_dict)
+              for i, student_id, payment_dict in payments if i not in failed]
+    if stored:
+        payments_balance.collection.bulk_write([
+            operation
+            for student_id, payment_dict in stored
+            for operation in payments_balance.ops(student_id,
+                                                  after=payment_dict)
+        ], ordered=False, session=session)
+        # El mismo evento que store_payment: marca pagada la deuda
+        emit_events(db, [
+            (f"debts.{payment_dict['debt_id']}.updated", {
+                "origin_service": "payments",
+                "student_id": student_id,
+                "data": {field: payment_dict[field]
+                         for field in Payment.model_fields}
+            }) for student_id, payment_dict in stored], session=session)
+    return stored
+
+
+# Exportar pagos por semestre:
+
+
+@app.get(f"{prefix}/payments/export",
+         status_code=status.HTTP_200_OK,
+         summary="Exportar pagos de todos los estudiantes",
+         description="""
+    Descarga como NDJSON o CSV todos los pagos que cumplen los filtros
+    (`semester`, `year` y `type`), leídos de Mongo por lotes y enviados a
+    medida que llegan, sin armar la respuesta completa en memoria. Cada fila
+    trae `resume_token`: si la descarga se corta, repetirla con
+    `resume=<token de la última fila recibida>` continúa después de esa fila.
+    """, tags=["GET"])
+def export_payments(
+    semester: Optional[str] = Query(
+        default=None, description="Filtrar por semestre"),
+    year: Optional[int] = Query(default=None, description="Filtrar por año"),
+    payment_type: Optional[str] = Query(
+        default=None, alias="type", description="Filtrar por tipo de pago"),
+    output: str = Query(default="ndjson", alias="format",
+                        enum=list(EXPORT_MEDIA_TYPES),
+                        description="Formato de salida"),
+    resume: Optional[str] = Query(
+        default=None,
+        description="resume_token de la última fila recibida")
+):
+    filters = {}
+    if semester is not None:
+        filters["semester"] = semester
+    if year is not None:
+        filters["year"] = year
+    if payment_type is not None:
+        filters["type"] = payment_type
+
+    # Un token inválido responde 400 antes de empezar a enviar
+    position = decode_position(resume, payments_store) if resume else None
+    rows = payments_store.export(filters, position, EXPORT_BATCH_SIZE)
+    period = [str(value) for value in (semester, year) if value is not None]
+    name = "-".join(["payments", *period])
+    return StreamingResponse(
+        export_lines(rows, PAYMENT_FIELDS, output, encode_position),
+        media_type=EXPORT_MEDIA_TYPES[output],
+        headers={"Content-Disposition":
+                 f'attachment; filename="{name}.{output}"'})
+
+
+# Importar pagos del banco:
+
+
+@app.post(f"{prefix}/payments/import",
+          status_code=status.HTTP_200_OK,
+          summary="Importar pagos desde un archivo del banco",
+          description="""
+    Recibe un CSV (`Content-Type: text/csv`, con encabezado), NDJSON
+    (`application/x-ndjson`) o un arreglo JSON de pagos con su
+    `student_id` y los registra por lotes a medida que llega el cuerpo, sin
+    cargar el archivo en memoria. Los pagos de un periodo (deuda, mes,
+    semestre y año) que el estudiante ya tiene pagado se rechazan, igual
+    que en el registro individual. Por cada pago registrado se publica
+    `debts.{debt_id}.updated`. Responde con el total registrado, la
+    cantidad de filas rechazadas y el error de cada una (`row` es su
+    posición, desde 0, sin contar el encabezado); pasados
+    `IMPORT_MAX_ERRORS` errores sólo se cuentan y `errors_truncated` es
+    `true`.
+    """, tags=["POST"])
+async def import_payments(request: Request):
+    started = time.perf_counter()
+    received = 0
+    stored = 0
+    errors = ImportErrors()
+    try:
+        async for chunk in chunked(iter_rows(request),
+                                   PAYMENT_IMPORT_CHUNK_SIZE):
+            rows = []
+            for index, row, error in chunk:
+                received += 1
+                if error is None:
+                    parsed, error = import_payment_row(row)
+                if error is not None:
+                    errors.add({"row": index, "error": error})
+                    continue
+                rows.append((index, *parsed))
+            if rows:
+                chunk_stored, chunk_errors = await run_in_threadpool(
+                    store_payments_chunk, rows)
+                stored += chunk_stored
+                errors.extend(chunk_errors)
+
+        return {
+            "received": received,
+            "stored": stored,
+            **errors.report(),
+            "seconds": round(time.perf_counter() - started, 3)
+        }
+
+    except pymongo.errors.PyMongoError as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Se produjo un error en la base de datos tras registrar {
+                stored} pagos: {str(e)}"
+        )
+
 # Actualizar información de un pago:
 
 
@@ -240,22 +541,18 @@ async def update_payment(student_id: str, payment_id: str, update_payment: Updat
 
         update_data['updated_at'] = datetime.now()
 
-        result = payments_collection.update_one(
-            {
-                "student_id": student_id,
-                "payments.payment_id": payment_id
-            },
-            {
-                "$set": {
-                    f"payments.$.{key}": value
-                    for key, value in update_data.items()
-                }
-            }
-        )
-
-        if result.matched_count == 0:
-            student = payments_collection.find_one({"student_id": student_id})
-            if not student:
+        # El pago y el resumen de saldo se actualizan juntos
+        async with async_transaction() as session:
+            before = await payments_store.update_item_async(
+                student_id, payment_id, update_data, session=session)
+            if before is not None:
+                await payments_balance.apply_async(
+                    student_id, before, {**before, **update_data},
+                    session=session)
+        read_cache.invalidate(student_id)
+
+        if before is None:
+            if not await payments_store.student_exists_async(student_id):
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail=f"Estudiante con ID {student_id} no fue encontrado"
@@ -266,18 +563,13 @@ async def update_payment(student_id: str, payment_id: str, update_payment: Updat
                     payment_id} no encontrado para estudiante {student_id}"
             )
 
-        if result.modified_count == 0:
-            return payments_collection.find_one({"student_id": student_id})
-
-        updated_student = payments_collection.find_one(
-            {"student_id": student_id})
+        updated_student = await payments_store.student_async(student_id)
         if not updated_student:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="No se pudo recuperar el registro actualizado del estudiante"
             )
 
-        updated_student.pop('_id', None)
         return {"msg": "Pago actualizado correctamente!", "student_updated": updated_student}
 
     except HTTPException:
@@ -307,24 +599,15 @@ async def update_payment(student_id: str, payment_id: str, update_payment: Updat
 )
 async def delete_payment(student_id: str, payment_id: str):
     try:
-        try:
-            payment = payments_collection.aggregate([
-                {"$match": {"student_id": student_id}},
-                {"$unwind": "$payments"},
-                {"$match": {"payments.payment_id": payment_id}},
-                {"$project": {
-                    "_id": 0,
-                    "status": "$payments.status"
-                }}
-            ]).next()
-
-        except StopIteration:
-            student = payments_collection.find_one({"student_id": student_id})
-            if not student:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail=f"Estudiante con ID {student_id} no fue encontrado"
-                )
+        student_exists, payment = await payments_store.find_item_async(
+            student_id, payment_id, ["status"])
+
+        if not student_exists:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Estudiante con ID {student_id} no fue encontrado"
+            )
+        if payment is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Pago con ID {
@@ -337,52 +620,37 @@ async def delete_payment(student_id: str, payment_id: str):
                 detail=f"Pago con ID {payment_id} ya fue eliminado"
             )
 
-        update_result = payments_collection.update_one(
-            {
-                "student_id": student_id,
-                "payments.payment_id": payment_id
-            },
-            {
-                "$set": {
-                    "payments.$.status": "inactived",
-                    "payments.$.updated_at": datetime.now()
-                }
-            }
-        )
-
-        if update_result.modified_count == 0:
+        # Sólo si sigue activo: dos DELETE simultáneos descuentan una vez.
+        # El pago y el resumen de saldo se actualizan juntos
+        async with async_transaction() as session:
+            before = await payments_store.update_item_async(
+                student_id, payment_id,
+                {"status": "inactived", "updated_at": datetime.now()},
+                conditions={"status": {"$ne": "inactived"}},
+                session=session)
+            if before is not None:
+                await payments_balance.apply_async(
+                    student_id, before, {**before, "status": "inactived"},
+                    session=session)
+        read_cache.invalidate(student_id)
+
+        if before is None:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Error al eliminar el pago"
             )
 
-        updated_payment = payments_collection.aggregate([
-            {"$match": {"student_id": student_id}},
-            {"$unwind": "$payments"},
-            {"$match": {"payments.payment_id": payment_id}},
-            {"$project": {
-                "_id": 0,
-                "payment_id": "$payments.payment_id",
-                "debt_id": "$payments.debt_id",
-                "type": "$payments.type",
-                "amount": "$payments.amount",
-                "semester": "$payments.semester",
-                "month": "$payments.month",
-                "year": "$payments.year",
-                "status": "$payments.status",
-                "description": "$payments.description",
-                "created_at": "$payments.created_at",
-                "updated_at": "$payments.updated_at"
-            }}
-        ]).next()
+        _, updated_payment = await payments_store.find_item_async(
+            student_id, payment_id, PAYMENT_FIELDS)
+
+        if updated_payment is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="No se pudo recuperar el pago actualizado"
+            )
 
         return updated_payment
 
-    except StopIteration:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="No se pudo recuperar el pago actualizado"
-        )
     except HTTPException:
         raise
     except pymongo.errors.PyMongoError as e:
@@ -410,35 +678,15 @@ async def delete_payment(student_id: str, payment_id: str):
 )
 async def get_payment(student_id: str, payment_id: str):
     try:
-        payment_cursor = payments_collection.aggregate([
-            {"$match": {"student_id": student_id}},
-            {"$unwind": "$payments"},
-            {"$match": {"payments.payment_id": payment_id}},
-            {"$project": {
-                "_id": 0,
-                "payment_id": "$payments.payment_id",
-                "debt_id": "$payments.debt_id",
-                "type": "$payments.type",
-                "amount": "$payments.amount",
-                "semester": "$payments.semester",
-                "month": "$payments.month",
-                "year": "$payments.year",
-                "status": "$payments.status",
-                "description": "$payments.description",
-                "created_at": "$payments.created_at",
-                "updated_at": "$payments.updated_at"
-            }}
-        ])
+        student_exists, payment = await payments_store.find_item_async(
+            student_id, payment_id, PAYMENT_FIELDS)
 
-        try:
-            payment = payment_cursor.next()
-        except StopIteration:
-            student = payments_collection.find_one({"student_id": student_id})
-            if not student:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail=f"Estudiante con ID {student_id} no fue encontrado"
-                )
+        if not student_exists:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Estudiante con ID {student_id} no fue encontrado"
+            )
+        if payment is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Pago con ID {
@@ -477,8 +725,8 @@ async def get_payments(
     page: int = Query(default=1, ge=1, description="Page number"),
     page_size: int = Query(default=10, ge=1, le=100,
                            description="Items per page"),
-    status: Optional[PaymentStatus] = Query(
-        default=None, description="Filter by payment status"),
+    status_filter: Optional[PaymentStatus] = Query(
+        default=None, alias="status", description="Filter by payment status"),
     min_amount: Optional[float] = Query(
         default=None, ge=0, description="Minimum payment amount"),
     max_amount: Optional[float] = Query(
@@ -496,83 +744,60 @@ async def get_payments(
         default="desc",
         enum=["asc", "desc"],
         description="Sort order"
-    )
+    ),
+    cursor: Optional[str] = Query(
+        default=None,
+        description="next_cursor of the previous page (replaces page)")
 ):
     try:
-        student = payments_collection.find_one({"student_id": student_id})
-        if not student:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Student with ID {student_id} not found"
-            )
-        match_conditions = {"student_id": student_id}
         filter_conditions = {}
 
-        if status:
-            filter_conditions["payments.status"] = status.value
+        if status_filter:
+            filter_conditions["status"] = status_filter.value
 
         if min_amount is not None:
-            filter_conditions["payments.amount"] = {"$gte": min_amount}
+            filter_conditions["amount"] = {"$gte": min_amount}
         if max_amount is not None:
-            filter_conditions["payments.amount"] = {
-                **filter_conditions.get("payments.amount", {}),
+            filter_conditions["amount"] = {
+                **filter_conditions.get("amount", {}),
                 "$lte": max_amount
             }
 
         if from_date:
-            filter_conditions["payments.created_at"] = {"$gte": from_date}
+            filter_conditions["created_at"] = {"$gte": from_date}
         if to_date:
-            filter_conditions["payments.created_at"] = {
-                **filter_conditions.get("payments.created_at", {}),
+            filter_conditions["created_at"] = {
+                **filter_conditions.get("created_at", {}),
                 "$lte": to_date
             }
 
-        pipeline = [
-            {"$match": match_conditions},
-            {"$unwind": "$payments"},
-        ]
-
-        if filter_conditions:
-            pipeline.append({"$match": filter_conditions})
-
-        sort_direction = pymongo.DESCENDING if sort_order == "desc" else pymongo.ASCENDING
-        pipeline.append({"$sort": {f"payments.{sort_by}": sort_direction}})
-
-        count_pipeline = pipeline.copy()
-        count_pipeline.append({"$count": "total"})
-        total_count = list(payments_collection.aggregate(count_pipeline))
-        total = total_count[0]["total"] if total_count else 0
-
-        pipeline.extend([
-            {"$skip": (page - 1) * page_size},
-            {"$limit": page_size},
-            {
-                "$project": {
-                    "_id": 0,
-                    "payment_id": "$payments.payment_id",
-                    "debt_id": "$payments.debt_id",
-                    "type": "$payments.type",
-                    "amount": "$payments.amount",
-                    "month": "$payments.month",
-                    "semester": "$payments.semester",
-                    "year": "$payments.year",
-                    "status": "$payments.status",
-                    "description": "$payments.description",
-                    "created_at": "$payments.created_at",
-                    "updated_at": "$payments.updated_at"
-                }
-            }
-        ])
-
-        payments = list(payments_collection.aggregate(pipeline))
+        student_exists, total, payments, next_cursor = \
+            await read_cache.get_or_load_async(
+                student_id,
+                ["payments", filter_conditions, sort_by, sort_order, page,
+                 page_size, cursor],
+                lambda: find_page_async(PageQuery(
+                    payments_store, student_id, PAYMENT_FIELDS,
+                    filter_conditions, sort_by, sort_order, page, page_size,
+                    cursor)))
+
+        if not student_exists:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Student with ID {student_id} not found"
+            )
 
-        return PaginatedPaymentsResponse(
-            total=total,
-            page=page,
-            page_size=page_size,
-            payments=payments
-        )
+        # Filas de nuestra proyección: sin validar de nuevo con el modelo
+        return FastJSONResponse({
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "payments": trusted_rows(PaymentResponse, payments),
+            "next_cursor": next_cursor
+        })
 
+    except HTTPException:
+        raise
     except pymongo.errors.PyMongoError as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -604,8 +829,9 @@ async def get_debt_payments(
     page: int = Query(default=1, ge=1, description="Número de página"),
     page_size: int = Query(default=10, ge=1, le=100,
                            description="Elementos por página"),
-    status: Optional[PaymentStatus] = Query(
-        default=None, description="Filtrar por estado del pago"),
+    status_filter: Optional[PaymentStatus] = Query(
+        default=None, alias="status",
+        description="Filtrar por estado del pago"),
     from_date: Optional[datetime] = Query(
         default=None, description="Filtrar pagos desde esta fecha"),
     to_date: Optional[datetime] = Query(
@@ -614,42 +840,40 @@ async def get_debt_payments(
         default="desc",
         enum=["asc", "desc"],
         description="Orden de clasificación"
-    )
+    ),
+    cursor: Optional[str] = Query(
+        default=None,
+        description="next_cursor de la página anterior (reemplaza a page)")
 ):
     try:
-        student = payments_collection.find_one({"student_id": student_id})
-        if not student:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Estudiante con ID {student_id} no fue encontrado"
-            )
+        filter_conditions = {"debt_id": debts_id}
 
-        pipeline = [
-            {"$match": {"student_id": student_id}},
-            {"$unwind": "$payments"},
-            {"$match": {"payments.debt_id": debts_id}}
-        ]
-
-        filter_conditions = {}
-
-        if status:
-            filter_conditions["payments.status"] = status.value
+        if status_filter:
+            filter_conditions["status"] = status_filter.value
 
         if from_date:
-            filter_conditions["payments.created_at"] = {"$gte": from_date}
+            filter_conditions["created_at"] = {"$gte": from_date}
         if to_date:
-            filter_conditions["payments.created_at"] = {
-                **filter_conditions.get("payments.created_at", {}),
+            filter_conditions["created_at"] = {
+                **filter_conditions.get("created_at", {}),
                 "$lte": to_date
             }
 
-        if filter_conditions:
-            pipeline.append({"$match": filter_conditions})
-
-        count_pipeline = pipeline.copy()
-        count_pipeline.append({"$count": "total"})
-        total_count = list(payments_collection.aggregate(count_pipeline))
-        total = total_count[0]["total"] if total_count else 0
+        student_exists, total, payments, next_cursor = \
+            await read_cache.get_or_load_async(
+                student_id,
+                ["debt_payments", filter_conditions, sort_order, page,
+                 page_size, cursor],
+                lambda: find_page_async(PageQuery(
+                    payments_store, student_id, PAYMENT_FIELDS,
+                    filter_conditions, "created_at", sort_order, page,
+                    page_size, cursor)))
+
+        if not student_exists:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Estudiante con ID {student_id} no fue encontrado"
+            )
 
         if total == 0:
             raise HTTPException(
@@ -658,37 +882,14 @@ async def get_debt_payments(
                     debts_id} del estudiante {student_id}"
             )
 
-        sort_direction = pymongo.DESCENDING if sort_order == "desc" else pymongo.ASCENDING
-        pipeline.extend([
-            {"$sort": {"payments.created_at": sort_direction}},
-            {"$skip": (page - 1) * page_size},
-            {"$limit": page_size},
-            {
-                "$project": {
-                    "_id": 0,
-                    "payment_id": "$payments.payment_id",
-                    "debt_id": "$payments.debt_id",
-                    "type": "$payments.type",
-                    "amount": "$payments.amount",
-                    "semester": "$payments.semester",
-                    "month": "$payments.month",
-                    "year": "$payments.year",
-                    "status": "$payments.status",
-                    "description": "$payments.description",
-                    "created_at": "$payments.created_at",
-                    "updated_at": "$payments.updated_at"
-                }
-            }
-        ])
-
-        payments = list(payments_collection.aggregate(pipeline))
-
-        return PaginatedPaymentsResponse(
-            total=total,
-            page=page,
-            page_size=page_size,
-            payments=payments
-        )
+        # Filas de nuestra proyección: sin validar de nuevo con el modelo
+        return FastJSONResponse({
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "payments": trusted_rows(PaymentResponse, payments),
+            "next_cursor": next_cursor
+        })
 
     except HTTPException:
         raise
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import os
+import httpx
+import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
+from pika.exchange_type import ExchangeType
+from .main import CONSUMER_PREFETCH, get_rabbitmq_connection
+from .monitor import start_consumer_monitor
+from .retry import RetryRouter, original_routing_key
+from ..metrics.main import consumer_labels, consumer_messages
+
+CONSUMER_CONCURRENCY = int(os.getenv("CONSUMER_CONCURRENCY", "16"))
+CONSUMER_HTTP_TIMEOUT = float(os.getenv("CONSUMER_HTTP_TIMEOUT", "10"))
+RETRY_DELAY = 5
+
+
+def _with_callback(loop, method, *args, **kwargs):
+    # Convierte un método de pika con `callback=` en un awaitable
+    future = loop.create_future()
+
+    def done(frame):
+        if not future.done():
+            future.set_result(frame)
+    method(*args, callback=done, **kwargs)
+    return future
+
+
+async def open_connection(loop, closed):
+    opened = loop.create_future()
+
+    def on_open(connection):
+        if not opened.done():
+            opened.set_result(connection)
+
+    def on_open_error(connection, error):
+        if not opened.done():
+            opened.set_exception(
+                pika.exceptions.AMQPConnectionError(str(error)))
+
+    def on_close(connection, reason):
+        if not closed.done():
+            closed.set_result(reason)
+
+    AsyncioConnection(pika.URLParameters(os.getenv("RABBITMQ_URL")),
+                      on_open_callback=on_open,
+                      on_open_error_callback=on_open_error,
+                      on_close_callback=on_close,
+                      custom_ioloop=loop)
+    return await opened
+
+
+async def open_channel(loop, connection):
+    opened = loop.create_future()
+    connection.channel(on_open_callback=opened.set_result)
+    return await opened
+
+
+async def setup_channel(loop, connection, service, prefetch, on_message,
+                        retry):
+    channel = await open_channel(loop, connection)
+    await _with_callback(loop, channel.exchange_declare,
+                         exchange='aranceles',
+                         exchange_type=ExchangeType.topic)
+    declared = await _with_callback(loop, channel.queue_declare,
+                                    queue=service, durable=True)
+    queue = declared.method.queue
+    await _with_callback(loop, channel.queue_bind, queue=queue,
+                         exchange='aranceles',
+                         routing_key=f'{service}.*.*')
+    for retry_queue, arguments in retry.queues():
+        await _with_callback(loop, channel.queue_declare, queue=retry_queue,
+                             durable=True, arguments=arguments)
+    await _with_callback(loop, channel.basic_qos, prefetch_count=prefetch)
+    channel.basic_consume(queue=queue, on_message_callback=on_message)
+    return channel
+
+
+async def consume(service, callback, prefetch, concurrency):
+    logger = logging.getLogger("AsyncConsumer")
+    loop = asyncio.get_running_loop()
+    # Un único cliente con keep-alive para todos los mensajes del consumer
+    client = httpx.AsyncClient(
+        timeout=CONSUMER_HTTP_TIMEOUT,
+        limits=httpx.Limits(max_connections=concurrency,
+                            max_keepalive_connections=concurrency),
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = set()
+    # Colas de espera y estacionamiento para los mensajes que fallan
+    retry = RetryRouter(service)
+    callback.retry = retry
+    # Hilo de profundidad de colas y servidor de métricas
+    start_consumer_monitor(service, retry, get_rabbitmq_connection)
+
+    async def handle(channel, method, properties, body):
+        async with semaphore:
+            try:
+                await callback.run_async(channel, method, properties, body,
+                                         client)
+            except Exception as e:
+                logger.info(f"Error procesando {method.routing_key}: {e}")
+                consumer_messages.inc(
+                    *consumer_labels(original_routing_key(method, properties)),
+                    "nacked")
+                if channel.is_open:
+                    channel.basic_nack(delivery_tag=method.delivery_tag,
+                                       requeue=not method.redelivered)
+
+    def on_message(channel, method, properties, body):
+        task = loop.create_task(handle(channel, method, properties, body))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    try:
+        while True:
+            closed = loop.create_future()
+            try:
+                logger.info("Connecting to RabbitMQ...")
+                connection = await open_connection(loop, closed)
+            except pika.exceptions.AMQPConnectionError as e:
+                logger.info(f"Error connecting to RabbitMQ: {e}")
+                await asyncio.sleep(RETRY_DELAY)
+                continue
+
+            setup = loop.create_task(
+                setup_channel(loop, connection, service, prefetch, on_message,
+                              retry))
+            await asyncio.wait({setup, closed},
+                               return_when=asyncio.FIRST_COMPLETED)
+            if setup.done() and not setup.exception():
+                logger.info(
+                    f'Waiting for messages... (prefetch={prefetch}, concurrency={concurrency})')
+            else:
+                setup.cancel()
+                if not closed.done() and connection.is_open:
+                    connection.close()
+
+            reason = await closed
+            logger.info(
+                f"Conexión cerrada por RabbitMQ ({reason}), intentando reconectar...")
+            # Los mensajes sin ack ya fueron devueltos a la cola por el broker
+            for task in list(tasks):
+                task.cancel()
+            await asyncio.sleep(RETRY_DELAY)
+    finally:
+        await client.aclose()
+
+
+def AsyncConsumer(service, callback, prefetch=CONSUMER_PREFETCH,
+                  concurrency=CONSUMER_CONCURRENCY):
+    """
+    Reemplazo de rabbit.main.Consumer sobre asyncio (uvloop si está
+    disponible). `callback` es un EventCallback; hasta `concurrency`
+    mensajes se procesan a la vez sobre un httpx.AsyncClient compartido.
+    """
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger("AsyncConsumer").info("Consumer started...")
+    runner = consume(service, callback, prefetch, concurrency)
+    try:
+        try:
+            import uvloop
+        except ImportError:
+            asyncio.run(runner)
+        else:
+            uvloop.run(runner)
+    except KeyboardInterrupt:
+        logging.getLogger("AsyncConsumer").info("Interrumpido por el usuario.")
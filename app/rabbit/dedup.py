@@ -0,0 +1,185 @@
+import asyncio
+import collections
+from datetime import datetime
+import logging
+import os
+import threading
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+from ..metrics.main import (consumer_dedup_checks, consumer_dedup_duplicates,
+                            consumer_dedup_entries, consumer_dedup_errors,
+                            consumer_dedup_marked, consumer_dedup_without_id)
+
+CONSUMER_DEDUP_ENABLED = os.getenv(
+    "CONSUMER_DEDUP_ENABLED", "true").lower() == "true"
+CONSUMER_DEDUP_MAX_ENTRIES = int(
+    os.getenv("CONSUMER_DEDUP_MAX_ENTRIES", "100000"))
+# Con "true" los ids procesados también se guardan en la colección
+# `processed_events` de la base del servicio: sobreviven a reinicios y los
+# comparten las réplicas del consumer
+CONSUMER_DEDUP_PERSISTENT = os.getenv(
+    "CONSUMER_DEDUP_PERSISTENT", "false").lower() == "true"
+CONSUMER_DEDUP_TTL = int(os.getenv("CONSUMER_DEDUP_TTL", str(24 * 3600)))
+# Cada cuántos mensajes se registran las estadísticas en el log
+CONSUMER_DEDUP_LOG_EVERY = int(os.getenv("CONSUMER_DEDUP_LOG_EVERY", "1000"))
+
+_stores = []
+# Estadística de DedupStore -> (métrica, etiquetas después del servicio);
+# "duplicates" es la suma de los dos hits
+_METRICS = {
+    "checked": (consumer_dedup_checks, ()),
+    "memory_hits": (consumer_dedup_duplicates, ("memory",)),
+    "persistent_hits": (consumer_dedup_duplicates, ("persistent",)),
+    "without_id": (consumer_dedup_without_id, ()),
+    "marked": (consumer_dedup_marked, ()),
+    "errors": (consumer_dedup_errors, ()),
+}
+
+
+class DedupStore:
+    """
+    Ids de mensaje (`message_id` de las propiedades AMQP, ver
+    rabbit.main.publish_event) que el consumer ya procesó, para descartar
+    las re-entregas de RabbitMQ antes de hacer cualquier trabajo.
+
+    Un LRU en memoria acotado a `max_entries`, más la colección
+    `processed_events` de `db` con índice TTL si `persistent`. Un id se
+    marca después de aplicar el evento: si el proceso cae antes, la
+    re-entrega se procesa de nuevo.
+    """
+
+    def __init__(self, service, db=None,
+                 max_entries=CONSUMER_DEDUP_MAX_ENTRIES,
+                 persistent=CONSUMER_DEDUP_PERSISTENT, ttl=CONSUMER_DEDUP_TTL,
+                 enabled=CONSUMER_DEDUP_ENABLED):
+        self.service = service
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.logger = logging.getLogger("Consumer_Dedup")
+        self._lock = threading.Lock()
+        self._seen = collections.OrderedDict()
+        self._stats = {
+            "checked": 0,
+            "duplicates": 0,
+            "memory_hits": 0,
+            "persistent_hits": 0,
+            "without_id": 0,
+            "marked": 0,
+            "errors": 0,
+        }
+        self.collection = None
+        if enabled and persistent and db is not None:
+            self.collection = db["processed_events"]
+            try:
+                self.collection.create_index(
+                    "processed_at", name="processed_at_ttl",
+                    expireAfterSeconds=ttl)
+            except PyMongoError as e:
+                self.logger.info(
+                    f"No se pudo crear el índice de processed_events: {e}")
+        _stores.append(self)
+
+    def _count(self, key, value=1):
+        # Con el lock tomado: la estadística y su métrica de Prometheus
+        self._stats[key] += value
+        if key in _METRICS:
+            metric, labels = _METRICS[key]
+            metric.inc(self.service, *labels, value=value)
+
+    def _incr(self, key, value=1):
+        with self._lock:
+            self._count(key, value)
+
+    def _remember(self, message_ids):
+        with self._lock:
+            for message_id in message_ids:
+                self._seen[message_id] = True
+                self._seen.move_to_end(message_id)
+            while len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+            consumer_dedup_entries.set(self.service, value=len(self._seen))
+
+    def seen(self, message_id):
+        """True si `message_id` ya fue procesado (el mensaje se descarta)."""
+        if not self.enabled:
+            return False
+        with self._lock:
+            self._count("checked")
+            checked = self._stats["checked"]
+            if message_id is None:
+                self._count("without_id")
+                return False
+            hit = message_id in self._seen
+            if hit:
+                self._seen.move_to_end(message_id)
+                self._count("memory_hits")
+                self._count("duplicates")
+        if checked % CONSUMER_DEDUP_LOG_EVERY == 0:
+            self.logger.info(f"Dedup {self.service}: {self.stats()}")
+        if hit or self.collection is None:
+            return hit
+
+        try:
+            hit = self.collection.find_one(
+                {"_id": message_id}, {"_id": 1}) is not None
+        except PyMongoError as e:
+            self._incr("errors")
+            self.logger.info(f"Error consultando processed_events: {e}")
+            return False
+        if hit:
+            self._remember([message_id])
+            with self._lock:
+                self._count("persistent_hits")
+                self._count("duplicates")
+        return hit
+
+    def mark(self, message_ids):
+        """Registra como procesados los ids de una lista (None se ignora)."""
+        message_ids = [message_id for message_id in message_ids
+                       if message_id is not None]
+        if not self.enabled or not message_ids:
+            return
+        self._remember(message_ids)
+        self._incr("marked", len(message_ids))
+        if self.collection is None:
+            return
+        now = datetime.now()
+        try:
+            self.collection.insert_many(
+                [{"_id": message_id, "service": self.service,
+                  "processed_at": now} for message_id in message_ids],
+                ordered=False)
+        except (BulkWriteError, DuplicateKeyError):
+            # Otra réplica ya lo registró
+            pass
+        except PyMongoError as e:
+            self._incr("errors")
+            self.logger.info(f"Error registrando processed_events: {e}")
+
+    async def seen_async(self, message_id):
+        if self.collection is None:
+            return self.seen(message_id)
+        return await asyncio.to_thread(self.seen, message_id)
+
+    async def mark_async(self, message_ids):
+        if self.collection is None:
+            return self.mark(message_ids)
+        return await asyncio.to_thread(self.mark, message_ids)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._seen)
+        with_id = stats["checked"] - stats["without_id"]
+        stats["hit_ratio"] = (stats["duplicates"] / with_id
+                              if with_id else 0.0)
+        stats.update({
+            "service": self.service,
+            "enabled": self.enabled,
+            "persistent": self.collection is not None,
+            "max_entries": self.max_entries,
+        })
+        return stats
+
+
+def dedup_stats():
+    return [store.stats() for store in _stores]
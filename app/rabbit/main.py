@@ -1,19 +1,58 @@
+import asyncio
+import collections
+import concurrent.futures
 from datetime import datetime
+import inspect
 import json
 import logging
 import os
+import queue
+import threading
+import uuid
 from bson import ObjectId
 from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+import httpx
 import pika
+import requests
 import time
 from pika.exchange_type import ExchangeType
+from .monitor import start_consumer_monitor
+from .retry import RetryRouter, original_routing_key, parking_queue
+from ..metrics.main import (consumer_event_lag, consumer_handler_duration,
+                            consumer_labels, consumer_messages, event_label,
+                            publish_duration, publish_failures)
 
+PUBLISHER_POOL_SIZE = int(os.getenv("RABBITMQ_PUBLISHER_POOL_SIZE", "4"))
+PUBLISHER_HEARTBEAT = int(os.getenv("RABBITMQ_HEARTBEAT", "60"))
+PUBLISHER_CHECKOUT_TIMEOUT = float(
+    os.getenv("RABBITMQ_PUBLISHER_CHECKOUT_TIMEOUT", "5"))
+PUBLISHER_CONFIRMS = os.getenv(
+    "RABBITMQ_PUBLISHER_CONFIRMS", "false").lower() == "true"
+PUBLISHER_CONFIRM_TIMEOUT = float(
+    os.getenv("RABBITMQ_PUBLISHER_CONFIRM_TIMEOUT", "10"))
+PUBLISHER_CONFIRM_RETRIES = int(
+    os.getenv("RABBITMQ_PUBLISHER_CONFIRM_RETRIES", "3"))
+PUBLISHER_RECONNECT_DELAY = 5
+CONSUMER_PREFETCH = int(os.getenv("CONSUMER_PREFETCH", "16"))
+CONSUMER_WORKERS = int(os.getenv("CONSUMER_WORKERS", "8"))
+# "direct": escribe en Mongo con las funciones del servicio
+# "http": reenvía el evento a la API del servicio
+CONSUMER_TRANSPORT = os.getenv("CONSUMER_TRANSPORT", "direct")
+CONSUMER_BATCH_SIZE = int(os.getenv("CONSUMER_BATCH_SIZE", "100"))
+CONSUMER_BATCH_WINDOW = float(os.getenv("CONSUMER_BATCH_WINDOW", "0.05"))
+# "threads": Consumer con pool de hilos, "asyncio": AsyncConsumer
+CONSUMER_RUNTIME = os.getenv("CONSUMER_RUNTIME", "threads")
+PUBLISHED_AT_HEADER = "x-published-at"
 
-def get_rabbitmq_connection():
+
+def get_rabbitmq_connection(heartbeat=None):
     rabbitmq_url = os.getenv("RABBITMQ_URL")
     logger = logging.getLogger("Connection_RabbitMQ")
     try:
         params = pika.URLParameters(rabbitmq_url)
+        if heartbeat is not None:
+            params.heartbeat = heartbeat
         connection = pika.BlockingConnection(params)
         logger.info("Connected to RabbitMQ")
 
@@ -24,45 +63,487 @@ def get_rabbitmq_connection():
         return None
 
 
-def Consumer(service, callback):
-    RETRY_DELAY = 5
-    RETRY_ATTEMPS = 10
-    logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger("Consumer")
+class ThreadSafeChannel:
+    """
+    Proxy del canal que se entrega a los callbacks del pool de workers.
 
-    logger.info("Consumer started...")
-    logger.info("Connecting to RabbitMQ...")
+    pika no es thread-safe: los ack/nack se agendan en el hilo de la
+    conexión con add_callback_threadsafe.
+    """
+
+    def __init__(self, connection, channel):
+        self._connection = connection
+        self._channel = channel
+
+    def _schedule(self, method, **kwargs):
+        def run():
+            if self._channel.is_open:
+                method(**kwargs)
+        self._connection.add_callback_threadsafe(run)
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self._schedule(self._channel.basic_ack,
+                       delivery_tag=delivery_tag, multiple=multiple)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self._schedule(self._channel.basic_nack, delivery_tag=delivery_tag,
+                       multiple=multiple, requeue=requeue)
+
+    def basic_reject(self, delivery_tag=0, requeue=True):
+        self._schedule(self._channel.basic_reject,
+                       delivery_tag=delivery_tag, requeue=requeue)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self._schedule(self._channel.basic_publish, exchange=exchange,
+                       routing_key=routing_key, body=body,
+                       properties=properties)
+
+    def __getattr__(self, name):
+        return getattr(self._channel, name)
+
+
+def connect_with_retry(logger, attempts=10, delay=5):
     connection = get_rabbitmq_connection()
     tries = 0
-    while connection is None or tries < RETRY_ATTEMPS:
+    while connection is None and tries < attempts:
         logger.info("Retrying connection to RabbitMQ...")
-        time.sleep(RETRY_DELAY)
+        time.sleep(delay)
         connection = get_rabbitmq_connection()
         tries += 1
-        if (tries == RETRY_ATTEMPS):
-            logger.info("Connection to RabbitMQ failed")
-
-    channel = connection.channel()
-    channel.exchange_declare(exchange='aranceles',
-                             exchange_type=ExchangeType.topic)
-    # channel.exchange_declare(exchange='topic_exchange', exchange_type=ExchangeType.topic)
-    queue = channel.queue_declare(queue=service, durable=True)
-    channel.queue_bind(exchange='aranceles',
-                       queue=queue.method.queue, routing_key=f'{service}.*.*')
-    channel.basic_consume(queue=queue.method.queue,
-                          on_message_callback=callback)
-    logger.info('Waiting for messages...')
+    if connection is None:
+        logger.info("Connection to RabbitMQ failed")
+    return connection
+
 
+def run_callback(callback, channel, method, properties, body, logger):
     try:
-        channel.start_consuming()
-    except pika.exceptions.ConnectionClosedByBroker:
-        logger.info("Conexión cerrada por RabbitMQ, intentando reconectar...")
-        Consumer()  # Reintento si RabbitMQ cierra la conexión
-    except KeyboardInterrupt:
-        logger.info("Interrumpido por el usuario.")
-        channel.stop_consuming()
-    finally:
-        connection.close()
+        callback(channel, method, properties, body)
+    except Exception as e:
+        logger.info(f"Error procesando {method.routing_key}: {e}")
+        consumer_messages.inc(
+            *consumer_labels(original_routing_key(method, properties)),
+            "nacked")
+        # Falló el propio manejo del fallo (p. ej. el canal se cerró): se
+        # reintenta una vez; si vuelve a fallar se descarta
+        channel.basic_nack(delivery_tag=method.delivery_tag,
+                           requeue=not method.redelivered)
+
+
+_handler_loop = None
+_handler_loop_lock = threading.Lock()
+
+
+def get_handler_loop():
+    """
+    Event loop en segundo plano donde se ejecutan los handlers async desde los
+    workers. Es siempre el mismo loop, así los clientes asíncronos de Mongo
+    (ligados a un loop) se reutilizan entre mensajes.
+    """
+    global _handler_loop
+    if _handler_loop is None:
+        with _handler_loop_lock:
+            if _handler_loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, daemon=True,
+                                 name="handler-loop").start()
+                _handler_loop = loop
+    return _handler_loop
+
+
+def run_handler(handler, *args):
+    """
+    Ejecuta una función del servicio (sync o async) desde un worker del
+    consumer, sin pasar por HTTP.
+    """
+    result = handler(*args)
+    if inspect.isawaitable(result):
+        return asyncio.run_coroutine_threadsafe(
+            result, get_handler_loop()).result()
+    return result
+
+
+class EventAction:
+    """
+    Operación que un evento aplica sobre un servicio: la función del servicio
+    (transporte directo) y la petición equivalente a su API (transporte http).
+    `args` debe traer todos los parámetros de la función: los que faltan
+    toman su Query(...) de FastAPI, no el valor por defecto.
+    """
+
+    def __init__(self, handler, args, method, path, body=None,
+                 success="", error="", batch=None):
+        self.handler = handler
+        self.args = args
+        self.method = method
+        self.path = path
+        self.body = body
+        self.success = success
+        self.error = error
+        # Función opcional que aplica una lista de `args` en una sola
+        # escritura (ver EventBatcher)
+        self.batch = batch
+
+
+class EventBatcher:
+    """
+    Acumula las acciones con `batch` hasta `max_size` mensajes o durante
+    `window` segundos y las aplica con una sola llamada por función. Los
+    acks se envían sólo después de aplicar el lote; si el lote falla, cada
+    acción se aplica por separado y las que vuelven a fallar pasan a
+    reintento.
+    """
+
+    def __init__(self, callback, max_size=CONSUMER_BATCH_SIZE,
+                 window=CONSUMER_BATCH_WINDOW):
+        self.callback = callback
+        self.max_size = max_size
+        self.window = window
+        self._lock = threading.Lock()
+        self._items = []
+        self._timer = None
+
+    def add(self, ch, method, properties, body, action, started):
+        with self._lock:
+            self._items.append(
+                (ch, method, properties, body, action, started))
+            if len(self._items) >= self.max_size:
+                batch = self._take()
+            else:
+                batch = None
+                if self._timer is None:
+                    self._timer = threading.Timer(self.window, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+        if batch:
+            self._apply(batch)
+
+    def flush(self):
+        with self._lock:
+            batch = self._take()
+        if batch:
+            self._apply(batch)
+
+    def _take(self):
+        items = self._items
+        self._items = []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return items
+
+    def _apply(self, batch):
+        groups = {}
+        for item in batch:
+            groups.setdefault(item[4].batch, []).append(item)
+
+        logger = self.callback.logger
+        for handler, items in groups.items():
+            errors = {}
+            try:
+                handler([item[4].args for item in items])
+                logger.info(f"✅ Lote de {len(items)} eventos aplicado")
+            except Exception as e:
+                logger.info(f"❌ Error al aplicar el lote, se aplica uno a uno: {e}")
+                for index, item in enumerate(items):
+                    error = self.callback.apply(item[4])
+                    if error is not None:
+                        errors[index] = error
+            self.callback.mark([getattr(item[2], "message_id", None)
+                                for index, item in enumerate(items)
+                                if index not in errors])
+            for index, (ch, method, properties, body, _, started) \
+                    in enumerate(items):
+                if index in errors:
+                    self.callback.fail(ch, method, properties, body,
+                                       errors[index], started=started)
+                else:
+                    ch.basic_ack(delivery_tag=method.delivery_tag)
+                    self.callback.record(method, properties, "acked",
+                                         started)
+
+
+def retryable_status(status_code):
+    # 4xx: el servicio rechazó el evento (duplicado, no existe...) y
+    # reintentarlo daría lo mismo
+    return status_code >= 500 or status_code in (408, 429)
+
+
+class EventCallback:
+    """
+    Callback de consumer compartido por los tres servicios.
+
+    `actions(event, message)` traduce el evento a una lista de EventAction;
+    esta clase se encarga del transporte, los logs y el ack. Se usa tanto
+    con Consumer (hilos) como con AsyncConsumer (asyncio). Con `dedup`
+    (rabbit.dedup.DedupStore) los mensajes cuyo message_id ya se procesó
+    se confirman sin aplicarlos.
+
+    Si una acción falla por un error transitorio (servicio caído, 5xx,
+    error de Mongo) el mensaje pasa a las colas de reintento de `retry`
+    (rabbit.retry.RetryRouter, lo asigna el consumer al declararlas).
+
+    Cada mensaje se cuenta en las métricas consumer_* según cómo terminó.
+    """
+
+    def __init__(self, url, actions, logger, transport=None,
+                 skip_origin=None, dedup=None):
+        self.url = url
+        self.actions = actions
+        self.logger = logger
+        self.transport = transport or CONSUMER_TRANSPORT
+        self.skip_origin = skip_origin
+        self.dedup = dedup
+        self.retry = None
+        # Una sesión HTTP por hilo: los workers del consumer aplican mensajes
+        # en paralelo y requests.Session no es thread-safe
+        self._local = threading.local()
+        self.batcher = EventBatcher(self)
+
+    @property
+    def session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def mark(self, message_ids):
+        if self.dedup is not None:
+            self.dedup.mark(message_ids)
+
+    def record(self, method, properties, outcome, started):
+        queue, action = consumer_labels(
+            original_routing_key(method, properties))
+        consumer_messages.inc(queue, action, outcome)
+        consumer_handler_duration.observe(time.perf_counter() - started,
+                                          queue, action)
+        lag = event_lag(properties)
+        if outcome == "acked" and lag is not None:
+            consumer_event_lag.observe(lag, queue, action)
+
+    def fail(self, ch, method, properties, body, error, permanent=False,
+             started=None):
+        """Manda el mensaje a reintento (o al estacionamiento) y lo confirma."""
+        if self.retry is None:
+            self.logger.info(f"❌ Evento descartado: {error}")
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            outcome = "discarded"
+        else:
+            queue = self.retry.route(ch, method, properties, body, error,
+                                     permanent)
+            outcome = ("parked" if queue == parking_queue(self.retry.service)
+                       else "retried")
+        if started is not None:
+            self.record(method, properties, outcome, started)
+
+    def plan(self, routing_key, body):
+        message = json.loads(body)
+        # En modo directo los eventos emitidos por el propio servicio ya
+        # están aplicados en su base
+        if (self.transport == "direct" and self.skip_origin
+                and message.get("origin_service") == self.skip_origin):
+            return []
+        return self.actions(routing_key, message)
+
+    def _failed(self, action, error, status_code=None):
+        self.logger.info(f"{action.error}: {error}")
+        if status_code is not None and not retryable_status(status_code):
+            return None
+        return error
+
+    def apply(self, action):
+        """Aplica una acción; devuelve el error si hay que reintentarla."""
+        try:
+            if self.transport == "direct":
+                run_handler(action.handler, *action.args)
+            else:
+                response = self.session.request(
+                    action.method, self.url+action.path, json=action.body)
+                response.raise_for_status()
+            self.logger.info(action.success)
+        except HTTPException as e:
+            return self._failed(action, e, e.status_code)
+        except requests.exceptions.HTTPError as e:
+            return self._failed(action, e, e.response.status_code
+                                if e.response is not None else None)
+        except Exception as e:
+            return self._failed(action, e)
+        return None
+
+    async def apply_async(self, action, client):
+        try:
+            if self.transport == "direct":
+                if inspect.iscoroutinefunction(action.handler):
+                    await action.handler(*action.args)
+                else:
+                    # pymongo es bloqueante: se ejecuta fuera del event loop
+                    await asyncio.to_thread(
+                        run_handler, action.handler, *action.args)
+            else:
+                response = await client.request(
+                    action.method, self.url+action.path, json=action.body)
+                response.raise_for_status()
+            self.logger.info(action.success)
+        except HTTPException as e:
+            return self._failed(action, e, e.status_code)
+        except httpx.HTTPStatusError as e:
+            return self._failed(action, e, e.response.status_code)
+        except Exception as e:
+            return self._failed(action, e)
+        return None
+
+    def _plan_or_park(self, ch, method, properties, body, routing_key,
+                      started):
+        try:
+            return self.plan(routing_key, body)
+        except Exception as e:
+            # Mensaje que no se puede interpretar: reintentarlo no sirve
+            self.logger.info(f"❌ Evento inválido {routing_key}: {e}")
+            self.fail(ch, method, properties, body, e, permanent=True,
+                      started=started)
+            return None
+
+    def __call__(self, ch, method, properties, body):
+        started = time.perf_counter()
+        routing_key = original_routing_key(method, properties)
+        message_id = getattr(properties, "message_id", None)
+        if self.dedup is not None and self.dedup.seen(message_id):
+            self.logger.info(f"↩️ Evento repetido descartado: {routing_key}")
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            self.record(method, properties, "duplicate", started)
+            return
+
+        actions = self._plan_or_park(ch, method, properties, body,
+                                     routing_key, started)
+        if actions is None:
+            return
+        # Los eventos que admiten lote se acumulan; el batcher hace el ack
+        if (self.transport == "direct" and len(actions) == 1
+                and actions[0].batch is not None):
+            self.batcher.add(ch, method, properties, body, actions[0],
+                             started)
+            return
+
+        for action in actions:
+            error = self.apply(action)
+            if error is not None:
+                self.fail(ch, method, properties, body, error,
+                          started=started)
+                return
+
+        self.mark([message_id])
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+        self.record(method, properties, "acked", started)
+
+    async def run_async(self, ch, method, properties, body, client):
+        started = time.perf_counter()
+        routing_key = original_routing_key(method, properties)
+        message_id = getattr(properties, "message_id", None)
+        if (self.dedup is not None
+                and await self.dedup.seen_async(message_id)):
+            self.logger.info(f"↩️ Evento repetido descartado: {routing_key}")
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            self.record(method, properties, "duplicate", started)
+            return
+
+        actions = self._plan_or_park(ch, method, properties, body,
+                                     routing_key, started)
+        if actions is None:
+            return
+        for action in actions:
+            error = await self.apply_async(action, client)
+            if error is not None:
+                self.fail(ch, method, properties, body, error,
+                          started=started)
+                return
+
+        if self.dedup is not None:
+            await self.dedup.mark_async([message_id])
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+        self.record(method, properties, "acked", started)
+
+
+def Consumer(service, callback, prefetch=CONSUMER_PREFETCH,
+             workers=CONSUMER_WORKERS):
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger("Consumer")
+
+    logger.info("Consumer started...")
+    # Colas de espera y estacionamiento para los mensajes que fallan
+    retry = RetryRouter(service)
+    callback.retry = retry
+    start_consumer_monitor(service, retry, get_rabbitmq_connection)
+    while True:
+        logger.info("Connecting to RabbitMQ...")
+        connection = connect_with_retry(logger)
+        if connection is None:
+            return
+
+        channel = connection.channel()
+        channel.exchange_declare(exchange='aranceles',
+                                 exchange_type=ExchangeType.topic)
+        # channel.exchange_declare(exchange='topic_exchange', exchange_type=ExchangeType.topic)
+        queue = channel.queue_declare(queue=service, durable=True)
+        channel.queue_bind(exchange='aranceles',
+                           queue=queue.method.queue, routing_key=f'{service}.*.*')
+        retry.declare(channel)
+        # Como máximo `prefetch` mensajes sin ack: el broker deja de entregar
+        # cuando los workers están ocupados
+        channel.basic_qos(prefetch_count=prefetch)
+
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix=f"{service}-worker")
+        worker_channel = ThreadSafeChannel(connection, channel)
+
+        def on_message(ch, method, properties, body):
+            executor.submit(run_callback, callback, worker_channel,
+                            method, properties, body, logger)
+
+        channel.basic_consume(queue=queue.method.queue,
+                              on_message_callback=on_message)
+        logger.info(
+            f'Waiting for messages... (prefetch={prefetch}, workers={workers})')
+
+        try:
+            channel.start_consuming()
+        except (pika.exceptions.ConnectionClosedByBroker,
+                pika.exceptions.AMQPConnectionError):
+            logger.info("Conexión cerrada por RabbitMQ, intentando reconectar...")
+            continue
+        except KeyboardInterrupt:
+            logger.info("Interrumpido por el usuario.")
+            channel.stop_consuming()
+            break
+        finally:
+            # Los mensajes sin ack vuelven a la cola al cerrar el canal
+            executor.shutdown(wait=False, cancel_futures=True)
+            if connection.is_open:
+                connection.close()
+
+
+def new_message_id():
+    """
+    Id con que se publica cada evento (propiedad AMQP message_id); los
+    consumers lo usan para descartar re-entregas (ver rabbit.dedup).
+    """
+    return uuid.uuid4().hex
+
+
+def published_at_header():
+    """
+    Encabezado con el momento de publicación (epoch en milisegundos: las
+    tablas AMQP de pika no admiten float), para medir en los consumers la
+    demora de cada evento.
+    """
+    return {PUBLISHED_AT_HEADER: int(time.time() * 1000)}
+
+
+def event_lag(properties):
+    """Segundos desde que se publicó el mensaje, o None sin el encabezado."""
+    headers = getattr(properties, "headers", None) or {}
+    published_at = headers.get(PUBLISHED_AT_HEADER)
+    if not isinstance(published_at, int):
+        return None
+    return max(time.time() - published_at / 1000, 0.0)
 
 
 def json_serial(obj):
@@ -73,22 +554,525 @@ def json_serial(obj):
     raise TypeError(f"Type {type(obj)} not serializable")
 
 
-def publish_event(event: str, body: dict):
+# ----- Publisher ------
 
-    connection = get_rabbitmq_connection()
-    if connection is None:
+class PooledChannel:
+    """
+    Conexión + canal de publicación reutilizable.
+
+    pika.BlockingConnection no es thread-safe, por lo que cada elemento del
+    pool tiene su propia conexión y sólo un hilo lo usa a la vez.
+    """
+
+    def __init__(self):
+        self.connection = None
+        self.channel = None
+        self.last_used = 0.0
+
+    def is_open(self):
+        return (self.connection is not None and self.connection.is_open
+                and self.channel is not None and self.channel.is_open)
+
+    def open(self):
+        self.close()
+        connection = get_rabbitmq_connection(heartbeat=PUBLISHER_HEARTBEAT)
+        if connection is None:
+            raise pika.exceptions.AMQPConnectionError(
+                "Cannot connect to RabbitMQ")
+        self.connection = connection
+        self.channel = connection.channel()
+        self.channel.exchange_declare(exchange='aranceles',
+                                      exchange_type=ExchangeType.topic)
+        self.last_used = time.monotonic()
+
+    def close(self):
+        try:
+            if self.connection is not None and self.connection.is_open:
+                self.connection.close()
+        except Exception:
+            pass
+        self.connection = None
+        self.channel = None
+
+    def keepalive(self):
+        # Procesa heartbeats pendientes de una conexión inactiva
+        if self.is_open():
+            self.connection.process_data_events(time_limit=0)
+
+
+class Publisher:
+    """
+    Publicador de eventos de larga duración con un pool de canales.
+
+    Las conexiones se abren bajo demanda, se reutilizan entre requests y se
+    reconectan de forma transparente si el broker las cierra.
+    """
+
+    def __init__(self, pool_size=PUBLISHER_POOL_SIZE,
+                 heartbeat=PUBLISHER_HEARTBEAT,
+                 checkout_timeout=PUBLISHER_CHECKOUT_TIMEOUT):
+        self.logger = logging.getLogger("Publisher")
+        self.pool_size = pool_size
+        self.heartbeat = heartbeat
+        self.checkout_timeout = checkout_timeout
+        self._pool = queue.LifoQueue()
+        for _ in range(pool_size):
+            self._pool.put(PooledChannel())
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "published": 0,
+            "failed": 0,
+            "connections_opened": 0,
+            "reconnects": 0,
+            "checkout_waits": 0,
+            "publish_time_total_ms": 0.0,
+            "publish_time_max_ms": 0.0,
+        }
+        self._keepalive_thread = None
+        self._stopped = threading.Event()
+
+    def _incr(self, key, value=1):
+        with self._stats_lock:
+            self._stats[key] += value
+
+    def _checkout(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            self._incr("checkout_waits")
+        try:
+            return self._pool.get(timeout=self.checkout_timeout)
+        except queue.Empty:
+            raise pika.exceptions.AMQPConnectionError(
+                "No hay canales disponibles en el pool de RabbitMQ")
+
+    def _checkin(self, pooled):
+        pooled.last_used = time.monotonic()
+        self._pool.put(pooled)
+
+    def _ensure_open(self, pooled):
+        if pooled.is_open():
+            return
+        reconnect = pooled.connection is not None
+        pooled.open()
+        self._incr("connections_opened")
+        if reconnect:
+            self._incr("reconnects")
+        self._start_keepalive()
+
+    def _start_keepalive(self):
+        if self.heartbeat <= 0 or self._keepalive_thread is not None:
+            return
+        self._keepalive_thread = threading.Thread(
+            target=self._keepalive, name="rabbit-publisher-keepalive",
+            daemon=True)
+        self._keepalive_thread.start()
+
+    def _keepalive(self):
+        # Las conexiones bloqueantes sólo responden heartbeats cuando se
+        # usan, así que se revisan periódicamente las que están inactivas.
+        interval = max(self.heartbeat / 2, 1)
+        while not self._stopped.wait(interval):
+            idle = []
+            try:
+                while True:
+                    idle.append(self._pool.get_nowait())
+            except queue.Empty:
+                pass
+            for pooled in idle:
+                try:
+                    if time.monotonic() - pooled.last_used >= interval:
+                        pooled.keepalive()
+                except Exception as e:
+                    self.logger.info(f"Publisher keepalive error: {e}")
+                    pooled.close()
+                finally:
+                    self._pool.put(pooled)
+
+    def _basic_publish(self, pooled, event, body, properties):
+        self._ensure_open(pooled)
+        pooled.channel.basic_publish(
+            exchange='aranceles',
+            routing_key=event,
+            body=body,
+            properties=properties,
+        )
+
+    def publish(self, event: str, body: dict, properties=None,
+                message_id=None):
+        payload = json.dumps(body, default=json_serial, ensure_ascii=False)
+        if properties is None:
+            properties = pika.BasicProperties(
+                content_type="application/json",
+                message_id=message_id or new_message_id(),
+                headers=published_at_header())
+        start = time.perf_counter()
+        pooled = self._checkout()
+        try:
+            try:
+                self._basic_publish(pooled, event, payload, properties)
+            except (pika.exceptions.AMQPConnectionError,
+                    pika.exceptions.AMQPChannelError,
+                    pika.exceptions.StreamLostError):
+                # Reintento único con una conexión nueva
+                pooled.close()
+                self._basic_publish(pooled, event, payload, properties)
+        except Exception:
+            self._incr("failed")
+            publish_failures.inc(event_label(event))
+            pooled.close()
+            raise
+        finally:
+            self._checkin(pooled)
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        publish_duration.observe(elapsed_ms / 1000, event_label(event))
+        with self._stats_lock:
+            self._stats["published"] += 1
+            self._stats["publish_time_total_ms"] += elapsed_ms
+            if elapsed_ms > self._stats["publish_time_max_ms"]:
+                self._stats["publish_time_max_ms"] = elapsed_ms
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        published = stats["published"]
+        stats["publish_time_avg_ms"] = (
+            stats["publish_time_total_ms"] / published if published else 0.0)
+        stats["pool_size"] = self.pool_size
+        stats["pool_idle"] = self._pool.qsize()
+        return stats
+
+    def close(self):
+        self._stopped.set()
+        idle = []
+        try:
+            while True:
+                idle.append(self._pool.get_nowait())
+        except queue.Empty:
+            pass
+        for pooled in idle:
+            pooled.close()
+            self._pool.put(pooled)
+
+
+class PublishError(Exception):
+    pass
+
+
+class PendingMessage:
+    def __init__(self, event, body, future, message_id):
+        self.event = event
+        self.body = body
+        self.future = future
+        self.message_id = message_id
+        self.attempts = 0
+        self.created = time.perf_counter()
+        # Los reintentos conservan el momento de la primera publicación
+        self.headers = published_at_header()
+
+
+class ConfirmPublisher:
+    """
+    Publicador con publisher confirms y mensajes persistentes.
+
+    Un hilo dedicado mantiene una SelectConnection con confirm_delivery
+    activado. Los mensajes se encolan desde cualquier hilo, se publican en
+    lote sobre el canal y cada uno devuelve un Future que se resuelve cuando
+    el broker confirma (Basic.Ack, incluidos los acks "multiple"). Los nacks
+    y los mensajes sin confirmar al caerse la conexión se reintentan.
+    """
+
+    def __init__(self, max_retries=PUBLISHER_CONFIRM_RETRIES,
+                 heartbeat=PUBLISHER_HEARTBEAT):
+        self.logger = logging.getLogger("ConfirmPublisher")
+        self.max_retries = max_retries
+        self.heartbeat = heartbeat
+        self._connection = None
+        self._channel = None
+        self._ready = False
+        self._stopping = False
+        self._thread = None
+        self._lock = threading.Lock()
+        self._pending = collections.deque()
+        self._unconfirmed = {}
+        self._delivery_tag = 0
+        self._stats = {
+            "published": 0,
+            "confirmed": 0,
+            "nacked": 0,
+            "retried": 0,
+            "failed": 0,
+            "reconnects": 0,
+        }
+
+    # --- API pública (cualquier hilo) ---
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="rabbit-confirm-publisher", daemon=True)
+            self._thread.start()
+
+    def publish(self, event: str, body: dict, message_id=None):
+        payload = json.dumps(body, default=json_serial, ensure_ascii=False)
+        future = concurrent.futures.Future()
+        with self._lock:
+            self._pending.append(PendingMessage(
+                event, payload, future, message_id or new_message_id()))
+        self.start()
+        self._wakeup()
+        return future
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._pending)
+            stats["in_flight"] = len(self._unconfirmed)
+            stats["connected"] = self._ready
+        return stats
+
+    def stop(self):
+        self._stopping = True
+        connection = self._connection
+        if connection is not None:
+            try:
+                connection.ioloop.add_callback_threadsafe(connection.close)
+            except Exception:
+                pass
+
+    def _wakeup(self):
+        connection = self._connection
+        if connection is None or not self._ready:
+            return
+        try:
+            connection.ioloop.add_callback_threadsafe(self._flush)
+        except Exception:
+            # La conexión se está cerrando; se publicará al reconectar
+            pass
+
+    # --- Hilo de I/O ---
+
+    def _run(self):
+        params = pika.URLParameters(os.getenv("RABBITMQ_URL"))
+        params.heartbeat = self.heartbeat
+        first = True
+        while not self._stopping:
+            if not first:
+                with self._lock:
+                    self._stats["reconnects"] += 1
+            first = False
+            self._connection = pika.SelectConnection(
+                params,
+                on_open_callback=self._on_connection_open,
+                on_open_error_callback=self._on_connection_open_error,
+                on_close_callback=self._on_connection_closed,
+            )
+            self._connection.ioloop.start()
+            if not self._stopping:
+                time.sleep(PUBLISHER_RECONNECT_DELAY)
+
+    def _on_connection_open(self, connection):
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_connection_open_error(self, connection, error):
+        self.logger.info(f"Error connecting to RabbitMQ: {error}")
+        connection.ioloop.stop()
+
+    def _on_connection_closed(self, connection, reason):
+        self._ready = False
+        self._channel = None
+        # Los mensajes sin confirmar vuelven a la cola de salida
+        with self._lock:
+            unconfirmed = list(self._unconfirmed.values())
+            self._unconfirmed.clear()
+        for message in reversed(unconfirmed):
+            self._retry(message, front=True)
+        if not self._stopping:
+            self.logger.info(
+                f"Conexión cerrada ({reason}), reconectando...")
+        connection.ioloop.stop()
+
+    def _on_channel_open(self, channel):
+        self._channel = channel
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.exchange_declare(exchange='aranceles',
+                                 exchange_type=ExchangeType.topic,
+                                 callback=self._on_exchange_declared)
+
+    def _on_channel_closed(self, channel, reason):
+        self._ready = False
+        if self._connection is not None and not (
+                self._connection.is_closing or self._connection.is_closed):
+            self._connection.close()
+
+    def _on_exchange_declared(self, frame):
+        self._channel.confirm_delivery(self._on_delivery_confirmation,
+                                       callback=self._on_confirm_selected)
+
+    def _on_confirm_selected(self, frame):
+        self._delivery_tag = 0
+        self._ready = True
+        self._flush()
+
+    def _flush(self):
+        while self._ready:
+            with self._lock:
+                if not self._pending:
+                    return
+                message = self._pending.popleft()
+                if message.future.cancelled():
+                    continue
+                self._delivery_tag += 1
+                self._unconfirmed[self._delivery_tag] = message
+                self._stats["published"] += 1
+            try:
+                self._channel.basic_publish(
+                    exchange='aranceles',
+                    routing_key=message.event,
+                    body=message.body,
+                    properties=pika.BasicProperties(
+                        delivery_mode=2,  # Hacer el mensaje persistente
+                        content_type="application/json",
+                        message_id=message.message_id,
+                        headers=message.headers,
+                    ),
+                )
+            except Exception as e:
+                self.logger.info(f"Error publishing to RabbitMQ: {e}")
+                return
+
+    def _on_delivery_confirmation(self, frame):
+        method = frame.method
+        ack = isinstance(method, pika.spec.Basic.Ack)
+        with self._lock:
+            if method.multiple:
+                tags = [tag for tag in self._unconfirmed
+                        if tag <= method.delivery_tag]
+            else:
+                tags = [method.delivery_tag]
+            messages = [self._unconfirmed.pop(tag)
+                        for tag in tags if tag in self._unconfirmed]
+            self._stats["confirmed" if ack else "nacked"] += len(messages)
+        for message in messages:
+            if ack:
+                publish_duration.observe(
+                    time.perf_counter() - message.created,
+                    event_label(message.event))
+                if not message.future.done():
+                    message.future.set_result(True)
+            else:
+                self._retry(message)
+        if not ack:
+            self._flush()
+
+    def _retry(self, message, front=False):
+        message.attempts += 1
+        if message.attempts > self.max_retries:
+            with self._lock:
+                self._stats["failed"] += 1
+            publish_failures.inc(event_label(message.event))
+            if not message.future.done():
+                message.future.set_exception(PublishError(
+                    f"El broker no confirmó el evento {message.event}"))
+            return
+        with self._lock:
+            self._stats["retried"] += 1
+            if front:
+                self._pending.appendleft(message)
+            else:
+                self._pending.append(message)
+
+
+_publisher = None
+_confirm_publisher = None
+_publisher_lock = threading.Lock()
+
+
+def get_publisher():
+    global _publisher
+    if _publisher is None:
+        with _publisher_lock:
+            if _publisher is None:
+                _publisher = Publisher()
+    return _publisher
+
+
+def get_confirm_publisher():
+    global _confirm_publisher
+    if _confirm_publisher is None:
+        with _publisher_lock:
+            if _confirm_publisher is None:
+                _confirm_publisher = ConfirmPublisher()
+    return _confirm_publisher
+
+
+def publisher_stats():
+    stats = {"pool": get_publisher().stats()}
+    if PUBLISHER_CONFIRMS:
+        stats["confirms"] = get_confirm_publisher().stats()
+    return stats
+
+
+# Una línea por evento publicado sólo con nivel DEBUG: es el camino caliente
+_publish_logger = logging.getLogger("Publisher")
+
+
+def publish_event(event: str, body: dict, wait: bool = True,
+                  message_id=None):
+    """
+    Publica un evento en el exchange 'aranceles'.
+
+    Cada mensaje lleva un message_id: `message_id` si se pasa (p. ej. el _id
+    del outbox, estable entre reintentos) o uno nuevo.
+
+    Con RABBITMQ_PUBLISHER_CONFIRMS=true el mensaje es persistente y se
+    devuelve un Future con la confirmación del broker; con wait=True se
+    espera esa confirmación antes de retornar.
+    """
+    if PUBLISHER_CONFIRMS:
+        future = get_confirm_publisher().publish(event, body, message_id)
+        if wait:
+            try:
+                future.result(timeout=PUBLISHER_CONFIRM_TIMEOUT)
+            except (PublishError, concurrent.futures.TimeoutError) as e:
+                _publish_logger.info(f"Error publishing to RabbitMQ: {e}")
+                raise HTTPException(
+                    status_code=500, detail="Cannot connect to RabbitMQ")
+        _publish_logger.debug("Sent to Queue: %s", event)
+        return future
+
+    try:
+        # Publicar el evento en RabbitMQ
+        get_publisher().publish(event, body, message_id=message_id)
+    except pika.exceptions.AMQPError as e:
+        _publish_logger.info(f"Error publishing to RabbitMQ: {e}")
+        raise HTTPException(
+            status_code=500, detail="Cannot connect to RabbitMQ")
+    _publish_logger.debug("Sent to Queue: %s", event)
+
+
+async def publish_event_async(event: str, body: dict, message_id=None):
+    """
+    Versión awaitable de publish_event para los endpoints async: la usa
+    outbox.emit_event_async cuando el outbox está desactivado.
+
+    En modo confirms se espera el Future sin bloquear el event loop; en modo
+    pool la publicación bloqueante se ejecuta en el threadpool.
+    """
+    if not PUBLISHER_CONFIRMS:
+        return await run_in_threadpool(publish_event, event, body,
+                                       message_id=message_id)
+
+    future = get_confirm_publisher().publish(event, body, message_id)
+    try:
+        await asyncio.wait_for(asyncio.wrap_future(future),
+                               timeout=PUBLISHER_CONFIRM_TIMEOUT)
+    except (PublishError, asyncio.TimeoutError) as e:
+        _publish_logger.info(f"Error publishing to RabbitMQ: {e}")
         raise HTTPException(
             status_code=500, detail="Cannot connect to RabbitMQ")
-    channel = connection.channel()
-
-    # Publicar el evento en RabbitMQ
-    channel.basic_publish(
-        exchange='aranceles',
-        routing_key=event,
-        body=json.dumps(body, default=json_serial, ensure_ascii=False),
-        # properties=pika.BasicProperties(
-        #     delivery_mode=2,  # Hacer el mensaje persistente
-        # )
-    )
-    print(f" [x] Sent to Queue: {event}")
-    connection.close()
+    _publish_logger.debug("Sent to Queue: %s", event)
+    return future
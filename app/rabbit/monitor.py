@@ -0,0 +1,159 @@
+# Monitoreo de los consumers, que no tienen app HTTP donde montar /metrics:
+#
+# - un hilo que cada CONSUMER_MONITOR_INTERVAL segundos hace un declare
+#   pasivo de la cola del servicio, sus colas de espera y el estacionamiento
+#   (mensajes listos y consumers suscritos) y calcula los mensajes por
+#   segundo del intervalo;
+# - un servidor HTTP mínimo en CONSUMER_METRICS_PORT con /metrics (formato
+#   de Prometheus) y /stats (estadísticas de deduplicación en JSON).
+#
+# Los puertos por defecto son los que compose publica para cada consumer.
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pika
+from .dedup import dedup_stats
+from ..metrics.main import (CONTENT_TYPE, METRICS_ENABLED, consumer_messages,
+                            consumer_queue_consumers, consumer_queue_depth,
+                            consumer_throughput, render)
+
+CONSUMER_METRICS_PORTS = {"payments": 8004, "benefits": 8005, "debts": 8006}
+CONSUMER_MONITOR_INTERVAL = float(
+    os.getenv("CONSUMER_MONITOR_INTERVAL", "15"))
+
+
+def metrics_port(service):
+    """Puerto del servidor de métricas; 0 lo desactiva."""
+    port = os.getenv("CONSUMER_METRICS_PORT")
+    if port is not None:
+        return int(port)
+    return CONSUMER_METRICS_PORTS.get(service, 0)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = render().encode(), CONTENT_TYPE
+        elif self.path == "/stats":
+            body = json.dumps({"dedup": dedup_stats()}).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Sin una línea de log por cada scrape
+        pass
+
+
+def start_metrics_server(port):
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="consumer-metrics",
+                     daemon=True).start()
+    return server
+
+
+class QueueMonitor:
+    """
+    Profundidad de las colas de un servicio con declares pasivos sobre una
+    conexión propia (la del consumer no se puede usar desde otro hilo).
+    """
+
+    def __init__(self, service, queues, connect,
+                 interval=CONSUMER_MONITOR_INTERVAL):
+        self.service = service
+        self.queues = queues
+        self.connect = connect
+        self.interval = interval
+        self.logger = logging.getLogger("Consumer_Monitor")
+        self._connection = None
+        self._channel = None
+        self._stopped = threading.Event()
+        self._last = None
+
+    def start(self):
+        threading.Thread(target=self._run, name=f"{self.service}-monitor",
+                         daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.update_throughput()
+            try:
+                self.poll()
+            except pika.exceptions.AMQPError as e:
+                self.logger.info(f"Error consultando las colas: {e}")
+                self._close()
+
+    def update_throughput(self):
+        now = time.monotonic()
+        total = consumer_messages.total(queue=self.service)
+        if self._last is not None:
+            last_time, last_total = self._last
+            consumer_throughput.set(
+                self.service, value=(total - last_total) / (now - last_time))
+        self._last = (now, total)
+
+    def poll(self):
+        if self._connection is None or not self._connection.is_open:
+            self._connection = self.connect()
+            if self._connection is None:
+                return
+            self._channel = None
+        for queue in self.queues:
+            if self._channel is None or not self._channel.is_open:
+                self._channel = self._connection.channel()
+            try:
+                declared = self._channel.queue_declare(queue=queue,
+                                                       passive=True)
+            except pika.exceptions.ChannelClosedByBroker:
+                # 404: la cola todavía no existe (el broker cierra el canal)
+                continue
+            consumer_queue_depth.set(
+                queue, value=declared.method.message_count)
+            consumer_queue_consumers.set(
+                queue, value=declared.method.consumer_count)
+
+    def _close(self):
+        try:
+            if self._connection is not None and self._connection.is_open:
+                self._connection.close()
+        except Exception:
+            pass
+        self._connection = None
+        self._channel = None
+
+
+def start_consumer_monitor(service, retry, connect):
+    """
+    Arranca el monitoreo de las colas de `service` (la del servicio y las de
+    `retry`, un rabbit.retry.RetryRouter) y el servidor de métricas.
+    `connect` abre una conexión bloqueante o devuelve None.
+    """
+    if not METRICS_ENABLED:
+        return None
+    queues = [service] + [queue for queue, _ in retry.queues()]
+    monitor = QueueMonitor(service, queues, connect)
+    monitor.start()
+    port = metrics_port(service)
+    if port:
+        try:
+            start_metrics_server(port)
+        except OSError as e:
+            monitor.logger.info(
+                f"No se pudo abrir el puerto de métricas {port}: {e}")
+        else:
+            monitor.logger.info(f"Métricas en :{port}/metrics")
+    return monitor
@@ -0,0 +1,98 @@
+# Reenvía a la cola del servicio los mensajes que quedaron en el
+# estacionamiento (`{service}.parking`, ver rabbit.retry), p. ej. después de
+# corregir la caída que los hizo fallar:
+#
+#     python -m app.rabbit.replay debts
+#     python -m app.rabbit.replay payments --limit 100
+#     python -m app.rabbit.replay benefits --list
+#
+# Cada mensaje vuelve con el contador de intentos en cero, así recorre de
+# nuevo todos los escalones de reintento si vuelve a fallar.
+import argparse
+import pika
+from .main import get_rabbitmq_connection
+from .retry import (ATTEMPT_HEADER, ERROR_HEADER, ROUTING_KEY_HEADER,
+                    parking_queue)
+
+
+def replay(channel, service, limit=None):
+    """Mueve hasta `limit` mensajes del estacionamiento; devuelve cuántos."""
+    moved = 0
+    while limit is None or moved < limit:
+        method, properties, body = channel.basic_get(parking_queue(service))
+        if method is None:
+            break
+        headers = {key: value for key, value in
+                   (properties.headers or {}).items()
+                   if key not in (ATTEMPT_HEADER, ERROR_HEADER)}
+        # Con confirm_delivery basic_publish espera la confirmación del
+        # broker antes de sacar el mensaje del estacionamiento
+        channel.basic_publish(
+            exchange="",
+            routing_key=service,
+            body=body,
+            properties=pika.BasicProperties(
+                delivery_mode=2,
+                content_type=properties.content_type,
+                message_id=properties.message_id,
+                headers=headers,
+            ),
+            mandatory=True,
+        )
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+        moved += 1
+    return moved
+
+
+def list_parked(channel, service, limit):
+    """Muestra los mensajes estacionados sin sacarlos de la cola."""
+    shown = []
+    while len(shown) < limit:
+        method, properties, body = channel.basic_get(parking_queue(service))
+        if method is None:
+            break
+        shown.append(method.delivery_tag)
+        headers = properties.headers or {}
+        print(f"{headers.get(ROUTING_KEY_HEADER)} "
+              f"intentos={headers.get(ATTEMPT_HEADER)} "
+              f"error={headers.get(ERROR_HEADER)!r} "
+              f"message_id={properties.message_id}")
+    if shown:
+        # Vuelven a la cola al rechazarlos con requeue
+        channel.basic_nack(delivery_tag=shown[-1], multiple=True,
+                           requeue=True)
+    return len(shown)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Reenvía los mensajes estacionados a la cola del servicio")
+    parser.add_argument("service", choices=["debts", "payments", "benefits"])
+    parser.add_argument("--limit", type=int, default=None,
+                        help="como máximo esta cantidad de mensajes")
+    parser.add_argument("--list", action="store_true",
+                        help="sólo muestra los mensajes, sin moverlos")
+    args = parser.parse_args()
+
+    connection = get_rabbitmq_connection()
+    if connection is None:
+        raise SystemExit("No se pudo conectar a RabbitMQ")
+    try:
+        channel = connection.channel()
+        channel.queue_declare(queue=parking_queue(args.service),
+                              durable=True)
+        if args.list:
+            count = list_parked(channel, args.service, args.limit or 20)
+            print(f"{parking_queue(args.service)}: {count} mensajes mostrados")
+            return
+        channel.confirm_delivery()
+        moved = replay(channel, args.service, args.limit)
+        print(f"{parking_queue(args.service)} -> {args.service}: "
+              f"{moved} mensajes reenviados")
+    finally:
+        if connection.is_open:
+            connection.close()
+
+
+if __name__ == "__main__":
+    main()
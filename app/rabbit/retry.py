@@ -0,0 +1,104 @@
+# Reintentos de los consumers con espera creciente, sin volver a encolar en
+# caliente.
+#
+# Por cada servicio se declaran colas de espera `{service}.retry.{n}s`, una
+# por escalón de CONSUMER_RETRY_DELAYS, con TTL y dead-letter hacia la cola
+# del servicio, más la cola final `{service}.parking`. Un mensaje que falla
+# se publica en el escalón que corresponde a su número de intento; cuando
+# vence el TTL el broker lo devuelve a la cola del servicio. Tras el último
+# escalón, o si el mensaje no se puede interpretar, queda en el
+# estacionamiento hasta que se reenvía con:
+#
+#     python -m app.rabbit.replay debts
+import logging
+import os
+import pika
+
+CONSUMER_RETRY_DELAYS = [
+    float(delay) for delay in
+    os.getenv("CONSUMER_RETRY_DELAYS", "5,30,120,600").split(",")
+    if delay.strip()]
+
+# Encabezados con que viaja un mensaje reintentado
+ATTEMPT_HEADER = "x-attempt"
+ROUTING_KEY_HEADER = "x-original-routing-key"
+ERROR_HEADER = "x-last-error"
+
+
+def parking_queue(service):
+    return f"{service}.parking"
+
+
+def original_routing_key(method, properties):
+    """
+    Evento de un mensaje: al volver de una cola de espera llega con la
+    routing key de la cola del servicio y el evento original en un
+    encabezado.
+    """
+    headers = getattr(properties, "headers", None) or {}
+    return headers.get(ROUTING_KEY_HEADER) or method.routing_key
+
+
+class RetryRouter:
+    """Topología de reintentos de un servicio y a qué cola va cada fallo."""
+
+    def __init__(self, service, delays=None):
+        self.service = service
+        self.delays = CONSUMER_RETRY_DELAYS if delays is None else delays
+        self.logger = logging.getLogger("Consumer_Retry")
+
+    def delay_queue(self, index):
+        return f"{self.service}.retry.{self.delays[index]:g}s"
+
+    def queues(self):
+        """[(cola, argumentos)] de las colas de espera y el estacionamiento."""
+        queues = [(self.delay_queue(index), {
+            "x-message-ttl": int(delay * 1000),
+            # Vencido el TTL vuelve, por el exchange por defecto, a la cola
+            # del servicio
+            "x-dead-letter-exchange": "",
+            "x-dead-letter-routing-key": self.service,
+        }) for index, delay in enumerate(self.delays)]
+        queues.append((parking_queue(self.service), None))
+        return queues
+
+    def declare(self, channel):
+        for queue, arguments in self.queues():
+            channel.queue_declare(queue=queue, durable=True,
+                                  arguments=arguments)
+
+    def route(self, ch, method, properties, body, error, permanent=False):
+        """
+        Publica en la cola de espera del próximo intento (o en el
+        estacionamiento) una copia del mensaje fallido y confirma el
+        original.
+        """
+        headers = {key: value for key, value in
+                   (getattr(properties, "headers", None) or {}).items()
+                   if key != "x-death"}
+        attempt = int(headers.get(ATTEMPT_HEADER, 0)) + 1
+        headers.update({
+            ATTEMPT_HEADER: attempt,
+            ROUTING_KEY_HEADER: original_routing_key(method, properties),
+            ERROR_HEADER: str(error)[:500],
+        })
+        if permanent or attempt > len(self.delays):
+            queue = parking_queue(self.service)
+        else:
+            queue = self.delay_queue(attempt - 1)
+
+        ch.basic_publish(
+            exchange="",
+            routing_key=queue,
+            body=body,
+            properties=pika.BasicProperties(
+                delivery_mode=2,
+                content_type="application/json",
+                message_id=getattr(properties, "message_id", None),
+                headers=headers,
+            ),
+        )
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+        self.logger.info(
+            f"↪️ {headers[ROUTING_KEY_HEADER]} (intento {attempt}) -> {queue}")
+        return queue
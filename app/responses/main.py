@@ -0,0 +1,75 @@
+# Respuestas JSON de los listados sin la validación de FastAPI.
+#
+# Con response_model FastAPI valida cada fila contra el modelo y la
+# serializa con jsonable_encoder + json estándar; en una página de 100
+# elementos eso es buena parte del CPU del request. Las filas de los
+# listados salen de nuestras propias proyecciones de Mongo, así que se
+# arman directamente con los campos del modelo y se serializan con orjson.
+# El endpoint conserva response_model para la documentación de OpenAPI.
+import os
+from typing import List, get_args
+import orjson
+from fastapi.responses import Response
+from pydantic import TypeAdapter
+
+# Con "true" las filas se validan igual, en lote, antes de serializar (para
+# pruebas o para encontrar documentos que no calzan con el modelo)
+RESPONSE_VALIDATION = os.getenv(
+    "RESPONSE_VALIDATION", "false").lower() == "true"
+
+_fields = {}
+_adapters = {}
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content):
+        # orjson serializa datetime en ISO 8601, igual que FastAPI
+        return orjson.dumps(content, default=str)
+
+
+def _is_float(annotation):
+    # float u Optional[float]
+    if annotation is float:
+        return True
+    args = [arg for arg in get_args(annotation) if arg is not type(None)]
+    return args == [float]
+
+
+def _model_fields(model):
+    fields = _fields.get(model)
+    if fields is None:
+        fields = _fields[model] = [
+            (name, None if field.is_required() else field.get_default(),
+             _is_float(field.annotation))
+            for name, field in model.model_fields.items()]
+    return fields
+
+
+def _float(value):
+    # Un monto guardado como entero sale 2000.0, como lo serializa el modelo
+    return float(value) if type(value) is int else value
+
+
+def _adapter(model):
+    adapter = _adapters.get(model)
+    if adapter is None:
+        adapter = _adapters[model] = TypeAdapter(List[model])
+    return adapter
+
+
+def trusted_rows(model, rows):
+    """
+    Filas de `model` a partir de documentos propios: sólo los campos del
+    modelo, con su valor por defecto si faltan, sin validar tipos (salvo
+    los enteros de los campos float, que pasan a float).
+    """
+    if RESPONSE_VALIDATION:
+        adapter = _adapter(model)
+        return adapter.dump_python(adapter.validate_python(rows))
+    fields = _model_fields(model)
+    return [{name: _float(row.get(name, default)) if is_float
+             else row.get(name, default)
+             for name, default, is_float in fields}
+            for row in rows]
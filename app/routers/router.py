@@ -1,8 +1,26 @@
 from fastapi import APIRouter, HTTPException
+from ..rabbit.main import publisher_stats as get_publisher_stats
+from ..outbox.main import relay_stats
+from ..cache.main import cache_stats as get_cache_stats
 
 prefix = "/api/v1"
 
 router = APIRouter(
     prefix=prefix,
     tags=["api"],
-)
\ No newline at end of file
+)
+
+
+@router.get("/rabbit/publisher/stats", summary="Estadísticas del pool de publicación de RabbitMQ", tags=["GET"])
+def publisher_stats():
+    return get_publisher_stats()
+
+
+@router.get("/outbox/stats", summary="Estado del relay del outbox de eventos", tags=["GET"])
+def outbox_stats():
+    return relay_stats()
+
+
+@router.get("/cache/stats", summary="Aciertos, fallos y tamaño de la caché de lecturas", tags=["GET"])
+def cache_stats():
+    return get_cache_stats()
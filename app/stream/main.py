@@ -0,0 +1,311 @@
+# Lectura incremental de cuerpos grandes (cargas masivas): filas NDJSON, CSV
+# o un arreglo JSON, sin esperar el cuerpo completo ni tenerlo entero en
+# memoria. También la escritura por trozos de las exportaciones.
+import codecs
+import csv
+from datetime import datetime
+import io
+import json
+import os
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson",
+                "application/jsonl", "application/x-jsonlines")
+CSV_TYPES = ("text/csv", "application/csv")
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+# Documentos por viaje a Mongo en las exportaciones
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+# Tamaño máximo (en caracteres) de una fila de una carga masiva (elemento del
+# arreglo JSON, línea NDJSON o registro CSV); una más grande corta la lectura
+# en vez de acumular el resto del cuerpo esperando a que cierre
+IMPORT_MAX_ROW_SIZE = int(os.getenv("IMPORT_MAX_ROW_SIZE", str(1024 * 1024)))
+# Un elemento cortado por el final del trozo falla a pocos caracteres del
+# final (un literal, un número o un escape \uXXXX incompletos); un error
+# más atrás es un elemento mal formado
+_TRUNCATED_WINDOW = 16
+# Errores por fila que devuelve una carga masiva; del resto sólo se cuentan
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+
+_decoder = json.JSONDecoder()
+
+
+def _media_type(content_type):
+    return content_type.split(";")[0].strip().lower()
+
+
+def is_ndjson(content_type):
+    return _media_type(content_type) in NDJSON_TYPES
+
+
+def is_csv(content_type):
+    return _media_type(content_type) in CSV_TYPES
+
+
+async def _text_chunks(request):
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    async for chunk in request.stream():
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+
+class RowTooLarge(Exception):
+    """Una fila de la carga masiva supera IMPORT_MAX_ROW_SIZE caracteres."""
+
+
+def _too_large_error():
+    return f"La fila supera el máximo de {IMPORT_MAX_ROW_SIZE} caracteres"
+
+
+async def _lines(request):
+    """
+    Líneas del cuerpo, sin el salto. Lo pendiente de una línea sin terminar
+    se guarda en partes (sin volver a partir lo ya leído) y una línea de más
+    de IMPORT_MAX_ROW_SIZE caracteres corta la lectura con RowTooLarge.
+    """
+    parts = []
+    size = 0
+    async for text in _text_chunks(request):
+        *lines, rest = text.split("\n")
+        if lines:
+            parts.append(lines[0])
+            lines[0] = "".join(parts)
+            for line in lines:
+                if len(line) > IMPORT_MAX_ROW_SIZE:
+                    raise RowTooLarge()
+                yield line
+            parts = [rest]
+            size = len(rest)
+        else:
+            parts.append(rest)
+            size += len(rest)
+        if size > IMPORT_MAX_ROW_SIZE:
+            raise RowTooLarge()
+    if size:
+        yield "".join(parts)
+
+
+async def _ndjson_rows(request):
+    index = 0
+    async for line in _lines(request):
+        if line.strip():
+            yield index, line
+            index += 1
+
+
+async def _csv_records(request):
+    # Un registro CSV puede ocupar varias líneas si un campo entre comillas
+    # tiene saltos de línea: se junta hasta que las comillas queden pares,
+    # contándolas por línea a medida que llegan
+    record = []
+    size = 0
+    quotes = 0
+    async for line in _lines(request):
+        record.append(line)
+        size += len(line) + 1
+        quotes += line.count('"')
+        if quotes % 2 == 0:
+            yield "\n".join(record) + "\n"
+            record = []
+            size = 0
+        elif size > IMPORT_MAX_ROW_SIZE:
+            raise RowTooLarge()
+    if record and "".join(record).strip():
+        yield "\n".join(record)
+
+
+async def _csv_rows(request):
+    """
+    Filas CSV como diccionarios según la primera línea (encabezado); los
+    campos vacíos quedan en None.
+    """
+    header = None
+    index = 0
+    try:
+        async for record in _csv_records(request):
+            if header is None:
+                # BOM de los CSV exportados desde planillas
+                record = record.lstrip("\ufeff")
+            try:
+                values = next(csv.reader([record]), [])
+            except csv.Error as e:
+                yield index, None, f"CSV inválido: {e}"
+                index += 1
+                continue
+            if not any(value.strip() for value in values):
+                continue
+            if header is None:
+                header = [value.strip() for value in values]
+                continue
+            if len(values) != len(header):
+                yield index, None, (f"Se esperaban {len(header)} columnas y "
+                                    f"hay {len(values)}")
+            else:
+                yield index, {name: value if value != "" else None
+                              for name, value in zip(header, values)}, None
+            index += 1
+    except RowTooLarge:
+        yield index, None, _too_large_error()
+
+
+def _malformed(error, size):
+    """Si el error de decodificación no se explica por un corte del trozo."""
+    if error.msg.startswith("Unterminated string"):
+        return False
+    return error.pos < size - _TRUNCATED_WINDOW
+
+
+async def iter_rows(request):
+    """
+    Genera (índice, fila, error) por cada elemento del cuerpo. Con
+    Content-Type NDJSON cada línea es una fila y con text/csv cada registro
+    después del encabezado; si no, se espera un arreglo JSON y se decodifica
+    elemento por elemento a medida que llega. Una fila NDJSON o CSV inválida
+    sólo afecta a esa fila; un arreglo mal formado o sin cerrar, o una fila
+    de más de IMPORT_MAX_ROW_SIZE caracteres en cualquier formato, corta la
+    lectura con un último error.
+    """
+    content_type = request.headers.get("content-type", "")
+    if is_csv(content_type):
+        async for row in _csv_rows(request):
+            yield row
+        return
+
+    if is_ndjson(content_type):
+        index = 0
+        try:
+            async for index, line in _ndjson_rows(request):
+                try:
+                    yield index, json.loads(line), None
+                except ValueError as e:
+                    yield index, None, f"JSON inválido: {e}"
+                index += 1
+        except RowTooLarge:
+            yield index, None, _too_large_error()
+        return
+
+    buffer = ""
+    position = 0
+    index = 0
+    started = False
+    async for text in _text_chunks(request):
+        buffer = buffer[position:] + text
+        position = 0
+        while True:
+            # Saltar espacios y separadores hasta el próximo elemento
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position >= len(buffer):
+                break
+            if not started:
+                if buffer[position] != "[":
+                    yield index, None, "Se esperaba un arreglo JSON o NDJSON"
+                    return
+                started = True
+                position += 1
+                continue
+            if buffer[position] == "]":
+                return
+            try:
+                row, end = _decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as e:
+                if _malformed(e, len(buffer)):
+                    yield index, None, f"Arreglo JSON inválido: {e.msg}"
+                    return
+                if len(buffer) - position > IMPORT_MAX_ROW_SIZE:
+                    yield index, None, _too_large_error()
+                    return
+                # Elemento incompleto: esperar el siguiente trozo
+                break
+            if (end == len(buffer) and isinstance(row, (int, float))
+                    and not isinstance(row, bool)):
+                # Un número pegado al final puede seguir en el próximo trozo
+                break
+            yield index, row, None
+            index += 1
+            position = end
+    # El cuerpo terminó sin el "]" final: una subida cortada no debe
+    # parecer una importación completa
+    if buffer[position:].strip():
+        yield index, None, "Arreglo JSON incompleto o inválido"
+    elif not started:
+        yield index, None, "Se esperaba un arreglo JSON o NDJSON"
+    else:
+        yield index, None, "Arreglo JSON incompleto: falta el ] final"
+
+
+async def chunked(rows, size):
+    """Agrupa un generador asíncrono en listas de hasta `size` elementos."""
+    chunk = []
+    async for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class ImportErrors:
+    """
+    Errores por fila de una carga masiva: guarda los primeros `limit` y del
+    resto sólo lleva la cuenta, para que un archivo con millones de filas
+    inválidas no arme una respuesta del tamaño del archivo.
+    """
+
+    def __init__(self, limit=IMPORT_MAX_ERRORS):
+        self.limit = limit
+        self.errors = []
+        self.count = 0
+
+    def add(self, error):
+        self.count += 1
+        if len(self.errors) < self.limit:
+            self.errors.append(error)
+
+    def extend(self, errors):
+        for error in errors:
+            self.add(error)
+
+    def report(self):
+        return {
+            "failed": self.count,
+            "errors": self.errors,
+            "errors_truncated": self.count > len(self.errors)
+        }
+
+
+def _export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def export_lines(rows, fields, output, token, rows_per_chunk=500):
+    """
+    Serializa filas (posición, student_id, elemento) de una exportación como
+    NDJSON o CSV (con encabezado) en trozos de `rows_per_chunk` filas, para
+    un StreamingResponse. Cada fila lleva `resume_token` = token(posición):
+    si la descarga se corta, el de la última fila completa la continúa.
+    """
+    columns = ["student_id", *fields, "resume_token"]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if output == "csv":
+        writer.writerow(columns)
+    count = 0
+    for position, student_id, item in rows:
+        values = [student_id, *(_export_value(item.get(field))
+                                for field in fields), token(position)]
+        if output == "csv":
+            writer.writerow(["" if value is None else value
+                             for value in values])
+        else:
+            buffer.write(json.dumps(dict(zip(columns, values)),
+                                    default=str))
+            buffer.write("\n")
+        count += 1
+        if count % rows_per_chunk == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
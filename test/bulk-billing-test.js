@@ -0,0 +1,57 @@
+import http from "k6/http";
+import { check } from "k6";
+import { Counter } from "k6/metrics";
+
+// Facturación masiva contra POST /api/v1/debts/bulk: cada iteración envía
+// ROWS aranceles en NDJSON. `debts_stored` / duración = aranceles por
+// segundo del pod:
+//
+//     k6 run -e HOST=localhost -e ROWS=5000 test/bulk-billing-test.js
+
+export const options = {
+    scenarios: {
+        billing: {
+            executor: "shared-iterations",
+            vus: 2,
+            iterations: parseInt(__ENV.ITERATIONS || "20"),
+        },
+    },
+    summaryTrendStats: ["avg", "med", "p(95)", "max"],
+};
+
+const HOST = __ENV.HOST || "localhost";
+const ROWS = parseInt(__ENV.ROWS || "5000");
+const SEMESTER = __ENV.SEMESTER || "2025-1";
+const stored = new Counter("debts_stored");
+
+export default function () {
+    const prefix = `${__VU}-${__ITER}-${Date.now()}`;
+    const lines = [];
+    for (let i = 0; i < ROWS; i++) {
+        lines.push(JSON.stringify({
+            student_id: `${(i % 1000) + 1}`,
+            debt: {
+                debt_id: `BULK-${prefix}-${i}`,
+                type: "arancel",
+                amount: 150000,
+                month: "marzo",
+                semester: SEMESTER,
+                year: 2025,
+            },
+        }));
+    }
+
+    const response = http.post(`http://${HOST}:8003/api/v1/debts/bulk`,
+        lines.join("\n"), {
+            headers: { "Content-Type": "application/x-ndjson" },
+            timeout: "120s",
+        });
+
+    check(response, {
+        "status is 200": (r) => r.status === 200,
+        "no row errors": (r) => r.status === 200 && r.json("failed") === 0,
+    });
+    if (response.status === 200) {
+        stored.add(response.json("stored"));
+    }
+}
@@ -0,0 +1,134 @@
+"""
+Compara mensajes/segundo del consumer de aranceles en modo "direct" (escribe
+en Mongo con las funciones del servicio) y "http" (reenvía a la API), con el
+runtime de hilos (Consumer) y el de asyncio (AsyncConsumer).
+
+Los eventos `debts.<id>.created` se entregan directamente al callback del
+consumer, sin pasar por RabbitMQ, usando el mismo número de workers que el
+Consumer. Ejecutar dentro del stack de compose, por ejemplo:
+
+    docker compose exec debt-consumer python test/consumer-benchmark.py --messages 2000
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+from app.debt import consumer  # noqa: E402
+from app.rabbit.main import CONSUMER_WORKERS  # noqa: E402
+
+
+class FakeChannel:
+    def __init__(self):
+        self.acks = 0
+        self._lock = threading.Lock()
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        with self._lock:
+            self.acks += 1
+
+
+class FakeMethod:
+    def __init__(self, routing_key, delivery_tag):
+        self.routing_key = routing_key
+        self.delivery_tag = delivery_tag
+        self.redelivered = False
+
+
+def build_events(messages, students):
+    run_id = uuid.uuid4().hex[:8]
+    events = []
+    for i in range(messages):
+        debt_id = f"BENCH-{run_id}-{i}"
+        body = {
+            "origin_service": "benchmark",
+            "student_id": f"bench-{run_id}-{i % students}",
+            "data": {
+                "debt_id": debt_id,
+                "type": "arancel",
+                "amount": 1500.0,
+                "month": "marzo",
+                "semester": "2024-1",
+                "year": 2024,
+                "description": "benchmark",
+            },
+        }
+        events.append((f"debts.{debt_id}.created",
+                       json.dumps(body).encode()))
+    return events
+
+
+def run(transport, messages, students, workers):
+    consumer.callback.transport = transport
+    channel = FakeChannel()
+    events = build_events(messages, students)
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(
+            lambda item: consumer.callback(
+                channel, FakeMethod(item[1][0], item[0]), None, item[1][1]),
+            enumerate(events)))
+    # Aplica el último lote parcial sin esperar la ventana
+    consumer.callback.batcher.flush()
+    while channel.acks < len(events):
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    return channel.acks, elapsed
+
+
+async def run_async(transport, messages, students, concurrency):
+    consumer.callback.transport = transport
+    channel = FakeChannel()
+    events = build_events(messages, students)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(limits=httpx.Limits(
+            max_connections=concurrency)) as client:
+        async def handle(tag, event):
+            async with semaphore:
+                await consumer.callback.run_async(
+                    channel, FakeMethod(event[0], tag), None, event[1],
+                    client)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(handle(tag, event)
+                               for tag, event in enumerate(events)))
+        elapsed = time.perf_counter() - start
+    return channel.acks, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--students", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=CONSUMER_WORKERS)
+    parser.add_argument("--transports", nargs="+",
+                        default=["http", "direct"])
+    parser.add_argument("--runtimes", nargs="+",
+                        default=["threads", "asyncio"])
+    args = parser.parse_args()
+
+    print(f"{'runtime':<8} {'transport':<10} {'messages':>9} "
+          f"{'seconds':>9} {'msg/s':>9}")
+    for runtime in args.runtimes:
+        for transport in args.transports:
+            if runtime == "asyncio":
+                acks, elapsed = asyncio.run(run_async(
+                    transport, args.messages, args.students, args.workers))
+            else:
+                acks, elapsed = run(transport, args.messages, args.students,
+                                    args.workers)
+            print(f"{runtime:<8} {transport:<10} {acks:>9} {elapsed:>9.2f} "
+                  f"{acks / elapsed:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import http from "k6/http";
+import { check } from "k6";
+
+// Lecturas concurrentes contra los endpoints async de aranceles y pagos.
+// Ejecutar antes y después de un cambio y comparar el p(99):
+//
+//     k6 run -e HOST=localhost test/read-latency-test.js
+
+export const options = {
+    scenarios: {
+        reads: {
+            executor: "constant-vus",
+            vus: 50,
+            duration: "1m",
+        },
+    },
+    summaryTrendStats: ["avg", "med", "p(95)", "p(99)", "max"],
+    thresholds: {
+        "http_req_duration{service:debt}": ["p(99)<500"],
+        "http_req_duration{service:payment}": ["p(99)<500"],
+    },
+};
+
+const HOST = __ENV.HOST || "localhost";
+const STUDENTS = parseInt(__ENV.STUDENTS || "1000");
+
+export default function () {
+    const student_id = Math.floor(Math.random() * STUDENTS) + 1;
+
+    const responses = http.batch([
+        ["GET", `http://${HOST}:8003/api/v1/${student_id}/debts`, null,
+            { tags: { service: "debt" } }],
+        ["GET", `http://${HOST}:8002/api/v1/${student_id}/payments`, null,
+            { tags: { service: "payment" } }],
+    ]);
+
+    for (const response of responses) {
+        check(response, {
+            "status is 200 or 404": (r) => r.status === 200 || r.status === 404,
+        });
+    }
+}
@@ -0,0 +1,81 @@
+# CPU por request de un listado de aranceles según cómo se arma la
+# respuesta: con response_model (FastAPI valida cada fila y serializa con
+# jsonable_encoder) o con FastJSONResponse + trusted_rows (orjson, sin
+# validar). No necesita Mongo: sirve una página fija desde un app FastAPI
+# en memoria.
+#
+#     python test/response-benchmark.py --sizes 10 100 --repeat 500
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.debt.main import DebtResponse, PaginatedDebtsResponse  # noqa: E402
+from app.responses.main import FastJSONResponse, trusted_rows  # noqa: E402
+
+
+def debt(index):
+    return {
+        "debt_id": f"DEBT-{index}",
+        "type": "arancel",
+        "amount": 1500.0,
+        "month": "marzo",
+        "semester": "2024-1",
+        "year": 2024,
+        "status": "active",
+        "paid": index % 2 == 0,
+        "description": "Arancel del semestre",
+        "created_at": datetime(2024, 1, 1) + timedelta(minutes=index),
+    }
+
+
+def benchmark_app(debts):
+    app = FastAPI()
+
+    @app.get("/model", response_model=PaginatedDebtsResponse)
+    def model_page():
+        return PaginatedDebtsResponse(
+            total=len(debts), page=1, page_size=len(debts), debts=debts,
+            next_cursor=None)
+
+    @app.get("/fast", response_model=PaginatedDebtsResponse)
+    def fast_page():
+        return FastJSONResponse({
+            "total": len(debts), "page": 1, "page_size": len(debts),
+            "debts": trusted_rows(DebtResponse, debts), "next_cursor": None})
+
+    return app
+
+
+def cpu_per_request(client, path, repeat):
+    client.get(path)
+    started = time.process_time()
+    for _ in range(repeat):
+        client.get(path)
+    return (time.process_time() - started) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100],
+                        help="elementos por página")
+    parser.add_argument("--repeat", type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"{'items':>6}{'model ms':>12}{'fast ms':>12}{'ahorro':>9}")
+    for size in args.sizes:
+        client = TestClient(benchmark_app([debt(i) for i in range(size)]))
+        model = cpu_per_request(client, "/model", args.repeat)
+        fast = cpu_per_request(client, "/fast", args.repeat)
+        print(f"{size:>6}{model:>12.3f}{fast:>12.3f}"
+              f"{(1 - fast / model) * 100:>8.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# Compara los dos STORAGE_LAYOUT ("embedded" e "items") según la cantidad de
+# elementos por estudiante: lectura de un elemento, primera página del
+# listado, página por cursor y agregar un elemento. Necesita un MongoDB real
+# (MONGO_URL) y usa una base aparte que borra al terminar:
+#
+#     python test/storage-benchmark.py --sizes 10 100 1000 5000
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.migrations.main import Migration, _items_indexes  # noqa: E402
+from app.mongo.items import ItemStore, PageQuery, find_page  # noqa: E402
+from app.mongo.main import get_client  # noqa: E402
+
+DATABASE = "storage_benchmark"
+FIELDS = ["debt_id", "amount", "status", "created_at"]
+
+
+def item(student, index):
+    return {
+        "debt_id": f"{student}-{index}",
+        "type": "arancel",
+        "amount": 1500.0,
+        "month": "marzo",
+        "semester": "2024-1",
+        "year": 2024,
+        "status": "actived" if index % 3 else "inactived",
+        "created_at": datetime(2024, 1, 1) + timedelta(minutes=index),
+    }
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1]
+
+
+def bench(layout, size, students, repeat):
+    store = ItemStore(DATABASE, "students", "debts", "debt_id", "debt_items",
+                      layout=layout)
+    for student in range(students):
+        store.add(f"s{student}", [item(f"s{student}", i)
+                                  for i in range(size)])
+
+    target = f"s{students // 2}"
+    first_page = find_page(PageQuery(store, target, FIELDS, page_size=20))
+    counter = iter(range(size, size + repeat))
+    return {
+        "find_item": timed(lambda: store.find_item(
+            target, f"{target}-{size // 2}", FIELDS), repeat),
+        "page": timed(lambda: find_page(PageQuery(
+            store, target, FIELDS, {"status": "actived"}, page_size=20)),
+            repeat),
+        "cursor": timed(lambda: find_page(PageQuery(
+            store, target, FIELDS, page_size=20, cursor=first_page[3])),
+            repeat),
+        "add": timed(lambda: store.add(
+            target, [item(target, next(counter))]), repeat),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[10, 100, 1000, 5000],
+                        help="elementos por estudiante")
+    parser.add_argument("--students", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    client = get_client()
+    print(f"{'layout':<9}{'items':>7}  "
+          + "  ".join(f"{op + ' p50/p99 ms':>24}"
+                      for op in ["find_item", "page", "cursor", "add"]))
+    try:
+        for size in args.sizes:
+            for layout in ["embedded", "items"]:
+                client.drop_database(DATABASE)
+                db = client[DATABASE]
+                Migration(0, "benchmark", [
+                    ("students", [("student_id", 1)], {"unique": True}),
+                    *_items_indexes("debt_items", "debt_id", "created_at"),
+                ]).apply(db)
+                results = bench(layout, size, args.students, args.repeat)
+                print(f"{layout:<9}{size:>7}  " + "  ".join(
+                    f"{p50:>11.2f}/{p99:<12.2f}"
+                    for p50, p99 in results.values()))
+    finally:
+        client.drop_database(DATABASE)
+
+
+if __name__ == "__main__":
+    main()